@@ -0,0 +1,19 @@
+# Generated by Django 5.2.8 on 2026-10-19 06:51
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('appointments', '0004_alter_appointment_unique_together_and_more'),
+        ('doctors', '0008_alter_doctorschedule_session'),
+        ('patients', '0005_patient_other_risk_notes'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='appointment',
+            index=models.Index(fields=['doctor', 'date', 'status'], name='appointment_doctor__488913_idx'),
+        ),
+    ]
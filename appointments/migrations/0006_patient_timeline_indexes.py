@@ -0,0 +1,19 @@
+# Generated by Django 5.2.8 on 2026-10-19 07:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('appointments', '0005_hot_path_indexes'),
+        ('doctors', '0008_alter_doctorschedule_session'),
+        ('patients', '0007_chart_number_sequence'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='appointment',
+            index=models.Index(fields=['patient', 'date', 'id'], name='appointment_patient_a74038_idx'),
+        ),
+    ]
@@ -104,6 +104,12 @@ class Appointment(models.Model):
                 name="uniq_active_doctor_date_time",
             )
         ]
+        indexes = [
+            # get_available_slots / doctor_panel：某醫師某天的掛號
+            models.Index(fields=["doctor", "date", "status"]),
+            # 病人時間軸（patients.timeline）依 (date, id) 往回翻
+            models.Index(fields=["patient", "date", "id"]),
+        ]
 
     def clean(self):
         leave = DoctorLeave.objects.filter(
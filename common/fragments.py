@@ -0,0 +1,51 @@
+"""
+模板片段快取（{% cache ... using="fragments" %}）用的版本戳記。
+
+片段的 key 帶著相關資料的版本號；model 寫入時 bump 版本，舊片段就不會再被讀到，
+放著等過期即可，不用去找出所有 vary 組合逐一刪除。
+"""
+
+import time
+
+from django.core.cache import caches
+from django.db import transaction
+
+FRAGMENT_CACHE = "fragments"
+
+DOCTORS = "doctors"
+TICKETS = "tickets"
+DRUGS = "drugs"
+STOCK = "stock"
+PRESCRIPTIONS = "prescriptions"
+# 不是模板片段：開處方過敏篩檢的自動機版本（藥名、學名、上下架、同義詞），見 prescriptions.screening
+FORMULARY = "formulary"
+
+
+def _key(name):
+    return f"fragver:{name}"
+
+
+def get_version(name):
+    cache = caches[FRAGMENT_CACHE]
+    version = cache.get(_key(name))
+    if version is None:
+        # 用時間當起始值：版本號被 evict 後重建，也不會剛好撞回舊片段的版本
+        cache.add(_key(name), time.time_ns(), None)
+        version = cache.get(_key(name), time.time_ns())
+    return version
+
+
+def _bump(names):
+    cache = caches[FRAGMENT_CACHE]
+    for name in names:
+        try:
+            cache.incr(_key(name))
+        except ValueError:
+            cache.set(_key(name), time.time_ns(), None)
+
+
+def bump(*names):
+    # 跟 public.signals 一樣：當下先 bump，commit 後再 bump 一次，
+    # 避免別的 request 在 commit 前用舊資料算出片段、存在新版本號底下
+    _bump(names)
+    transaction.on_commit(lambda: _bump(names))
@@ -0,0 +1,454 @@
+import json
+import os
+import platform
+import queue
+import subprocess
+import tempfile
+import threading
+import time as time_mod
+from collections import defaultdict
+from contextlib import redirect_stdout
+from datetime import time, timedelta
+
+import django
+from django.conf import settings
+from django.contrib.auth.models import Group, User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections
+from django.test import Client
+from django.test.utils import override_settings, setup_test_environment, teardown_test_environment
+from django.urls import reverse
+from django.utils import timezone
+
+from appointments.models import Appointment
+from doctors.models import Doctor, DoctorSchedule
+from inventory.models import Drug, StockBatch
+from patients.models import Patient
+from prescriptions.models import Prescription
+from public.models import ClinicProfile
+from queues.models import VisitTicket
+
+BENCH_STORAGES = {
+    "default": {"BACKEND": "django.core.files.storage.FileSystemStorage"},
+    "staticfiles": {"BACKEND": "django.contrib.staticfiles.storage.StaticFilesStorage"},
+}
+
+# 量測時用行程內的快取：CACHE_URL 指到正式的 redis 時，不能把測試資料、片段版本號寫進去，
+# 更不能清掉它（cached_db 的 session、登入驗證碼的防重送紀錄都在裡面）
+BENCH_CACHES = {
+    "default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache", "LOCATION": "bench-default"},
+    "fragments": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache", "LOCATION": "bench-fragments"},
+}
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    k = max(0, min(len(sorted_values) - 1, int(round(pct / 100 * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[k]
+
+
+class StepStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.samples = defaultdict(list)
+        self.errors = defaultdict(int)
+        self.error_samples = defaultdict(set)
+        self.wall = {}
+
+    def record(self, step, seconds, ok, detail=""):
+        with self._lock:
+            self.samples[step].append(seconds)
+            if not ok:
+                self.errors[step] += 1
+                if len(self.error_samples[step]) < 5:
+                    self.error_samples[step].add(detail)
+
+    def summary(self):
+        out = {}
+        for step, values in self.samples.items():
+            values = sorted(values)
+            wall = self.wall.get(step) or sum(values)
+            out[step] = {
+                "count": len(values),
+                "errors": self.errors[step],
+                "wall_s": round(wall, 3),
+                "throughput_rps": round(len(values) / wall, 2) if wall else 0.0,
+                "mean_ms": round(sum(values) / len(values) * 1000, 2),
+                "p50_ms": round(percentile(values, 50) * 1000, 2),
+                "p95_ms": round(percentile(values, 95) * 1000, 2),
+                "p99_ms": round(percentile(values, 99) * 1000, 2),
+                "max_ms": round(values[-1] * 1000, 2),
+                "error_samples": sorted(self.error_samples[step]),
+            }
+        return out
+
+
+class Command(BaseCommand):
+    help = (
+        "在獨立的測試資料庫上，用 Django test client 走完一整個門診日："
+        "線上掛號 → 櫃台掛號 → 叫號/看診/開處方 → 藥師審核 → 領藥確認，"
+        "輸出每一步的 throughput 與 p50/p95/p99，並存成 JSON 供版本間比較。"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--doctors", type=int, default=4)
+        parser.add_argument("--patients-per-doctor", type=int, default=30, help="每位醫師今日櫃台掛號數")
+        parser.add_argument("--public-registrations", type=int, default=40)
+        parser.add_argument("--items-per-prescription", type=int, default=3)
+        parser.add_argument("--drugs", type=int, default=50)
+        parser.add_argument("--concurrency", type=int, default=4, help="同時執行的 client 數")
+        parser.add_argument("--output", default="", help="結果 JSON 路徑（預設 bench_results/<時間>.json）")
+        parser.add_argument("--compare", default="", help="和之前的結果 JSON 比較")
+
+    def handle(self, *args, **opts):
+        self.opts = opts
+        self.stats = StepStats()
+
+        setup_test_environment()
+        old_name = self._create_db()
+        try:
+            with override_settings(
+                STORAGES=BENCH_STORAGES, CACHES=BENCH_CACHES, PROFILING_SLOW_LOG=None, METRICS_DIR="",
+            ):
+                self._seed()
+                # 部分 view 會 print 除錯訊息，量測期間先吞掉
+                with open(os.devnull, "w") as devnull, redirect_stdout(devnull):
+                    self._run_phase("public_register", self._public_register_tasks())
+                    self._run_phase("reception_book", self._booking_tasks())
+                    self._run_phase("doctor_visit", self._doctor_tasks(), concurrency=opts["doctors"])
+                    self._run_phase("pharmacy_review", self._review_tasks())
+                    self._run_phase("dispense_confirm", self._dispense_tasks())
+        finally:
+            connections.close_all()
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+
+        result = {
+            "meta": self._meta(),
+            "steps": self.stats.summary(),
+        }
+        self._print(result["steps"])
+        path = self._save(result)
+        self.stdout.write(self.style.SUCCESS(f"結果已存到 {path}"))
+
+        if opts["compare"]:
+            self._compare(result["steps"], opts["compare"])
+
+    # ------------------------------------------------------------------
+    # 測試資料庫
+
+    def _create_db(self):
+        old_name = connection.settings_dict["NAME"]
+        if connection.vendor == "sqlite":
+            # 檔案型 DB，多執行緒才會各自連線、真的互相競爭
+            fd, path = tempfile.mkstemp(prefix="bench_", suffix=".sqlite3")
+            os.close(fd)
+            connection.settings_dict.setdefault("TEST", {})["NAME"] = path
+        connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        return old_name
+
+    # ------------------------------------------------------------------
+    # 基本資料（不計時）
+
+    def _seed(self):
+        opts = self.opts
+        today = timezone.localdate()
+        self.today = today
+
+        groups = {n: Group.objects.create(name=n) for n in ("RECEPTION", "DOCTOR", "PHARMACY")}
+        self.reception_user = User.objects.create_user("bench_reception")
+        self.reception_user.groups.add(groups["RECEPTION"])
+        self.pharmacy_users = []
+        for i in range(max(1, opts["concurrency"])):
+            u = User.objects.create_user(f"bench_pharmacist_{i}")
+            u.groups.add(groups["PHARMACY"])
+            self.pharmacy_users.append(u)
+
+        ClinicProfile.objects.create(name="Benchmark Clinic", phone="0", address="-", opening_hours="-")
+
+        self.doctors = []
+        for i in range(opts["doctors"]):
+            user = User.objects.create_user(f"bench_doctor_{i}")
+            user.groups.add(groups["DOCTOR"])
+            doctor = Doctor.objects.create(name=f"Doctor {i}", department=f"Dept {i % 3}", room=str(i), user=user)
+            for weekday in range(7):
+                if weekday == today.weekday():
+                    # 今天開全天診，任何時間跑 benchmark 都有可掛時段
+                    DoctorSchedule.objects.create(
+                        doctor=doctor, weekday=weekday, session="AM",
+                        start_time=time(0, 0), end_time=time(12, 0), slot_minutes=5, max_patients=500,
+                    )
+                    DoctorSchedule.objects.create(
+                        doctor=doctor, weekday=weekday, session="PM",
+                        start_time=time(12, 0), end_time=time(23, 55), slot_minutes=5, max_patients=500,
+                    )
+                else:
+                    DoctorSchedule.objects.create(
+                        doctor=doctor, weekday=weekday, session="AM",
+                        start_time=time(9, 0), end_time=time(12, 0), slot_minutes=10, max_patients=18,
+                    )
+            self.doctors.append(doctor)
+
+        self.drugs = []
+        for i in range(opts["drugs"]):
+            drug = Drug.objects.create(code=f"BENCH{i:04d}", name=f"Bench drug {i}", stock_quantity=100_000)
+            StockBatch.objects.create(
+                drug=drug, batch_no=f"B{i}", quantity=100_000, expiry_date=today + timedelta(days=720),
+            )
+            self.drugs.append(drug)
+
+        self.booking_plan = []
+        for doctor in self.doctors:
+            slots = Appointment.objects.get_available_slots(doctor, today)
+            wanted = opts["patients_per_doctor"]
+            if len(slots) < wanted:
+                self.stderr.write(
+                    f"{doctor.name} 今日只剩 {len(slots)} 個可掛時段，掛號數降為 {len(slots)}"
+                )
+            for n, slot in enumerate(slots[:wanted]):
+                patient = Patient.objects.create(
+                    full_name=f"Bench patient {doctor.pk}-{n}",
+                    national_id=f"B{doctor.pk:03d}{n:06d}",
+                    birth_date=today - timedelta(days=365 * 40),
+                )
+                self.booking_plan.append((doctor, patient.chart_no, slot))
+
+    # ------------------------------------------------------------------
+    # 各步驟
+
+    def _timed(self, step, fn, expect_redirect=True):
+        # 例外（例如 SQLite 的 database is locked）也算一次失敗的請求，繼續跑後面的流程
+        start = time_mod.perf_counter()
+        try:
+            response = fn()
+        except Exception as e:  # noqa: BLE001
+            self.stats.record(step, time_mod.perf_counter() - start, False, repr(e))
+            return None
+        elapsed = time_mod.perf_counter() - start
+        ok = response.status_code < 400 and (not expect_redirect or response.status_code == 302)
+        self.stats.record(step, elapsed, ok, "" if ok else f"HTTP {response.status_code}")
+        return response
+
+    def _public_register_tasks(self):
+        # 未來 6 天的上午診 09:00–12:00、每 10 分鐘一格
+        days = [self.today + timedelta(days=d) for d in range(1, 7)]
+        free = {
+            (doc.pk, day): [f"{9 + k // 6:02d}:{k % 6 * 10:02d}" for k in range(18)]
+            for doc in self.doctors for day in days
+        }
+
+        plan = []
+        keys = list(free)
+        for n in range(self.opts["public_registrations"]):
+            doc_pk, day = keys[n % len(keys)]
+            if not free[(doc_pk, day)]:
+                break
+            plan.append((doc_pk, day, free[(doc_pk, day)].pop(0), n))
+
+        doctors = {d.pk: d for d in self.doctors}
+
+        def make(doc_pk, day, slot, n):
+            def task(client):
+                doctor = doctors[doc_pk]
+                self._timed("public_register", lambda: client.post(reverse("public:register"), {
+                    "department": doctor.department,
+                    "doctor_id": doctor.pk,
+                    "date": day.isoformat(),
+                    "time": f"AM|{slot}",
+                    "name": f"Online {n}",
+                    "national_id": f"Z{n:09d}",
+                    "birth_date": "1980-01-01",
+                    "phone": "0912000000",
+                }))
+            return task
+
+        return [(None, make(*p)) for p in plan]
+
+    def _booking_tasks(self):
+        def make(doctor, chart_no, slot):
+            def task(client):
+                self._timed("reception_book", lambda: client.post(reverse("appointments:book"), {
+                    "action": "confirm",
+                    "chart_no": chart_no,
+                    "doctor": doctor.pk,
+                    "appt_date": self.today.isoformat(),
+                    "appt_time": slot.strftime("%H:%M"),
+                }))
+            return task
+
+        return [(self.reception_user, make(*p)) for p in self.booking_plan]
+
+    def _doctor_tasks(self):
+        items = self.opts["items_per_prescription"]
+
+        def make(doctor, drug_offset):
+            def task(client):
+                panel = reverse("queues:doctor_panel")
+                while True:
+                    self._timed("call_next", lambda: client.post(panel, {"action": "call_next"}))
+                    ticket = VisitTicket.objects.filter(
+                        doctor=doctor, date=self.today, status=VisitTicket.STATUS_CALLING,
+                    ).first()
+                    if ticket is None:
+                        break
+
+                    url = reverse("prescriptions:edit_for_ticket", args=[ticket.pk])
+                    self._timed("prescribe_form", lambda: client.get(url), expect_redirect=False)
+                    data = {
+                        "notes": "",
+                        "items-TOTAL_FORMS": str(items),
+                        "items-INITIAL_FORMS": "0",
+                        "items-MIN_NUM_FORMS": "0",
+                        "items-MAX_NUM_FORMS": "1000",
+                    }
+                    for k in range(items):
+                        drug = self.drugs[(drug_offset + ticket.number + k) % len(self.drugs)]
+                        data.update({
+                            f"items-{k}-drug": drug.pk,
+                            f"items-{k}-quantity": "6",
+                            f"items-{k}-treatment_days": "3",
+                            f"items-{k}-usage": "TID",
+                        })
+                    self._timed("prescribe_save", lambda: client.post(url, data))
+                    self._timed("finish", lambda: client.post(panel, {"action": "finish", "ticket_id": ticket.pk}))
+            return task
+
+        return [(d.user, make(d, i)) for i, d in enumerate(self.doctors)]
+
+    def _review_tasks(self):
+        ids = list(
+            Prescription.objects
+            .filter(status=Prescription.STATUS_FINAL, verify_status=Prescription.VERIFY_PENDING)
+            .values_list("pk", flat=True)
+        )
+
+        def make(pk):
+            def task(client):
+                url = reverse("prescriptions:pharmacy_review_detail", args=[pk])
+                self._timed("review_detail", lambda: client.get(url), expect_redirect=False)
+                self._timed("review_approve", lambda: client.post(url, {"action": "approve", "verify_note": ""}))
+            return task
+
+        users = self.pharmacy_users
+        return [(users[i % len(users)], make(pk)) for i, pk in enumerate(ids)]
+
+    def _dispense_tasks(self):
+        ids = list(
+            Prescription.objects
+            .filter(verify_status=Prescription.VERIFY_APPROVED, pharmacy_status=Prescription.PHARMACY_PENDING)
+            .values_list("pk", flat=True)
+        )
+
+        def make(pk):
+            def task(client):
+                url = reverse("prescriptions:dispense_confirm", args=[pk])
+                self._timed("dispense_page", lambda: client.get(url), expect_redirect=False)
+                self._timed("dispense_confirm", lambda: client.post(url))
+                self._timed("pharmacy_panel", lambda: client.get(reverse("prescriptions:pharmacy_panel")), expect_redirect=False)
+            return task
+
+        users = self.pharmacy_users
+        return [(users[i % len(users)], make(pk)) for i, pk in enumerate(ids)]
+
+    # ------------------------------------------------------------------
+
+    def _run_phase(self, name, tasks, concurrency=None):
+        concurrency = max(1, concurrency or self.opts["concurrency"])
+        work = queue.Queue()
+        for t in tasks:
+            work.put(t)
+
+        steps_before = set(self.stats.samples)
+        errors = []
+
+        def worker():
+            clients = {}
+            try:
+                while True:
+                    try:
+                        user, task = work.get_nowait()
+                    except queue.Empty:
+                        return
+                    key = user.pk if user else None
+                    client = clients.get(key)
+                    if client is None:
+                        client = clients[key] = Client()
+                        if user:
+                            client.force_login(user)
+                    try:
+                        task(client)
+                    except Exception as e:  # noqa: BLE001 — 記錄後繼續跑完其他任務
+                        errors.append(f"{name}: {e!r}")
+            finally:
+                connections.close_all()
+
+        start = time_mod.perf_counter()
+        threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        wall = time_mod.perf_counter() - start
+
+        for step in set(self.stats.samples) - steps_before:
+            self.stats.wall[step] = wall
+        for e in errors[:5]:
+            self.stderr.write(e)
+        if errors:
+            self.stderr.write(f"{name}: {len(errors)} 個任務發生例外")
+
+    def _meta(self):
+        try:
+            rev = subprocess.run(
+                ["git", "rev-parse", "--short", "HEAD"],
+                cwd=settings.BASE_DIR, capture_output=True, text=True, timeout=5,
+            ).stdout.strip()
+        except (OSError, subprocess.SubprocessError):
+            rev = ""
+        return {
+            "git_rev": rev,
+            "timestamp": timezone.now().isoformat(),
+            "python": platform.python_version(),
+            "django": django.get_version(),
+            "db_vendor": connection.vendor,
+            "options": {k: v for k, v in self.opts.items() if k in (
+                "doctors", "patients_per_doctor", "public_registrations",
+                "items_per_prescription", "drugs", "concurrency",
+            )},
+        }
+
+    def _print(self, steps):
+        header = f"{'step':<18}{'n':>6}{'err':>5}{'rps':>9}{'p50':>9}{'p95':>9}{'p99':>9}"
+        self.stdout.write(header)
+        self.stdout.write("-" * len(header))
+        for step, s in steps.items():
+            self.stdout.write(
+                f"{step:<18}{s['count']:>6}{s['errors']:>5}{s['throughput_rps']:>9}"
+                f"{s['p50_ms']:>9}{s['p95_ms']:>9}{s['p99_ms']:>9}"
+            )
+
+    def _save(self, result):
+        path = self.opts["output"]
+        if not path:
+            directory = os.path.join(settings.BASE_DIR, "bench_results")
+            os.makedirs(directory, exist_ok=True)
+            path = os.path.join(directory, f"clinic_day_{timezone.now():%Y%m%d_%H%M%S}.json")
+        with open(path, "w", encoding="utf-8") as fp:
+            json.dump(result, fp, ensure_ascii=False, indent=2)
+        return path
+
+    def _compare(self, steps, path):
+        try:
+            with open(path, encoding="utf-8") as fp:
+                baseline = json.load(fp)["steps"]
+        except (OSError, ValueError, KeyError) as e:
+            raise CommandError(f"無法讀取比較基準 {path}: {e}")
+
+        self.stdout.write(f"\n與 {path} 比較（p95，負值代表變快）")
+        for step, s in steps.items():
+            base = baseline.get(step)
+            if not base or not base["p95_ms"]:
+                continue
+            delta = (s["p95_ms"] - base["p95_ms"]) / base["p95_ms"] * 100
+            self.stdout.write(f"  {step:<18}{base['p95_ms']:>9} -> {s['p95_ms']:>9} ms ({delta:+.1f}%)")
@@ -0,0 +1,126 @@
+import time as time_mod
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib.auth.models import Group, User
+from django.core.cache import caches
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client
+from django.test.utils import (
+    CaptureQueriesContext, override_settings, setup_test_environment, teardown_test_environment,
+)
+from django.urls import reverse
+from django.utils import timezone
+
+from doctors.models import Doctor
+from patients.models import Patient
+from queues.models import VisitTicket
+
+from .benchmark_clinic_day import BENCH_CACHES, BENCH_STORAGES, percentile
+
+
+class Command(BaseCommand):
+    help = (
+        "比較各 session backend 在櫃台叫號迴圈（叫號頁 → 叫下一號 → 回到叫號頁）"
+        "每個 request 的 query 數與回應時間。在獨立的測試資料庫上跑。"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--rounds", type=int, default=50, help="叫號幾次")
+        parser.add_argument(
+            "--backends", default=",".join(settings.SESSION_BACKENDS),
+            help=f"要比較的 backend，逗號分隔（{', '.join(settings.SESSION_BACKENDS)}）",
+        )
+
+    def handle(self, *args, **opts):
+        backends = [b.strip() for b in opts["backends"].split(",") if b.strip()]
+        unknown = set(backends) - set(settings.SESSION_BACKENDS)
+        if unknown:
+            raise CommandError(f"不支援的 backend：{', '.join(sorted(unknown))}")
+
+        setup_test_environment()
+        old_name = connection.settings_dict["NAME"]
+        connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            with override_settings(
+                STORAGES=BENCH_STORAGES, CACHES=BENCH_CACHES, PROFILING_SLOW_LOG=None, METRICS_DIR="",
+            ):
+                self._seed(opts["rounds"])
+                results = {}
+                for backend in backends:
+                    with override_settings(SESSION_ENGINE=f"django.contrib.sessions.backends.{backend}"):
+                        results[backend] = self._run(opts["rounds"])
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+
+        self._print(results)
+
+    def _seed(self, rounds):
+        today = timezone.localdate()
+        group = Group.objects.create(name="RECEPTION")
+        self.user = User.objects.create_user("bench_reception")
+        self.user.groups.add(group)
+        self.doctor = Doctor.objects.create(name="Bench doctor", department="內科", room="1")
+        for n in range(1, rounds + 1):
+            patient = Patient.objects.create(
+                full_name=f"Bench patient {n}", national_id=f"S{n:09d}",
+                birth_date=today - timedelta(days=365 * 40),
+            )
+            VisitTicket.objects.create(patient=patient, doctor=self.doctor, date=today, number=n)
+
+    def _run(self, rounds):
+        VisitTicket.objects.update(status=VisitTicket.STATUS_WAITING, called_at=None, finished_at=None)
+        # 只清 BENCH_CACHES 的行程內快取，每個 backend 都從空的快取開始量
+        caches["default"].clear()
+        client = Client()
+        client.force_login(self.user)
+        url = reverse("queues:reception_call") + f"?doctor={self.doctor.pk}"
+
+        timings, queries, session_queries = [], 0, 0
+        requests = [
+            lambda: client.get(url),
+            lambda: client.post(url, {"action": "start_next", "doctor": self.doctor.pk}),
+        ]
+        for _ in range(rounds):
+            for send in requests:
+                start = time_mod.perf_counter()
+                with CaptureQueriesContext(connection) as ctx:
+                    response = send()
+                timings.append(time_mod.perf_counter() - start)
+                if response.status_code >= 400:
+                    raise CommandError(f"{url} -> HTTP {response.status_code}")
+                queries += len(ctx.captured_queries)
+                session_queries += sum("django_session" in q["sql"] for q in ctx.captured_queries)
+
+        timings.sort()
+        n = len(timings)
+        return {
+            "requests": n,
+            "queries_per_request": queries / n,
+            "session_queries_per_request": session_queries / n,
+            "p50_ms": percentile(timings, 50) * 1000,
+            "p95_ms": percentile(timings, 95) * 1000,
+        }
+
+    def _print(self, results):
+        header = f"{'backend':<16}{'requests':>9}{'q/req':>8}{'session q/req':>15}{'p50':>9}{'p95':>9}"
+        self.stdout.write(header)
+        self.stdout.write("-" * len(header))
+        for backend, r in results.items():
+            self.stdout.write(
+                f"{backend:<16}{r['requests']:>9}{r['queries_per_request']:>8.2f}"
+                f"{r['session_queries_per_request']:>15.2f}{r['p50_ms']:>9.2f}{r['p95_ms']:>9.2f}"
+            )
+
+        base = results.get("db")
+        if base and base["queries_per_request"]:
+            for backend, r in results.items():
+                if backend == "db":
+                    continue
+                saved = base["queries_per_request"] - r["queries_per_request"]
+                self.stdout.write(
+                    f"{backend}: 每個 request 少 {saved:.2f} 個 query"
+                    f"（{saved / base['queries_per_request'] * 100:.0f}%）"
+                )
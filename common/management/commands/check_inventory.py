@@ -0,0 +1,41 @@
+from django.core.management.base import BaseCommand
+
+from inventory.consistency import check_inventory, repair_inventory
+
+
+class Command(BaseCommand):
+    help = (
+        "對帳：藥品總量、批次加總、異動紀錄加總三層互相比對，列出對不起來的藥品和批次。"
+        "加 --repair 以批次為準補校正異動、改藥品總量，沒有批次的庫存移到隔離中的暫存批次。建議用 cron 每晚跑一次。"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--repair", action="store_true", help="補校正異動並修正藥品總量")
+
+    def handle(self, *args, **opts):
+        if opts["repair"]:
+            report, created = repair_inventory()
+        else:
+            report, created = check_inventory(), 0
+
+        for d in report.batches:
+            self.stdout.write(
+                f"批次\t{d.batch_id}\t{d.batch_no or '-'}\t庫存 {d.quantity}\t異動加總 {d.ledger}\t差 {d.diff:+d}"
+            )
+        for d in report.drugs:
+            self.stdout.write(
+                f"藥品\t{d.code}\t{d.name}\t總量 {d.stock_quantity}\t批次加總 {d.batch_total}"
+                f"\t異動加總 {d.ledger_total}（無批次 {d.unbatched:+d}）"
+                + ("\t需人工確認" if d.needs_review else "")
+            )
+        for reason, n in sorted(report.unknown_reasons.items()):
+            self.stdout.write(self.style.WARNING(f"異動原因不在選項內：{reason}（{n} 筆）"))
+
+        summary = (
+            f"檢查 {report.checked_drugs} 種藥品、{report.checked_batches} 個批次："
+            f"{len(report.drugs)} 種藥品、{len(report.batches)} 個批次對不起來"
+        )
+        if opts["repair"]:
+            summary += f"；已補 {created} 筆校正異動"
+        style = self.style.SUCCESS if report.ok or opts["repair"] else self.style.WARNING
+        self.stdout.write(style(summary))
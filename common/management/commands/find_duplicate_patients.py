@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand
+
+from patients.dedup import DEFAULT_THRESHOLD, MAX_BLOCK, find_duplicates, refresh_review_queue
+
+
+class Command(BaseCommand):
+    help = (
+        "批次找出疑似重複的病人（生日相同，且電話相同或姓名相近），"
+        "放進病人列表「疑似重複」的審核佇列。"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD, help="相似度門檻（0~1）")
+        parser.add_argument("--max-block", type=int, default=MAX_BLOCK, help="區塊超過這麼多人就略過")
+        parser.add_argument("--dry-run", action="store_true", help="只列出配對，不寫入審核佇列")
+
+    def handle(self, *args, **opts):
+        matches = find_duplicates(threshold=opts["threshold"], max_block=opts["max_block"])
+
+        if opts["dry_run"]:
+            count = 0
+            for m in matches:
+                count += 1
+                self.stdout.write(f"{m.patient_a_id}\t{m.patient_b_id}\t{m.score:.3f}\t{'、'.join(m.reasons)}")
+            self.stdout.write(self.style.SUCCESS(f"找到 {count} 組疑似重複"))
+            return
+
+        created = refresh_review_queue(matches)
+        self.stdout.write(self.style.SUCCESS(f"審核佇列新增 {created} 組疑似重複"))
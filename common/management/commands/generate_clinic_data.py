@@ -0,0 +1,377 @@
+import random
+import time as time_mod
+from collections import defaultdict
+from contextlib import contextmanager
+from datetime import datetime, time, timedelta
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from appointments.models import Appointment
+from doctors.models import Doctor, DoctorLeave, DoctorSchedule
+from inventory.models import Drug, StockBatch, StockTransaction
+from patients.models import Patient
+from prescriptions.models import Prescription, PrescriptionItem
+from queues.models import VisitTicket
+
+SURNAMES = "陳林黃張李王吳劉蔡楊許鄭謝郭洪曾邱廖賴周徐蘇葉莊呂江何蕭羅高"
+GIVEN = "志明家豪俊傑建宏怡君雅婷美玲淑芬宗翰冠宇承恩柏翰詩涵欣怡佳穎宜蓁子晴品妤"
+DEPARTMENTS = ["家醫科", "內科", "小兒科", "耳鼻喉科", "皮膚科", "骨科"]
+DRUG_FORMS = [("錠", "顆"), ("膠囊", "顆"), ("糖漿", "ml"), ("軟膏", "條")]
+ID_LETTERS = "ABCDEFGHJKLMNPQRSTUVXYWZIO"
+
+
+@contextmanager
+def backdating(*fields):
+    """
+    bulk_create 時暫時關掉 auto_now / auto_now_add，才能寫入歷史時間。
+    """
+    saved = [(f, f.auto_now, f.auto_now_add) for f in fields]
+    try:
+        for f, _, _ in saved:
+            f.auto_now = False
+            f.auto_now_add = False
+        yield
+    finally:
+        for f, auto_now, auto_now_add in saved:
+            f.auto_now = auto_now
+            f.auto_now_add = auto_now_add
+
+
+class Command(BaseCommand):
+    help = (
+        "產生大量、可重現（固定 seed）的模擬門診資料：醫師/班表/停診、病人、一年份掛號與叫號、"
+        "處方與明細、藥品批次與一致的庫存異動帳。全部用 bulk_create 寫入。"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--seed", type=int, default=42)
+        parser.add_argument("--doctors", type=int, default=10)
+        parser.add_argument("--patients", type=int, default=100_000)
+        parser.add_argument("--days", type=int, default=365, help="往回產生幾天的門診")
+        parser.add_argument("--future-days", type=int, default=14, help="往後產生幾天的預約")
+        parser.add_argument("--per-session", type=int, default=15, help="每診平均掛號數")
+        parser.add_argument("--drugs", type=int, default=300)
+        parser.add_argument("--batches-per-drug", type=int, default=6)
+        parser.add_argument("--batch-size", type=int, default=5000, help="bulk_create 每批筆數")
+
+    def handle(self, *args, **opts):
+        self.rng = random.Random(opts["seed"])
+        self.batch_size = opts["batch_size"]
+        self.today = timezone.localdate()
+        self.tz = timezone.get_current_timezone()
+        started = time_mod.perf_counter()
+
+        with transaction.atomic():
+            doctors = self._doctors(opts["doctors"])
+            patients = self._patients(opts["patients"])
+            drugs = self._drugs(opts["drugs"])
+            appts = self._appointments(doctors, patients, opts["days"], opts["future_days"], opts["per_session"])
+            tickets = self._tickets(appts)
+            items = self._prescriptions(tickets, drugs)
+            self._stock(drugs, items, opts["days"], opts["batches_per_drug"])
+
+        self.stdout.write(self.style.SUCCESS(
+            f"完成，用時 {time_mod.perf_counter() - started:.1f} 秒"
+        ))
+
+    # ------------------------------------------------------------------
+
+    def _log(self, label, count):
+        self.stdout.write(f"  {label}: {count}")
+
+    def _aware(self, day, t):
+        return timezone.make_aware(datetime.combine(day, t), self.tz)
+
+    def _name(self):
+        return self.rng.choice(SURNAMES) + "".join(self.rng.choice(GIVEN) for _ in range(2))
+
+    def _doctors(self, n):
+        existing = Doctor.objects.count()
+        users = User.objects.bulk_create([
+            User(username=f"syn_doc_{existing + i + 1:03d}", password="!")
+            for i in range(n)
+        ])
+        doctors = Doctor.objects.bulk_create([
+            Doctor(
+                name=self._name(),
+                department=DEPARTMENTS[i % len(DEPARTMENTS)],
+                room=f"{existing + i + 1}診",
+                user=users[i],
+            )
+            for i in range(n)
+        ])
+
+        schedules, leaves = [], []
+        for doctor in doctors:
+            # 每位醫師一週排 4~6 個診
+            slots = [(wd, s) for wd in range(6) for s in ("AM", "PM")]
+            for weekday, session in sorted(self.rng.sample(slots, self.rng.randint(4, 6))):
+                start, end = (time(9), time(12)) if session == "AM" else (time(14), time(17))
+                schedules.append(DoctorSchedule(
+                    doctor=doctor, weekday=weekday, session=session,
+                    start_time=start, end_time=end, slot_minutes=10, max_patients=18,
+                ))
+            for _ in range(self.rng.randint(1, 3)):
+                start = self.today - timedelta(days=self.rng.randint(0, 360))
+                leaves.append(DoctorLeave(
+                    doctor=doctor, start_date=start,
+                    end_date=start + timedelta(days=self.rng.randint(0, 4)),
+                    reason=self.rng.choice(["休假", "研討會", "公假"]),
+                ))
+        DoctorSchedule.objects.bulk_create(schedules)
+        DoctorLeave.objects.bulk_create(leaves)
+
+        self.schedules = defaultdict(list)
+        for s in schedules:
+            self.schedules[s.doctor_id].append(s)
+        self.leaves = defaultdict(list)
+        for lv in leaves:
+            self.leaves[lv.doctor_id].append((lv.start_date, lv.end_date))
+
+        self._log("醫師", len(doctors))
+        self._log("班表", len(schedules))
+        self._log("停診", len(leaves))
+        return doctors
+
+    def _patients(self, n):
+        chart_nos = Patient.allocate_chart_nos(n) if n else []
+        taken = set(Patient.objects.values_list("national_id", flat=True))
+
+        rows = []
+        serial = 0
+        for i in range(n):
+            gender = self.rng.choice([Patient.GENDER_MALE, Patient.GENDER_FEMALE])
+            while True:
+                serial += 1
+                nid = f"{ID_LETTERS[serial % 26]}{1 if gender == 'M' else 2}{serial:08d}"
+                if nid not in taken:
+                    break
+            rows.append(Patient(
+                full_name=self._name(),
+                national_id=nid,
+                gender=gender,
+                birth_date=self.today - timedelta(days=self.rng.randint(365, 365 * 90)),
+                phone=f"09{self.rng.randint(0, 99_999_999):08d}",
+                blood_type=self.rng.choice(["A", "B", "AB", "O", "UNK"]),
+                allergies=self.rng.choice(["", "", "", "盤尼西林", "磺胺類", "阿斯匹靈"]),
+                chronic_diseases=self.rng.choice(["", "", "高血壓", "糖尿病", "氣喘"]),
+                chart_no=chart_nos[i],
+            ))
+        patients = Patient.objects.bulk_create(rows, batch_size=self.batch_size)
+        self._log("病人", len(patients))
+        return patients
+
+    def _drugs(self, n):
+        existing = Drug.objects.count()
+        rows = []
+        for i in range(n):
+            form, unit = self.rng.choice(DRUG_FORMS)
+            rows.append(Drug(
+                code=f"SYN{existing + i + 1:05d}",
+                name=f"模擬藥品{existing + i + 1:05d}",
+                generic_name=f"Generic-{i % max(1, n // 3):04d}",
+                form=form,
+                strength=f"{self.rng.choice([5, 10, 25, 50, 100, 250, 500])}mg",
+                unit=unit,
+                reorder_level=self.rng.choice([50, 100, 200]),
+                unit_price=self.rng.randint(1, 50),
+            ))
+        drugs = Drug.objects.bulk_create(rows, batch_size=self.batch_size)
+        self._log("藥品", len(drugs))
+        return drugs
+
+    def _appointments(self, doctors, patients, days, future_days, per_session):
+        rows = []
+        start = self.today - timedelta(days=days)
+        day = start
+        while day <= self.today + timedelta(days=future_days):
+            weekday = day.weekday()
+            for doctor in doctors:
+                if any(s <= day <= e for s, e in self.leaves[doctor.pk]):
+                    continue
+                for sch in self.schedules[doctor.pk]:
+                    if sch.weekday != weekday:
+                        continue
+                    total = (
+                        (datetime.combine(day, sch.end_time) - datetime.combine(day, sch.start_time))
+                        // timedelta(minutes=sch.slot_minutes)
+                    )
+                    count = min(total, max(0, int(self.rng.gauss(per_session, per_session / 4))))
+                    for idx in sorted(self.rng.sample(range(total), count)):
+                        t = (datetime.combine(day, sch.start_time) + timedelta(minutes=idx * sch.slot_minutes)).time()
+                        if day < self.today:
+                            status = self.rng.choices(
+                                [Appointment.STATUS_DONE, Appointment.STATUS_NO_SHOW, Appointment.STATUS_CANCELLED],
+                                weights=[85, 7, 8],
+                            )[0]
+                        else:
+                            status = Appointment.STATUS_BOOKED
+                        rows.append(Appointment(
+                            patient=self.rng.choice(patients),
+                            doctor=doctor,
+                            date=day,
+                            time=t,
+                            status=status,
+                            created_at=self._aware(day - timedelta(days=self.rng.randint(0, 14)), time(8)),
+                        ))
+            day += timedelta(days=1)
+
+        appts = Appointment.objects.bulk_create(rows, batch_size=self.batch_size)
+        self._log("掛號", len(appts))
+        return appts
+
+    def _tickets(self, appts):
+        status_map = {
+            Appointment.STATUS_DONE: VisitTicket.STATUS_DONE,
+            Appointment.STATUS_NO_SHOW: VisitTicket.STATUS_NO_SHOW,
+            Appointment.STATUS_BOOKED: VisitTicket.STATUS_WAITING,
+        }
+        numbers = defaultdict(int)
+        rows = []
+        for appt in appts:
+            if appt.status == Appointment.STATUS_CANCELLED or appt.date > self.today:
+                continue
+            key = (appt.doctor_id, appt.date)
+            numbers[key] += 1
+            status = status_map[appt.status]
+            called = self._aware(appt.date, appt.time) if status != VisitTicket.STATUS_WAITING else None
+            rows.append(VisitTicket(
+                appointment=appt,
+                patient_id=appt.patient_id,
+                doctor_id=appt.doctor_id,
+                date=appt.date,
+                number=numbers[key],
+                status=status,
+                created_at=appt.created_at,
+                called_at=called,
+                finished_at=called + timedelta(minutes=8) if called else None,
+                call_count=1 if called else 0,
+                is_skipped=status == VisitTicket.STATUS_NO_SHOW,
+            ))
+        tickets = VisitTicket.objects.bulk_create(rows, batch_size=self.batch_size)
+        self._log("叫號", len(tickets))
+        return tickets
+
+    def _prescriptions(self, tickets, drugs):
+        done = [t for t in tickets if t.status == VisitTicket.STATUS_DONE]
+        rx_rows = []
+        for ticket in done:
+            if self.rng.random() > 0.7:
+                continue
+            finished = ticket.finished_at
+            rx_rows.append(Prescription(
+                patient_id=ticket.patient_id,
+                doctor_id=ticket.doctor_id,
+                date=ticket.date,
+                visit_ticket=ticket,
+                status=Prescription.STATUS_FINAL,
+                verify_status=Prescription.VERIFY_APPROVED,
+                verified_at=finished + timedelta(minutes=5),
+                pharmacy_status=Prescription.PHARMACY_DONE,
+                dispensed_at=finished + timedelta(minutes=15),
+                created_at=finished,
+                updated_at=finished + timedelta(minutes=15),
+            ))
+
+        created_at = Prescription._meta.get_field("created_at")
+        updated_at = Prescription._meta.get_field("updated_at")
+        with backdating(created_at, updated_at):
+            prescriptions = Prescription.objects.bulk_create(rx_rows, batch_size=self.batch_size)
+
+        # 常用藥集中在少數品項，比較像真實處方
+        weights = [1.0 / (i + 1) for i in range(len(drugs))]
+        item_rows = []
+        for rx in prescriptions:
+            for drug in set(self.rng.choices(drugs, weights=weights, k=self.rng.randint(1, 4))):
+                days = self.rng.choice([1, 3, 7, 14, 28])
+                item_rows.append(PrescriptionItem(
+                    prescription=rx,
+                    drug=drug,
+                    quantity=days * self.rng.choice([1, 2, 3]),
+                    treatment_days=days,
+                    days_supply=days,
+                    usage=self.rng.choice(["QD", "BID", "TID", "QID", "HS"]),
+                ))
+        items = PrescriptionItem.objects.bulk_create(item_rows, batch_size=self.batch_size)
+        self._log("處方", len(prescriptions))
+        self._log("處方明細", len(items))
+        return items
+
+    def _stock(self, drugs, items, days, batches_per_drug):
+        """
+        每個藥品依時間切成 N 段進貨，每批數量 = 該段的需求 + 緩衝，
+        再照 FEFO 依日期扣庫存，保證 批次餘量 = 進貨 - 發藥，藥品總量 = 批次加總。
+        """
+        demand = defaultdict(list)
+        for it in items:
+            rx = it.prescription
+            demand[it.drug_id].append((rx.dispensed_at, it))
+
+        start = self.today - timedelta(days=days)
+        span = max(1, days // batches_per_drug)
+        batch_rows = []
+        receipts = {}
+        for drug in drugs:
+            lots = defaultdict(int)
+            for when, it in demand[drug.pk]:
+                period = min(batches_per_drug - 1, (timezone.localtime(when).date() - start).days // span)
+                lots[period] += it.quantity
+            receipts[drug.pk] = []
+            for k in range(batches_per_drug):
+                received = start + timedelta(days=k * span)
+                qty = lots[k] + self.rng.randint(20, 200)
+                batch_rows.append(StockBatch(
+                    drug=drug,
+                    batch_no=f"SYN{received:%Y%m%d}-{k + 1:03d}",
+                    expiry_date=received + timedelta(days=self.rng.randint(540, 900)),
+                    quantity=qty,
+                    created_at=self._aware(received, time(8)),
+                    updated_at=self._aware(received, time(8)),
+                ))
+                receipts[drug.pk].append(batch_rows[-1])
+
+        with backdating(StockBatch._meta.get_field("created_at"), StockBatch._meta.get_field("updated_at")):
+            StockBatch.objects.bulk_create(batch_rows, batch_size=self.batch_size)
+
+        tx_rows = []
+        for drug in drugs:
+            batches = receipts[drug.pk]
+            remain = {b.pk: b.quantity for b in batches}
+            for b in batches:
+                tx_rows.append(StockTransaction(
+                    drug=drug, batch=b, change=b.quantity, reason="purchase",
+                    note="模擬資料進貨", created_at=b.created_at,
+                ))
+
+            for when, it in sorted(demand[drug.pk], key=lambda x: (x[0], x[1].pk)):
+                need = it.quantity
+                for b in sorted(batches, key=lambda b: (b.expiry_date, b.pk)):
+                    if need <= 0:
+                        break
+                    if b.created_at > when or remain[b.pk] <= 0:
+                        continue
+                    take = min(need, remain[b.pk])
+                    remain[b.pk] -= take
+                    need -= take
+                    tx_rows.append(StockTransaction(
+                        drug=drug, batch=b, change=-take, reason="dispense",
+                        prescription_id=it.prescription_id, created_at=when,
+                        note=f"處方明細 #{it.pk} 扣庫存（批號 {b.batch_no}）",
+                    ))
+
+            for b in batches:
+                b.quantity = remain[b.pk]
+            drug.stock_quantity = sum(remain.values())
+
+        with backdating(StockTransaction._meta.get_field("created_at")):
+            StockTransaction.objects.bulk_create(tx_rows, batch_size=self.batch_size)
+        StockBatch.objects.bulk_update(
+            [b for bs in receipts.values() for b in bs], ["quantity"], batch_size=self.batch_size
+        )
+        Drug.objects.bulk_update(drugs, ["stock_quantity"], batch_size=self.batch_size)
+
+        self._log("批次", len(batch_rows))
+        self._log("庫存異動", len(tx_rows))
@@ -0,0 +1,40 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from patients.importer import detect_format, import_patients, iter_records
+
+
+class Command(BaseCommand):
+    help = (
+        "從 CSV（第一列是欄位名稱）或 JSONL（一行一個 JSON 物件）匯入病人，"
+        "以身分證判斷新增或更新。欄位名稱跟 Patient 一樣（full_name、national_id、birth_date…）。"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("path")
+        parser.add_argument("--format", choices=["csv", "jsonl"], help="預設依副檔名判斷")
+        parser.add_argument("--chunk-size", type=int, default=1000)
+        parser.add_argument("--no-update", action="store_true", help="已存在的病人略過、不更新")
+
+    def handle(self, *args, **opts):
+        fmt = opts["format"] or detect_format(opts["path"])
+        try:
+            fp = open(opts["path"], encoding="utf-8-sig", newline="")
+        except OSError as e:
+            raise CommandError(f"無法開啟 {opts['path']}: {e}")
+
+        with fp:
+            result = import_patients(
+                iter_records(fp, fmt),
+                chunk_size=max(1, opts["chunk_size"]),
+                update_existing=not opts["no_update"],
+            )
+
+        for line, message in result.errors:
+            self.stderr.write(f"第 {line} 行：{message}")
+        if result.error_count > len(result.errors):
+            self.stderr.write(f"……另有 {result.error_count - len(result.errors)} 筆錯誤未列出")
+
+        self.stdout.write(self.style.SUCCESS(
+            f"新增 {result.created} 筆、更新 {result.updated} 筆、略過 {result.skipped} 筆、"
+            f"錯誤 {result.error_count} 筆"
+        ))
@@ -0,0 +1,39 @@
+from importlib import import_module
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+
+class Command(BaseCommand):
+    help = (
+        "分批刪除過期的 session。一次一批、每批一個短的 DELETE，"
+        "不會像一次刪光那樣長時間佔住 SQLite 的寫鎖。建議用 cron 每天跑一次。"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=5000)
+
+    def handle(self, *args, **opts):
+        store = import_module(settings.SESSION_ENGINE).SessionStore
+        if not hasattr(store, "get_model_class"):
+            self.stdout.write(f"{settings.SESSION_ENGINE} 沒有存在資料庫，不需要清理")
+            return
+
+        model = store.get_model_class()
+        now = timezone.now()
+        batch_size = max(1, opts["batch_size"])
+        total = 0
+        while True:
+            pks = list(
+                model.objects
+                .filter(expire_date__lt=now)
+                .values_list("pk", flat=True)[:batch_size]
+            )
+            if not pks:
+                break
+            # Session 沒有關聯也沒有 delete signal，delete() 會直接下一個 DELETE ... WHERE IN
+            deleted, _ = model.objects.filter(pk__in=pks).delete()
+            total += deleted
+
+        self.stdout.write(self.style.SUCCESS(f"已刪除 {total} 筆過期 session"))
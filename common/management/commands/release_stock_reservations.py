@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from inventory.reservations import release_expired
+
+
+class Command(BaseCommand):
+    help = (
+        "把逾時沒領藥的庫存保留標成已釋放。逾時的保留本來就不算進可承諾量，"
+        "這個指令只是整理狀態，建議用 cron 每小時跑一次。"
+    )
+
+    def handle(self, *args, **opts):
+        released = release_expired()
+        self.stdout.write(self.style.SUCCESS(f"已釋放 {released} 筆逾時的庫存保留"))
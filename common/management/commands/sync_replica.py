@@ -0,0 +1,33 @@
+import sqlite3
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connections
+
+from common.routers import REPLICA_ALIAS, replica_configured
+
+
+class Command(BaseCommand):
+    help = (
+        "把 primary 的 SQLite 檔完整複製到 replica 檔（本機 / 測試用的 replica 替身）。"
+        "正式環境的 PostgreSQL replica 由資料庫本身的串流複寫處理，不需要這個指令。"
+    )
+
+    def handle(self, *args, **opts):
+        if not replica_configured():
+            raise CommandError("沒有設定 DATABASE_REPLICA_URL（或 replica 跟 primary 是同一個 DB）")
+
+        primary = connections[DEFAULT_DB_ALIAS]
+        replica = connections[REPLICA_ALIAS]
+        if primary.vendor != "sqlite" or replica.vendor != "sqlite":
+            raise CommandError("sync_replica 只支援 SQLite → SQLite")
+
+        replica.close()
+        primary.ensure_connection()
+        # sqlite backup API：線上複製，不用停 primary
+        with sqlite3.connect(str(replica.settings_dict["NAME"])) as target:
+            primary.connection.backup(target)
+        target.close()
+
+        self.stdout.write(self.style.SUCCESS(
+            f"已同步 {primary.settings_dict['NAME']} → {replica.settings_dict['NAME']}"
+        ))
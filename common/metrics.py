@@ -0,0 +1,300 @@
+from __future__ import annotations
+
+import glob
+import json
+import os
+import re
+import secrets
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+from django.conf import settings
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500)
+
+HTTP_REQUESTS = "hospitalsys_http_requests_total"
+HTTP_LATENCY = "hospitalsys_http_request_duration_seconds"
+HTTP_DB_QUERIES = "hospitalsys_http_request_db_queries"
+TICKETS_CALLED = "hospitalsys_tickets_called_total"
+PRESCRIPTIONS_DISPENSED = "hospitalsys_prescriptions_dispensed_total"
+STOCK_TRANSACTIONS = "hospitalsys_stock_transactions_total"
+PUBLIC_REGISTRATIONS = "hospitalsys_public_registrations_total"
+
+HELP = {
+    "hospitalsys_http_requests_total": "Requests handled, by URL name / method / status.",
+    "hospitalsys_http_request_duration_seconds": "Request wall time, by URL name.",
+    "hospitalsys_http_request_db_queries": "DB queries per request, by URL name.",
+    "hospitalsys_tickets_called_total": "Visit tickets called (call next / skip / recall).",
+    "hospitalsys_prescriptions_dispensed_total": "Prescriptions dispensed by the pharmacy.",
+    "hospitalsys_stock_transactions_total": "StockTransaction rows written, by reason.",
+    "hospitalsys_public_registrations_total": "Public online registrations submitted.",
+}
+
+
+def _key(name, labels):
+    return name, tuple(sorted((k, str(v)) for k, v in (labels or {}).items()))
+
+
+class MetricsRegistry:
+    """
+    Process-local 計數器 / 直方圖。
+
+    每個 gunicorn worker 各自累加在記憶體裡，最多每 METRICS_FLUSH_SECONDS 秒把快照
+    原子寫到 METRICS_DIR/metrics-<pid>-<token>.json；/internal/metrics/ 讀全部檔案加總。
+    token 每個 process 不同，PID 被重複使用也不會蓋掉舊 worker 的檔案。
+    已經結束的 worker 的檔案在 collect 時併進 metrics-retired.json 後刪掉，
+    檔案數不會隨重啟越來越多，計數器也維持單調遞增。
+    METRICS_DIR 沒設定時只回報目前這個 process。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._histograms = {}
+        self._last_flush = 0.0
+        self._pid = None
+        self._token = ""
+
+    def inc(self, name, value=1, **labels):
+        key = _key(name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name, value, buckets, **labels):
+        key = _key(name, labels)
+        with self._lock:
+            hist = self._histograms.get(key)
+            if hist is None:
+                hist = self._histograms[key] = {
+                    "buckets": list(buckets),
+                    "counts": [0] * len(buckets),
+                    "sum": 0.0,
+                    "count": 0,
+                }
+            idx = bisect_left(hist["buckets"], value)
+            if idx < len(hist["counts"]):
+                hist["counts"][idx] += 1
+            hist["sum"] += value
+            hist["count"] += 1
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "counters": [[n, list(l), v] for (n, l), v in self._counters.items()],
+                "histograms": [
+                    [n, list(l), dict(h, counts=list(h["counts"]))]
+                    for (n, l), h in self._histograms.items()
+                ],
+            }
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+            self._histograms.clear()
+
+    # ---- 多 worker 檔案彙總 ----
+
+    @staticmethod
+    def _directory():
+        return getattr(settings, "METRICS_DIR", None) or None
+
+    def maybe_flush(self):
+        directory = self._directory()
+        if not directory:
+            return
+        now = time.monotonic()
+        if now - self._last_flush < getattr(settings, "METRICS_FLUSH_SECONDS", 2):
+            return
+        self._last_flush = now
+        self.flush()
+
+    def _path(self, directory):
+        pid = os.getpid()
+        if self._pid != pid:
+            # fork 出來的 worker 換一個 token
+            self._pid = pid
+            self._token = secrets.token_hex(4)
+        return os.path.join(directory, f"metrics-{pid}-{self._token}.json")
+
+    def flush(self):
+        directory = self._directory()
+        if not directory:
+            return
+        os.makedirs(directory, exist_ok=True)
+        _write_json(self._path(directory), self.snapshot())
+
+    def collect(self) -> dict:
+        """合併所有 worker 的快照，順便把已經結束的 worker 併進 retired 檔。"""
+        directory = self._directory()
+        if not directory:
+            return _merge([self.snapshot()])
+        self.flush()
+        own = self._path(directory)
+        with _dir_lock(directory) as locked:
+            if locked:
+                _retire_dead(directory, keep=own)
+            snapshots = [
+                snap for snap in map(_read_json, glob.glob(os.path.join(directory, "metrics-*.json")))
+                if snap is not None
+            ]
+        return _merge(snapshots)
+
+
+# ---- 檔案彙總的小工具 ----
+
+RETIRED_FILE = "metrics-retired.json"
+_WORKER_FILE = re.compile(r"^metrics-(\d+)(?:-[0-9a-f]+)?\.json$")
+
+
+def _write_json(path, data):
+    tmp = f"{path}.tmp"
+    with open(tmp, "w", encoding="utf-8") as fp:
+        json.dump(data, fp)
+    os.replace(tmp, path)
+
+
+def _read_json(path):
+    try:
+        with open(path, encoding="utf-8") as fp:
+            return json.load(fp)
+    except (OSError, ValueError):
+        return None
+
+
+def _merge(snapshots) -> dict:
+    counters, histograms = {}, {}
+    for snap in snapshots:
+        for name, labels, value in snap.get("counters", []):
+            key = (name, tuple(tuple(x) for x in labels))
+            counters[key] = counters.get(key, 0) + value
+        for name, labels, hist in snap.get("histograms", []):
+            key = (name, tuple(tuple(x) for x in labels))
+            merged = histograms.get(key)
+            if merged is None:
+                histograms[key] = dict(hist, counts=list(hist["counts"]))
+                continue
+            merged["counts"] = [a + b for a, b in zip(merged["counts"], hist["counts"])]
+            merged["sum"] += hist["sum"]
+            merged["count"] += hist["count"]
+    return {"counters": counters, "histograms": histograms}
+
+
+def _to_snapshot(data) -> dict:
+    return {
+        "counters": [[n, [list(x) for x in l], v] for (n, l), v in data["counters"].items()],
+        "histograms": [[n, [list(x) for x in l], h] for (n, l), h in data["histograms"].items()],
+    }
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        # PermissionError 之類：process 在，只是不是我們的
+        return True
+    return True
+
+
+@contextmanager
+def _dir_lock(directory):
+    """同一台機器上的 worker 之間互斥（fcntl）；沒有 fcntl 的平台不整理舊檔，只讀。"""
+    if fcntl is None:
+        yield False
+        return
+    with open(os.path.join(directory, ".lock"), "a") as fp:
+        fcntl.flock(fp, fcntl.LOCK_EX)
+        try:
+            yield True
+        finally:
+            fcntl.flock(fp, fcntl.LOCK_UN)
+
+
+def _retire_dead(directory, *, keep):
+    """
+    PID 已經不在的 worker 檔案、以及同一個 PID 較舊的檔案（PID 被重複使用）
+    併進 RETIRED_FILE 後刪除；要在 _dir_lock 裡呼叫。
+    """
+    by_pid = {}
+    for path in glob.glob(os.path.join(directory, "metrics-*.json")):
+        match = _WORKER_FILE.match(os.path.basename(path))
+        if match:
+            by_pid.setdefault(int(match.group(1)), []).append(path)
+
+    dead = []
+    for pid, paths in by_pid.items():
+        if not _pid_alive(pid):
+            dead.extend(p for p in paths if p != keep)
+            continue
+        # 同一個 PID 有好幾個檔案：最新的（或自己的）是現在那個 process，其他是前一個用這個 PID 的 worker
+        current = keep if keep in paths else max(paths, key=os.path.getmtime)
+        dead.extend(p for p in paths if p != current)
+    if not dead:
+        return
+
+    retired_path = os.path.join(directory, RETIRED_FILE)
+    snapshots = [snap for snap in map(_read_json, [retired_path, *dead]) if snap is not None]
+    # 先寫好合併後的 retired 檔再刪，中途掛掉頂多重複算一次，不會少算
+    _write_json(retired_path, _to_snapshot(_merge(snapshots)))
+    for path in dead:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+def _fmt_labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ""
+    body = ",".join(
+        '{}="{}"'.format(k, str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for k, v in pairs
+    )
+    return "{" + body + "}"
+
+
+def render_prometheus(data: dict) -> str:
+    lines = []
+    seen = set()
+
+    def header(name, kind):
+        if name in seen:
+            return
+        seen.add(name)
+        if name in HELP:
+            lines.append(f"# HELP {name} {HELP[name]}")
+        lines.append(f"# TYPE {name} {kind}")
+
+    for (name, labels), value in sorted(data["counters"].items()):
+        header(name, "counter")
+        lines.append(f"{name}{_fmt_labels(labels)} {value}")
+
+    for (name, labels), hist in sorted(data["histograms"].items()):
+        header(name, "histogram")
+        cumulative = 0
+        for bound, count in zip(hist["buckets"], hist["counts"]):
+            cumulative += count
+            lines.append(f"{name}_bucket{_fmt_labels(labels, [('le', bound)])} {cumulative}")
+        lines.append(f'{name}_bucket{_fmt_labels(labels, [("le", "+Inf")])} {hist["count"]}')
+        lines.append(f"{name}_sum{_fmt_labels(labels)} {hist['sum']}")
+        lines.append(f"{name}_count{_fmt_labels(labels)} {hist['count']}")
+
+    return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+
+
+def inc(name, value=1, **labels):
+    if getattr(settings, "METRICS_ENABLED", True):
+        registry.inc(name, value, **labels)
@@ -1,5 +1,12 @@
+import time
+
 from django.conf import settings
 from django.shortcuts import redirect
+from django.utils import timezone
+
+from . import metrics
+from .profiling import QueryRecorder, write_jsonl
+from .routers import REPLICA_PIN_COOKIE, replica_configured
 
 PUBLIC_PATHS = {
     "/",              # 首頁
@@ -31,3 +38,120 @@ class LoginRequiredMiddleware:
 
         login_url = settings.LOGIN_URL
         return redirect(f"{login_url}?next={path}")
+
+
+class QueryProfilingMiddleware:
+    """
+    每個 request 記錄：SQL 次數、SQL 總耗時、最慢的幾條 SQL、view 名稱與總耗時。
+    超過門檻（PROFILING_SLOW_REQUEST_MS / PROFILING_SLOW_QUERY_COUNT）就寫一行 JSON
+    到 PROFILING_SLOW_LOG；PROFILING_QUERY_COUNT_HEADER 開啟時回傳 X-Query-Count。
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.enabled = getattr(settings, "PROFILING_ENABLED", False)
+        self.slow_ms = getattr(settings, "PROFILING_SLOW_REQUEST_MS", 500)
+        self.slow_queries = getattr(settings, "PROFILING_SLOW_QUERY_COUNT", 50)
+        self.top_n = getattr(settings, "PROFILING_TOP_QUERIES", 5)
+        self.log_path = getattr(settings, "PROFILING_SLOW_LOG", None)
+        self.add_header = getattr(settings, "PROFILING_QUERY_COUNT_HEADER", False)
+
+    def __call__(self, request):
+        if not self.enabled:
+            return self.get_response(request)
+
+        recorder = QueryRecorder(top_n=self.top_n)
+        request.query_profile = recorder
+
+        start = time.perf_counter()
+        with recorder:
+            response = self.get_response(request)
+        wall_ms = (time.perf_counter() - start) * 1000
+
+        if self.add_header:
+            response["X-Query-Count"] = str(recorder.count)
+            response["X-Query-Time-Ms"] = f"{recorder.total_ms:.1f}"
+
+        is_slow = wall_ms >= self.slow_ms or recorder.count >= self.slow_queries
+        if is_slow and self.log_path:
+            match = getattr(request, "resolver_match", None)
+            user = getattr(request, "user", None)
+            write_jsonl(self.log_path, {
+                "ts": timezone.now().isoformat(),
+                "method": request.method,
+                "path": request.path,
+                "view": match.view_name if match else "",
+                "status": response.status_code,
+                "user": user.get_username() if user is not None and user.is_authenticated else "",
+                "wall_ms": round(wall_ms, 1),
+                "sql_ms": round(recorder.total_ms, 1),
+                "query_count": recorder.count,
+                "slowest": recorder.slowest(),
+            })
+
+        return response
+
+
+class MetricsMiddleware:
+    """
+    依 URL name 累計 request 數、延遲直方圖、每個 request 的 SQL 次數。
+    放在 QueryProfilingMiddleware 之後可以直接沿用它的 SQL 計數。
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.enabled = getattr(settings, "METRICS_ENABLED", True)
+
+    def __call__(self, request):
+        if not self.enabled:
+            return self.get_response(request)
+
+        start = time.perf_counter()
+        recorder = getattr(request, "query_profile", None)
+        if recorder is None:
+            recorder = QueryRecorder(top_n=0)
+            with recorder:
+                response = self.get_response(request)
+            query_count = recorder.count
+        else:
+            before = recorder.count
+            response = self.get_response(request)
+            query_count = recorder.count - before
+        elapsed = time.perf_counter() - start
+
+        match = getattr(request, "resolver_match", None)
+        view = match.view_name if match and match.view_name else "<unresolved>"
+
+        metrics.registry.inc(
+            metrics.HTTP_REQUESTS,
+            view=view,
+            method=request.method,
+            status=response.status_code,
+        )
+        metrics.registry.observe(metrics.HTTP_LATENCY, elapsed, metrics.LATENCY_BUCKETS, view=view)
+        metrics.registry.observe(metrics.HTTP_DB_QUERIES, query_count, metrics.QUERY_BUCKETS, view=view)
+        metrics.registry.maybe_flush()
+        return response
+
+
+class ReplicaPinMiddleware:
+    """
+    POST 等寫入請求之後，REPLICA_PIN_SECONDS 秒內讓同一個瀏覽器的報表頁照舊讀 primary，
+    避免 replica 還沒追上就看到舊資料（見 common.routers.use_replica）。
+    沒設定 replica 時什麼都不做。
+    """
+
+    SAFE_METHODS = {"GET", "HEAD", "OPTIONS", "TRACE"}
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.seconds = getattr(settings, "REPLICA_PIN_SECONDS", 10)
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        if request.method not in self.SAFE_METHODS and replica_configured():
+            response.set_cookie(
+                REPLICA_PIN_COOKIE, "1",
+                max_age=self.seconds, httponly=True, samesite="Lax",
+            )
+        return response
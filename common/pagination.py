@@ -0,0 +1,126 @@
+from __future__ import annotations
+
+import base64
+import json
+
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+
+
+class KeysetPage:
+    """
+    Keyset 分頁的一頁，介面跟 Paginator 的 Page 類似（可迭代 / has_next / has_previous），
+    但沒有總頁數：不做 COUNT(*)、也不用 OFFSET，第 500 頁跟第 1 頁成本一樣。
+    """
+
+    def __init__(self, object_list, *, has_next, has_previous, next_cursor, previous_cursor):
+        self.object_list = object_list
+        self.has_next = has_next
+        self.has_previous = has_previous
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __bool__(self):
+        return bool(self.object_list)
+
+    def has_other_pages(self):
+        return self.has_next or self.has_previous
+
+
+class KeysetPaginator:
+    """
+    依 ordering（例如 ("-created_at", "-id")）做 keyset 分頁。
+    最後一個欄位必須唯一（通常是 id），排序才會穩定。
+
+    cursor 是最後 / 第一筆的排序欄位值，以 urlsafe base64 JSON 放在網址上；
+    壞掉或被竄改的 cursor 一律當作第一頁，不會噴錯。
+    """
+
+    def __init__(self, queryset, ordering, per_page=20):
+        self.queryset = queryset
+        self.ordering = tuple(ordering)
+        self.per_page = per_page
+        self.fields = [o.lstrip("-") for o in self.ordering]
+        self.descending = [o.startswith("-") for o in self.ordering]
+        opts = queryset.model._meta
+        self._model_fields = [opts.pk if f == "pk" else opts.get_field(f) for f in self.fields]
+
+    # ---- cursor 編解碼 ----
+
+    def encode_cursor(self, obj):
+        values = []
+        for f in self.fields:
+            v = getattr(obj, f)
+            values.append(v.isoformat() if hasattr(v, "isoformat") else v)
+        raw = json.dumps(values, separators=(",", ":")).encode()
+        return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+    def decode_cursor(self, cursor):
+        if not cursor:
+            return None
+        try:
+            raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+            values = json.loads(raw)
+            if not isinstance(values, list) or len(values) != len(self.fields):
+                return None
+            return [field.to_python(v) for field, v in zip(self._model_fields, values)]
+        except (ValueError, TypeError, ValidationError):
+            return None
+
+    # ---- 查詢 ----
+
+    def _seek(self, values, forward):
+        """
+        產生「排在 values 之後（forward）/ 之前」的條件。
+        第一個欄位額外加一個 <= / >= 條件，讓 index 可以直接做 range scan。
+        """
+        def op(desc):
+            # forward + 遞減排序 → 往更小的值走
+            return "lt" if desc == forward else "gt"
+
+        clauses = Q()
+        for i in range(len(self.fields)):
+            q = Q(**{f"{self.fields[i]}__{op(self.descending[i])}": values[i]})
+            for j in range(i):
+                q &= Q(**{self.fields[j]: values[j]})
+            clauses |= q
+
+        lead = self.fields[0]
+        bound = "lte" if op(self.descending[0]) == "lt" else "gte"
+        return Q(**{f"{lead}__{bound}": values[0]}) & clauses
+
+    def page(self, after=None, before=None):
+        after_values = self.decode_cursor(after)
+        before_values = None if after_values else self.decode_cursor(before)
+
+        if before_values is not None:
+            reverse = tuple(o[1:] if o.startswith("-") else f"-{o}" for o in self.ordering)
+            rows = list(
+                self.queryset.filter(self._seek(before_values, forward=False))
+                .order_by(*reverse)[: self.per_page + 1]
+            )
+            has_previous = len(rows) > self.per_page
+            rows = rows[: self.per_page][::-1]
+            has_next = True
+        else:
+            qs = self.queryset.order_by(*self.ordering)
+            if after_values is not None:
+                qs = qs.filter(self._seek(after_values, forward=True))
+            rows = list(qs[: self.per_page + 1])
+            has_next = len(rows) > self.per_page
+            rows = rows[: self.per_page]
+            has_previous = after_values is not None
+
+        return KeysetPage(
+            rows,
+            has_next=has_next and bool(rows),
+            has_previous=has_previous and bool(rows),
+            next_cursor=self.encode_cursor(rows[-1]) if rows else None,
+            previous_cursor=self.encode_cursor(rows[0]) if rows else None,
+        )
@@ -0,0 +1,78 @@
+from __future__ import annotations
+
+import heapq
+import json
+import os
+import threading
+import time
+from contextlib import ExitStack
+
+from django.db import connections
+
+
+class QueryRecorder:
+    """
+    透過 connection.execute_wrapper 記錄一個 request 內所有 SQL：
+    - 查詢次數、總耗時
+    - 最慢的前 N 條 SQL（heap，只保留 N 條，不會無限長）
+    不依賴 DEBUG=True，正式環境也可以用。
+    """
+
+    def __init__(self, top_n: int = 5):
+        self.top_n = top_n
+        self.count = 0
+        self.total_ms = 0.0
+        self._slowest = []  # (ms, seq, alias, sql)
+        self._stack = None
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            ms = (time.perf_counter() - start) * 1000
+            self.count += 1
+            self.total_ms += ms
+            self._keep_if_slow(ms, context["connection"].alias, sql)
+
+    def _keep_if_slow(self, ms, alias, sql):
+        if self.top_n <= 0:
+            return
+        entry = (ms, self.count, alias, sql)
+        if len(self._slowest) < self.top_n:
+            heapq.heappush(self._slowest, entry)
+        elif ms > self._slowest[0][0]:
+            heapq.heapreplace(self._slowest, entry)
+
+    def __enter__(self):
+        self._stack = ExitStack()
+        for conn in connections.all(initialized_only=False):
+            self._stack.enter_context(conn.execute_wrapper(self))
+        return self
+
+    def __exit__(self, *exc):
+        self._stack.close()
+        self._stack = None
+        return False
+
+    def slowest(self):
+        return [
+            {"ms": round(ms, 3), "db": alias, "sql": sql[:1000]}
+            for ms, _, alias, sql in sorted(self._slowest, reverse=True)
+        ]
+
+
+_log_lock = threading.Lock()
+
+
+def write_jsonl(path, record: dict) -> None:
+    """
+    一筆一行 append；單次 write 搭配 O_APPEND，多個 gunicorn worker 同時寫也不會交錯。
+    """
+    line = json.dumps(record, ensure_ascii=False, default=str) + "\n"
+    directory = os.path.dirname(str(path))
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with _log_lock:
+        with open(path, "a", encoding="utf-8") as fp:
+            fp.write(line)
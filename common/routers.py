@@ -0,0 +1,76 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+
+REPLICA_ALIAS = "replica"
+REPLICA_PIN_COOKIE = "db_pin"
+
+_reading_from_replica = ContextVar("reading_from_replica", default=False)
+
+
+def replica_configured():
+    if REPLICA_ALIAS not in settings.DATABASES:
+        return False
+    # 測試時 replica 是 default 的 MIRROR，指到同一個 DB 就不必切換
+    return _target(REPLICA_ALIAS) != _target(DEFAULT_DB_ALIAS)
+
+
+def _target(alias):
+    s = connections[alias].settings_dict
+    return s.get("HOST"), s.get("PORT"), str(s["NAME"])
+
+
+class ReplicaRouter:
+    """
+    只有在 use_replica / replica() 範圍內的讀取才會送到 replica，其餘一律走 primary。
+    範圍內遇到以下情況會改回 primary，避免讀到還沒同步的資料：
+    - 正在 primary 的 transaction 裡（atomic 內的讀取通常緊接著寫入）
+    - 已經寫過一次（之後的讀取黏在 primary）
+    """
+
+    def db_for_read(self, model, **hints):
+        if not _reading_from_replica.get() or not replica_configured():
+            return None
+        if connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return DEFAULT_DB_ALIAS
+        return REPLICA_ALIAS
+
+    def db_for_write(self, model, **hints):
+        if _reading_from_replica.get():
+            _reading_from_replica.set(False)
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # replica 是 primary 的複本，兩邊的物件可以互相關聯
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # replica 的 schema 由複寫（或本機的 sync_replica）帶過去
+        return db != REPLICA_ALIAS
+
+
+@contextmanager
+def replica():
+    token = _reading_from_replica.set(True)
+    try:
+        yield
+    finally:
+        _reading_from_replica.reset(token)
+
+
+def use_replica(view_func):
+    """
+    報表類 view 用：讀取改走 replica，不跟櫃台 / 藥局的寫入搶 primary。
+    使用者剛送出表單（ReplicaPinMiddleware 的 cookie 還在）時照舊讀 primary，
+    才不會一寫完就看到舊資料。
+    """
+    @wraps(view_func)
+    def wrapper(request, *args, **kwargs):
+        if request.COOKIES.get(REPLICA_PIN_COOKIE):
+            return view_func(request, *args, **kwargs)
+        with replica():
+            return view_func(request, *args, **kwargs)
+    return wrapper
@@ -0,0 +1,67 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from doctors.models import Doctor
+from inventory.models import AllergenSynonym, Drug, StockBatch, StockTransaction
+from patients.models import Patient
+from prescriptions.models import Prescription, PrescriptionItem
+from prescriptions.screening import FORMULARY_FIELDS
+from public.models import PublicRegistrationRequest
+from queues.models import VisitTicket
+
+from . import fragments, metrics
+
+
+@receiver(post_save, sender=StockTransaction)
+def count_stock_transaction(sender, instance, created, **kwargs):
+    if created:
+        metrics.inc(metrics.STOCK_TRANSACTIONS, reason=instance.reason)
+
+
+@receiver(post_save, sender=PublicRegistrationRequest)
+def count_public_registration(sender, instance, created, **kwargs):
+    if created:
+        metrics.inc(metrics.PUBLIC_REGISTRATIONS)
+
+
+# 模板片段快取的版本戳記：資料一改就換版本號，舊片段自然失效
+
+
+@receiver([post_save, post_delete], sender=Doctor)
+def bump_doctor_fragments(sender, **kwargs):
+    fragments.bump(fragments.DOCTORS)
+
+
+@receiver([post_save, post_delete], sender=VisitTicket)
+def bump_ticket_fragments(sender, **kwargs):
+    fragments.bump(fragments.TICKETS)
+
+
+@receiver([post_save, post_delete], sender=Patient)
+def bump_patient_fragments(sender, **kwargs):
+    # 看板跟藥局面板都有顯示病人姓名 / 病歷號
+    fragments.bump(fragments.TICKETS, fragments.PRESCRIPTIONS)
+
+
+@receiver([post_save, post_delete], sender=Drug)
+def bump_drug_fragments(sender, update_fields=None, **kwargs):
+    fragments.bump(fragments.DRUGS)
+    # 扣庫存、進貨只存 stock_quantity，不用重編過敏篩檢的自動機
+    if update_fields is None or FORMULARY_FIELDS.intersection(update_fields):
+        fragments.bump(fragments.FORMULARY)
+
+
+@receiver([post_save, post_delete], sender=AllergenSynonym)
+def bump_formulary(sender, **kwargs):
+    fragments.bump(fragments.FORMULARY)
+
+
+@receiver([post_save, post_delete], sender=StockBatch)
+def bump_stock_fragments(sender, **kwargs):
+    fragments.bump(fragments.STOCK)
+
+
+@receiver([post_save, post_delete], sender=Prescription)
+@receiver([post_save, post_delete], sender=PrescriptionItem)
+def bump_prescription_fragments(sender, **kwargs):
+    fragments.bump(fragments.PRESCRIPTIONS)
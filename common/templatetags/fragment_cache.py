@@ -0,0 +1,11 @@
+from django import template
+
+from common import fragments
+
+register = template.Library()
+
+
+@register.simple_tag
+def fragment_version(*names):
+    """{% fragment_version "doctors" "tickets" as v %}，v 放進 {% cache %} 的 vary 參數。"""
+    return ".".join(str(fragments.get_version(name)) for name in names)
@@ -4,7 +4,11 @@ register = template.Library()
 
 @register.filter
 def has_group(user, group_name: str) -> bool:
-    return (
-        user.is_authenticated
-        and user.groups.filter(name=group_name).exists()
-    )
+    if not user.is_authenticated:
+        return False
+    # 同一個 request 的模板常常呼叫好幾次，群組名稱只查一次
+    names = getattr(user, "_group_names", None)
+    if names is None:
+        names = set(user.groups.values_list("name", flat=True))
+        user._group_names = names
+    return group_name in names
@@ -1,3 +1,831 @@
-from django.test import TestCase
+import json
+import os
+import subprocess
+import sys
+import tempfile
+from datetime import time, timedelta
+from io import StringIO
+from unittest import skipUnless
 
-# Create your tests here.
+from django.contrib.auth.models import Group, Permission, User
+from django.conf import settings
+from django.contrib.sessions.models import Session
+from django.core.cache import cache, caches
+from django.core.management import call_command
+from django.db import connection, transaction
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from appointments.models import Appointment
+from doctors.models import Doctor, DoctorSchedule
+from inventory.models import Drug, StockBatch, StockTransaction
+from inventory.utils import use_drug_from_prescription_item
+from patients.models import DuplicateCandidate, Patient
+from prescriptions.models import Prescription, PrescriptionItem, PrescriptionLog
+from public.models import Announcement, ClinicProfile, PublicRegistrationRequest
+from queues.models import VisitTicket
+
+from . import metrics
+from .profiling import QueryRecorder
+
+
+# ---------------------------------------------------------------------------
+# Query budget 表：模板或 view 改動多出 N+1 時，這裡會先爆。
+#
+# (url name, kwargs key, 角色, 最多幾個 query, 是否為 list view)
+# - kwargs key 對應 ClinicDay.url_kwargs() 產生的參數
+# - list view 會在加倍資料量後再量一次，query 數不可增加
+# ---------------------------------------------------------------------------
+QUERY_BUDGETS = [
+    # 公開頁面
+    ("public:home", None, None, 0, True),
+    ("public:register", None, None, 0, False),
+    ("public:doctor_list", None, None, 0, True),
+    ("public:register_success", "public_request", None, 1, False),
+
+    # 內部首頁 / 登入 / 監控
+    ("index", None, "RECEPTION", 3, False),
+    ("login", None, None, 0, False),
+    ("metrics", None, "ADMIN", 2, False),
+    ("admin:index", None, "ADMIN", 5, False),
+
+    # 櫃台
+    ("queues:reception_panel", None, "RECEPTION", 4, True),
+    ("queues:reception_call", None, "RECEPTION", 8, True),
+    ("queues:board", None, None, 2, True),
+    ("queues:api_current_number", "doctor_id_query", None, 4, True),
+    ("appointments:book", None, "RECEPTION", 4, False),
+    ("appointments:new_for_patient", "patient_id", "RECEPTION", 4, False),
+    ("appointments:doctor_today_appointments", "doctor_id", "RECEPTION", 4, True),
+    ("patients:patient_list", None, "RECEPTION", 3, True),
+    ("patients:patient_create", None, "RECEPTION", 2, False),
+    ("patients:patient_import", None, "ADMIN", 2, False),
+    ("patients:duplicate_review", None, "ADMIN", 3, True),
+    ("patients:patient_detail", "pk_patient", "RECEPTION", 4, True),
+    ("patients:patient_update", "pk_patient", "RECEPTION", 3, False),
+    ("patients:patient_timeline", "pk_patient", "RECEPTION", 8, True),
+    ("patients:patient_timeline_api", "pk_patient", "RECEPTION", 8, True),
+
+    # 醫師
+    ("queues:doctor_panel", None, "DOCTOR", 10, True),
+    ("queues:doctor_action", "doctor_action", "DOCTOR", 3, False),
+    ("prescriptions:edit_for_ticket", "ticket_id", "DOCTOR", 11, False),
+    ("prescriptions:doctor_prescription_list", None, "DOCTOR", 7, True),
+    ("prescriptions:edit_prescription", "pk_prescription", "DOCTOR", 9, False),
+
+    # 藥局
+    ("prescriptions:pharmacy_panel", None, "PHARMACY", 8, True),
+    ("prescriptions:pharmacy_review_list", None, "PHARMACY", 6, True),
+    ("prescriptions:pharmacy_batch_dispense", "approved_ids", "PHARMACY", 8, True),
+    ("prescriptions:pharmacy_review_detail", "pk_pending", "PHARMACY", 8, False),
+    ("prescriptions:prescription_detail", "pk_prescription", "PHARMACY", 10, False),
+    ("prescriptions:dispense_confirm", "pk_prescription", "PHARMACY", 14, False),
+    ("prescriptions:prescription_print", "pk_prescription", "PHARMACY", 6, False),
+    ("prescriptions:public_request_list", None, "PHARMACY", 4, True),
+    ("inventory:dashboard", None, "PHARMACY", 8, True),
+    ("inventory:drug_list", None, "PHARMACY", 10, True),
+    ("inventory:drug_create", None, "PHARMACY", 4, False),
+    ("inventory:drug_search", "drug_q", "DOCTOR", 4, True),
+    ("inventory:edit_drug", "pk_drug", "PHARMACY", 4, False),
+    ("inventory:stock_in", "drug_id", "PHARMACY", 6, False),
+    ("inventory:stock_history", None, "PHARMACY", 5, True),
+    ("inventory:stock_history_export_csv", None, "PHARMACY", 4, True),
+    ("inventory:expiry_dashboard", None, "PHARMACY", 8, True),
+    ("inventory:quarantine_dashboard", None, "PHARMACY", 4, True),
+
+    # 病人
+    ("prescriptions:patient_history", None, "PATIENT", 8, True),
+]
+
+# ---------------------------------------------------------------------------
+# 會寫入 / 只收 POST 的路由：每個只送一次，在 savepoint 裡量完就 rollback，不影響其他列。
+#
+# (url name, kwargs key, 角色, 最多幾個 query, method, data key)
+# - data key 對應 ClinicDay.post_data() 產生的表單內容
+# ---------------------------------------------------------------------------
+ACTION_BUDGETS = [
+    ("logout", None, "RECEPTION", 4, "post", None),
+    ("appointments:appointment_update_status", "pk_appointment", "RECEPTION", 4, "post", "appointment_status"),
+    ("patients:duplicate_resolve", "pk_duplicate", "ADMIN", 4, "post", "dismiss"),
+    ("prescriptions:pharmacy_review_bulk", None, "PHARMACY", 15, "post", "bulk_approve"),
+    ("prescriptions:dispense", "pk_prescription", "PHARMACY", 39, "post", None),
+    ("prescriptions:cancel_or_return", "pk_prescription", "PHARMACY", 12, "post", None),
+    ("prescriptions:public_request_approve", "public_request", "PHARMACY", 10, "post", None),
+    ("prescriptions:public_request_reject", "public_request", "PHARMACY", 9, "post", None),
+    ("inventory:batch_quarantine", "batch_id", "PHARMACY", 11, "post", "quarantine"),
+    ("inventory:batch_unquarantine", "quarantined_batch_id", "PHARMACY", 11, "post", None),
+    ("inventory:batch_destroy", "batch_id", "PHARMACY", 13, "post", "destroy"),
+]
+
+
+class ClinicDay:
+    """
+    建一個「像真的」門診日：多位醫師、掛號、叫號中的票、各狀態處方、藥品批次與異動。
+    add_rows() 可以再加一批，用來驗證 list view 的 query 數不會隨筆數成長。
+    """
+
+    ROLES = ("RECEPTION", "DOCTOR", "PHARMACY", "PATIENT")
+
+    def __init__(self):
+        self.today = timezone.localdate()
+        self.groups = {name: Group.objects.create(name=name) for name in self.ROLES}
+        self.users = {}
+        for name in self.ROLES:
+            user = User.objects.create_user(username=name.lower(), password="pw")
+            user.groups.add(self.groups[name])
+            self.users[name] = user
+        self.users["ADMIN"] = User.objects.create_superuser("admin", password="pw")
+
+        ClinicProfile.objects.create(name="測試診所", phone="02-0000", address="台北", opening_hours="週一至週五")
+        Announcement.objects.create(
+            title="公告", content="內容",
+            start_date=self.today - timedelta(days=1),
+            end_date=self.today + timedelta(days=1),
+        )
+
+        self.doctors = []
+        for i, dept in enumerate(["內科", "外科"]):
+            user = self.users["DOCTOR"] if i == 0 else User.objects.create_user(username=f"doc{i}")
+            doctor = Doctor.objects.create(name=f"醫師{i}", department=dept, room=f"{i + 1}診", user=user)
+            for weekday in range(7):
+                DoctorSchedule.objects.create(
+                    doctor=doctor, weekday=weekday, session="AM",
+                    start_time=time(9, 0), end_time=time(12, 0),
+                    slot_minutes=5, max_patients=36,
+                )
+            self.doctors.append(doctor)
+        self.doctor = self.doctors[0]
+
+        self.drugs = []
+        for i in range(3):
+            drug = Drug.objects.create(code=f"DRG{i:04d}", name=f"藥品{i}", unit_price=1)
+            batch = StockBatch.objects.create(
+                drug=drug, batch_no=f"B{i}", quantity=1000,
+                expiry_date=self.today + timedelta(days=365),
+            )
+            StockBatch.objects.create(
+                drug=drug, batch_no=f"E{i}", quantity=5,
+                expiry_date=self.today + timedelta(days=10),
+            )
+            StockTransaction.objects.create(drug=drug, batch=batch, change=1000, reason="purchase")
+            drug.stock_quantity = 1005
+            drug.save(update_fields=["stock_quantity"])
+            self.drugs.append(drug)
+
+        self._seq = 0
+        self.add_rows(4)
+
+        self.pending = Prescription.objects.filter(verify_status=Prescription.VERIFY_PENDING).first()
+        self.prescription = Prescription.objects.filter(verify_status=Prescription.VERIFY_APPROVED).first()
+        self.ticket = VisitTicket.objects.filter(doctor=self.doctor).first()
+        self.patient = self.ticket.patient
+        # 核准時會幫預約開號碼牌，所以另外準備一筆還沒報到的線上掛號
+        walk_in = Patient.objects.create(
+            full_name="線上掛號", national_id="Z100000002", birth_date=self.today - timedelta(days=365 * 30),
+        )
+        appt = Appointment.objects.create(patient=walk_in, doctor=self.doctor, date=self.today, time=time(11, 55))
+        self.public_request = PublicRegistrationRequest.objects.create(
+            department=self.doctor.department, doctor=self.doctor, date=self.today, period="AM",
+            time=appt.time, name=walk_in.full_name, national_id=walk_in.national_id,
+            birth_date=walk_in.birth_date, phone="", appointment=appt,
+        )
+        self.appointment = self.ticket.appointment
+
+        first, second = Patient.objects.order_by("pk")[:2]
+        self.duplicate = DuplicateCandidate.objects.create(patient_a=first, patient_b=second, score=0.9)
+        self.quarantined = StockBatch.objects.create(
+            drug=self.drugs[0], batch_no="Q0", quantity=5, status=StockBatch.STATUS_QUARANTINE,
+            expiry_date=self.today + timedelta(days=200),
+        )
+
+        # PATIENT 角色用帳號名稱對病歷號
+        own = Patient.objects.create(
+            full_name="病人帳號", national_id="Z100000001", chart_no=self.users["PATIENT"].username,
+            birth_date=self.today - timedelta(days=365 * 30),
+        )
+        rx = Prescription.objects.create(patient=own, doctor=self.doctor, date=self.today, status=Prescription.STATUS_FINAL)
+        for drug in self.drugs:
+            PrescriptionItem.objects.create(prescription=rx, drug=drug, quantity=1, treatment_days=3)
+
+    def add_rows(self, n):
+        for _ in range(n):
+            for doctor in self.doctors:
+                self._seq += 1
+                seq = self._seq
+                patient = Patient.objects.create(
+                    full_name=f"病人{seq}", national_id=f"A{seq:09d}",
+                    birth_date=self.today - timedelta(days=365 * 30),
+                    phone=f"0912{seq:06d}",
+                )
+                appt = Appointment.objects.create(
+                    patient=patient, doctor=doctor, date=self.today,
+                    time=time(9 + seq // 12 % 3, seq % 12 * 5),
+                )
+                status = [VisitTicket.STATUS_WAITING, VisitTicket.STATUS_DONE][seq % 2]
+                if seq <= 2:
+                    status = VisitTicket.STATUS_CALLING
+                ticket = VisitTicket.objects.create(
+                    appointment=appt, patient=patient, doctor=doctor,
+                    date=self.today, status=status,
+                    number=VisitTicket.objects.filter(doctor=doctor, date=self.today).count() + 1,
+                )
+
+                verify = [Prescription.VERIFY_PENDING, Prescription.VERIFY_APPROVED][seq % 2]
+                rx = Prescription.objects.create(
+                    patient=patient, doctor=doctor, date=self.today, visit_ticket=ticket,
+                    status=Prescription.STATUS_FINAL, verify_status=verify,
+                )
+                for drug in self.drugs:
+                    PrescriptionItem.objects.create(prescription=rx, drug=drug, quantity=2, treatment_days=3)
+                PrescriptionLog.objects.create(prescription=rx, action=PrescriptionLog.ACTION_CREATE)
+
+                batch = self.drugs[seq % len(self.drugs)].batches.first()
+                StockTransaction.objects.create(
+                    drug=batch.drug, batch=batch, change=-1, reason="dispense",
+                    prescription=rx, operator=self.users["PHARMACY"],
+                )
+
+                PublicRegistrationRequest.objects.create(
+                    department=doctor.department, doctor=doctor, date=self.today, period="AM",
+                    time=appt.time, name=patient.full_name, national_id=patient.national_id,
+                    birth_date=patient.birth_date, phone=patient.phone, appointment=appt,
+                )
+
+    def url_kwargs(self, key):
+        if key is None:
+            return {}, ""
+        return {
+            "public_request": ({"pk": self.public_request.pk}, ""),
+            "doctor_id_query": ({}, f"?doctor_id={self.doctor.pk}"),
+            "patient_id": ({"patient_id": self.patient.pk}, ""),
+            "doctor_id": ({"doctor_id": self.doctor.pk}, ""),
+            "pk_patient": ({"pk": self.patient.pk}, ""),
+            "ticket_id": ({"ticket_id": self.ticket.pk}, ""),
+            "pk_prescription": ({"pk": self.prescription.pk}, ""),
+            "pk_pending": ({"pk": self.pending.pk}, ""),
+            "pk_drug": ({"pk": self.drugs[0].pk}, ""),
+            "drug_id": ({"drug_id": self.drugs[0].pk}, ""),
+            "drug_q": ({}, "?q=藥品"),
+            "doctor_action": ({"pk": self.ticket.pk, "act": "call"}, ""),
+            "pk_appointment": ({"pk": self.appointment.pk}, ""),
+            "pk_duplicate": ({"pk": self.duplicate.pk}, ""),
+            "batch_id": ({"batch_id": self.drugs[0].batches.get(batch_no="B0").pk}, ""),
+            "quarantined_batch_id": ({"batch_id": self.quarantined.pk}, ""),
+            # 批次領藥：今天所有已審核的處方（add_rows 之後張數會跟著變多）
+            "approved_ids": ({}, "?" + "&".join(
+                f"prescription_ids={pk}"
+                for pk in Prescription.objects.filter(verify_status=Prescription.VERIFY_APPROVED).values_list("pk", flat=True)
+            )),
+        }[key]
+
+    def post_data(self, key):
+        if key is None:
+            return {}
+        if key == "bulk_approve":
+            pending = Prescription.objects.filter(verify_status=Prescription.VERIFY_PENDING)
+            return {"action": "approve", "prescription_ids": [str(pk) for pk in pending.values_list("pk", flat=True)]}
+        return {
+            "appointment_status": {"status": "DONE", "next": "/internal/"},
+            "dismiss": {"action": "dismiss"},
+            "quarantine": {"reason": "other", "note": "量測"},
+            "destroy": {"quantity": "1", "reason": "量測"},
+        }[key]
+
+
+TEST_STORAGES = {
+    "default": {"BACKEND": "django.core.files.storage.FileSystemStorage"},
+    "staticfiles": {"BACKEND": "django.contrib.staticfiles.storage.StaticFilesStorage"},
+}
+
+# 量 query 時量的是片段快取沒命中的最差情況，不然 N+1 會被快取蓋掉
+NO_FRAGMENT_CACHE = {
+    **settings.CACHES,
+    "fragments": {"BACKEND": "django.core.cache.backends.dummy.DummyCache"},
+}
+
+
+@override_settings(
+    PROFILING_SLOW_LOG=None, METRICS_DIR="", STORAGES=TEST_STORAGES, CACHES=NO_FRAGMENT_CACHE,
+)
+class QueryBudgetTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.day = ClinicDay()
+        # drug_create 需要 model permission
+        cls.day.users["PHARMACY"].user_permissions.add(
+            Permission.objects.get(codename="add_drug")
+        )
+
+    def setUp(self):
+        cache.clear()
+
+    def _login(self, role):
+        self.client.logout()
+        if role:
+            self.client.force_login(self.day.users[role])
+
+    def _measure(self, name, key, role):
+        kwargs, query = self.day.url_kwargs(key)
+        url = reverse(name, kwargs=kwargs) + query
+        self._login(role)
+        # 先打一次暖機（session、content type cache 等），量第二次
+        self.client.get(url)
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(url)
+        self.assertLess(response.status_code, 400, f"{name} -> {response.status_code}")
+        return len(ctx.captured_queries), ctx
+
+    def test_every_view_within_budget(self):
+        for name, key, role, budget, _ in QUERY_BUDGETS:
+            with self.subTest(view=name):
+                count, ctx = self._measure(name, key, role)
+                self.assertLessEqual(
+                    count, budget,
+                    f"{name} 用了 {count} 個 query（上限 {budget}）：\n"
+                    + "\n".join(q["sql"] for q in ctx.captured_queries),
+                )
+
+    def test_list_views_do_not_grow_with_rows(self):
+        before = {}
+        for name, key, role, _, is_list in QUERY_BUDGETS:
+            if is_list:
+                before[name] = self._measure(name, key, role)[0]
+
+        self.day.add_rows(6)
+
+        for name, key, role, _, is_list in QUERY_BUDGETS:
+            if not is_list:
+                continue
+            with self.subTest(view=name):
+                after, ctx = self._measure(name, key, role)
+                self.assertEqual(
+                    after, before[name],
+                    f"{name}: {before[name]} -> {after} 個 query（N+1？）\n"
+                    + "\n".join(q["sql"] for q in ctx.captured_queries),
+                )
+
+    def test_actions_within_budget(self):
+        for name, key, role, budget, method, data_key in ACTION_BUDGETS:
+            with self.subTest(view=name):
+                kwargs, query = self.day.url_kwargs(key)
+                url = reverse(name, kwargs=kwargs) + query
+                self._login(role)
+                # 暖機（session、content type cache 等）
+                self.client.get(reverse("index"))
+
+                with transaction.atomic():
+                    with CaptureQueriesContext(connection) as ctx:
+                        response = getattr(self.client, method)(url, self.day.post_data(data_key))
+                    transaction.set_rollback(True)
+
+                self.assertLess(response.status_code, 400, f"{name} -> {response.status_code}")
+                self.assertFalse(
+                    response.get("Location", "").startswith(settings.LOGIN_URL), f"{name} 沒有權限",
+                )
+                self.assertLessEqual(
+                    len(ctx.captured_queries), budget,
+                    f"{name} 用了 {len(ctx.captured_queries)} 個 query（上限 {budget}）：\n"
+                    + "\n".join(q["sql"] for q in ctx.captured_queries),
+                )
+
+    def test_budget_table_covers_urlconf(self):
+        from django.urls import get_resolver
+
+        covered = {row[0] for row in QUERY_BUDGETS} | {row[0] for row in ACTION_BUDGETS}
+        # 現在打不開的路由，修好時要補進表裡：
+        # - 模板不存在：appointments:patient_history、appointments:appointment_detail
+        # - view 查 Patient.user，但 Patient 沒有這個欄位：prescriptions:patient_detail
+        # - POST 還沒實作，redirect 到 register_success 時少了 pk：public:register_confirm
+        exempt = {
+            "appointments:patient_history", "appointments:appointment_detail",
+            "prescriptions:patient_detail", "public:register_confirm",
+        }
+
+        def walk(resolver, prefix=""):
+            for p in resolver.url_patterns:
+                if hasattr(p, "url_patterns"):
+                    ns = p.namespace
+                    if ns == "admin":
+                        continue
+                    yield from walk(p, f"{prefix}{ns}:" if ns else prefix)
+                elif p.name:
+                    yield f"{prefix}{p.name}"
+
+        names = set(walk(get_resolver()))
+        missing = names - covered - exempt
+        self.assertFalse(missing, f"這些 URL 沒有 query budget：{sorted(missing)}")
+
+
+# ---------------------------------------------------------------------------
+# 模板片段快取：命中時不查資料；相關 model 一寫入，版本號變了就重新算。
+
+
+@override_settings(PROFILING_SLOW_LOG=None, METRICS_DIR="", STORAGES=TEST_STORAGES)
+class FragmentCacheTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.day = ClinicDay()
+
+    def setUp(self):
+        cache.clear()
+        caches["fragments"].clear()
+
+    def _get(self, name, role):
+        self.client.force_login(self.day.users[role])
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(reverse(name))
+        self.assertEqual(response.status_code, 200)
+        return len(ctx.captured_queries), response
+
+    def _rename_patient(self):
+        patient = self.day.ticket.patient
+        patient.full_name = "改名病人"
+        patient.save()
+        return "改名病人"
+
+    def _rename_drug(self):
+        drug = self.day.drugs[0]
+        drug.name = "改名藥品"
+        drug.save()
+        return "改名藥品"
+
+    def _rename_approved_patient(self):
+        patient = self.day.prescription.patient
+        patient.full_name = "改名領藥病人"
+        patient.save()
+        return "改名領藥病人"
+
+    def test_cached_fragments_skip_queries_until_a_write(self):
+        cases = [
+            ("queues:board", "RECEPTION", self._rename_patient),
+            ("inventory:drug_list", "PHARMACY", self._rename_drug),
+            ("prescriptions:pharmacy_panel", "PHARMACY", self._rename_approved_patient),
+        ]
+        for name, role, write in cases:
+            with self.subTest(view=name):
+                cold, _ = self._get(name, role)
+                warm, _ = self._get(name, role)
+                self.assertLess(warm, cold)
+
+                new_text = write()
+                after, response = self._get(name, role)
+                self.assertGreater(after, warm)
+                self.assertContains(response, new_text)
+
+    def test_doctor_options_follow_doctor_writes(self):
+        self._get("queues:board", "RECEPTION")
+        self.day.doctor.name = "改名醫師"
+        self.day.doctor.save()
+        _, response = self._get("queues:board", "RECEPTION")
+        self.assertContains(response, "改名醫師")
+
+
+# ---------------------------------------------------------------------------
+# 熱門查詢的 EXPLAIN QUERY PLAN：大表只要出現 "SCAN <table>"（整表掃描）就失敗。
+
+HOT_TABLES = {
+    Appointment._meta.db_table,
+    VisitTicket._meta.db_table,
+    Prescription._meta.db_table,
+    StockBatch._meta.db_table,
+    StockTransaction._meta.db_table,
+}
+
+
+@skipUnless(connection.vendor == "sqlite", "EXPLAIN QUERY PLAN 的輸出格式是 SQLite 專用")
+@override_settings(
+    PROFILING_SLOW_LOG=None, METRICS_DIR="", STORAGES=TEST_STORAGES, CACHES=NO_FRAGMENT_CACHE,
+)
+class IndexPlanTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.day = ClinicDay()
+
+    def _full_scans(self, captured):
+        found = []
+        with connection.cursor() as cursor:
+            for q in captured:
+                sql = q["sql"]
+                if not sql.lstrip().upper().startswith("SELECT"):
+                    continue
+                cursor.execute("EXPLAIN QUERY PLAN " + sql)
+                for row in cursor.fetchall():
+                    detail = row[-1]
+                    words = detail.split()
+                    # "SCAN t" = 整表；"SCAN t USING [COVERING] INDEX" 也是掃完整個 index
+                    if len(words) >= 2 and words[0] == "SCAN" and words[1] in HOT_TABLES:
+                        found.append(f"{detail}\n    {sql}")
+        return found
+
+    def _assert_no_full_scan(self, captured):
+        scans = self._full_scans(captured)
+        self.assertFalse(scans, "整表掃描：\n" + "\n".join(scans))
+
+    def _view_queries(self, name, role):
+        self.client.force_login(self.day.users[role])
+        self.client.get(reverse(name))
+        with CaptureQueriesContext(connection) as ctx:
+            self.client.get(reverse(name))
+        return ctx.captured_queries
+
+    def test_pharmacy_panel(self):
+        self._assert_no_full_scan(self._view_queries("prescriptions:pharmacy_panel", "PHARMACY"))
+
+    def test_doctor_panel(self):
+        self._assert_no_full_scan(self._view_queries("queues:doctor_panel", "DOCTOR"))
+
+    def test_board(self):
+        self._assert_no_full_scan(self._view_queries("queues:board", "RECEPTION"))
+
+    def test_get_available_slots(self):
+        with CaptureQueriesContext(connection) as ctx:
+            Appointment.objects.get_available_slots(self.day.doctor, self.day.today + timedelta(days=1))
+        self._assert_no_full_scan(ctx.captured_queries)
+
+    def test_use_drug_from_prescription_item(self):
+        item = self.day.prescription.items.select_related("drug").first()
+        with CaptureQueriesContext(connection) as ctx, transaction.atomic():
+            use_drug_from_prescription_item(item, prescription=self.day.prescription)
+        self._assert_no_full_scan(ctx.captured_queries)
+
+
+# ---------------------------------------------------------------------------
+# 多個 writer 同時寫 SQLite：另開 process，用 DATABASE_URL 指到臨時檔案，
+# 走的是跟正式環境一樣的 settings（WAL + busy_timeout + IMMEDIATE）。
+
+CONCURRENT_WRITERS_SCRIPT = """
+import threading
+import django
+django.setup()
+from django.db import connection, connections, transaction
+
+WRITERS, ROUNDS = 8, 25
+
+with connection.cursor() as cursor:
+    cursor.execute("CREATE TABLE counter (id INTEGER PRIMARY KEY, n INTEGER NOT NULL)")
+    cursor.execute("INSERT INTO counter (id, n) VALUES (1, 0)")
+    cursor.execute("PRAGMA journal_mode")
+    assert cursor.fetchone()[0] == "wal"
+
+errors = []
+start = threading.Barrier(WRITERS)
+
+def writer():
+    start.wait()
+    try:
+        for _ in range(ROUNDS):
+            # 先讀再寫：DEFERRED 交易在這裡升級鎖時會直接 database is locked
+            with transaction.atomic():
+                with connection.cursor() as cursor:
+                    cursor.execute("SELECT n FROM counter WHERE id = 1")
+                    n = cursor.fetchone()[0]
+                    cursor.execute("UPDATE counter SET n = %s WHERE id = 1", [n + 1])
+    except Exception as e:
+        errors.append(repr(e))
+    finally:
+        connections.close_all()
+
+threads = [threading.Thread(target=writer) for _ in range(WRITERS)]
+for t in threads:
+    t.start()
+for t in threads:
+    t.join()
+
+with connection.cursor() as cursor:
+    cursor.execute("SELECT n FROM counter WHERE id = 1")
+    print(cursor.fetchone()[0], len(errors), errors[:3])
+"""
+
+
+class SQLiteConcurrentWriteTests(SimpleTestCase):
+
+    def test_parallel_read_modify_write_does_not_lock(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            env = dict(
+                os.environ,
+                DJANGO_SETTINGS_MODULE="hospitalsys.settings",
+                # tmp 是絕對路徑，所以會變成 sqlite:////tmp/...
+                DATABASE_URL=f"sqlite:///{tmp}/concurrency.sqlite3",
+            )
+            result = subprocess.run(
+                [sys.executable, "-c", CONCURRENT_WRITERS_SCRIPT],
+                cwd=settings.BASE_DIR, env=env, capture_output=True, text=True, timeout=120,
+            )
+        self.assertEqual(result.returncode, 0, result.stderr)
+        total, error_count, samples = result.stdout.split(" ", 2)
+        self.assertEqual(int(error_count), 0, samples)
+        self.assertEqual(int(total), 8 * 25)
+
+
+# ---------------------------------------------------------------------------
+# 讀取 replica：primary / replica 各一個 SQLite 檔，replica 只同步到某個時間點，
+# 所以讀到哪一邊可以直接從資料看出來。
+
+REPLICA_SCRIPT = """
+import json
+import django
+django.setup()
+from django.contrib.auth.models import Group, User
+from django.core.management import call_command
+from django.db import transaction
+from django.test import Client
+from django.test.utils import override_settings, setup_test_environment
+from django.urls import reverse
+
+from common.routers import replica
+from inventory.models import Drug
+
+setup_test_environment()
+call_command("migrate", verbosity=0)
+user = User.objects.create_user("pharm")
+user.groups.add(Group.objects.create(name="PHARMACY"))
+Drug.objects.create(code="S1", name="synced")
+call_command("sync_replica", verbosity=0)
+Drug.objects.create(code="P1", name="primary only")
+
+out = {}
+with replica():
+    out["replica_read"] = Drug.objects.filter(code="P1").exists()
+    with transaction.atomic():
+        out["read_in_atomic"] = Drug.objects.filter(code="P1").exists()
+    Drug.objects.create(code="P2", name="written in scope")
+    out["read_after_write"] = Drug.objects.filter(code="P1").exists()
+out["replica_drugs"] = Drug.objects.using("replica").count()
+
+storages = {
+    "default": {"BACKEND": "django.core.files.storage.FileSystemStorage"},
+    "staticfiles": {"BACKEND": "django.contrib.staticfiles.storage.StaticFilesStorage"},
+}
+with override_settings(STORAGES=storages, PROFILING_SLOW_LOG=None, METRICS_DIR=""):
+    client = Client()
+    client.force_login(user)
+    out["dashboard"] = client.get(reverse("inventory:dashboard")).context["total_drugs"]
+    client.post(reverse("inventory:stock_history"))
+    out["dashboard_after_post"] = client.get(reverse("inventory:dashboard")).context["total_drugs"]
+
+print(json.dumps(out))
+"""
+
+
+class ReplicaRoutingTests(SimpleTestCase):
+
+    def test_reporting_reads_go_to_replica_but_read_after_write_stays_on_primary(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            env = dict(
+                os.environ,
+                DJANGO_SETTINGS_MODULE="hospitalsys.settings",
+                DATABASE_URL=f"sqlite:///{tmp}/primary.sqlite3",
+                DATABASE_REPLICA_URL=f"sqlite:///{tmp}/replica.sqlite3",
+            )
+            result = subprocess.run(
+                [sys.executable, "-c", REPLICA_SCRIPT],
+                cwd=settings.BASE_DIR, env=env, capture_output=True, text=True, timeout=120,
+            )
+        self.assertEqual(result.returncode, 0, result.stderr)
+        out = json.loads(result.stdout.strip().splitlines()[-1])
+
+        self.assertFalse(out["replica_read"])
+        self.assertTrue(out["read_in_atomic"])
+        self.assertTrue(out["read_after_write"])
+        self.assertEqual(out["replica_drugs"], 1)
+        # dashboard 走 replica（只有同步時的 1 筆）；POST 之後 pin 在 primary（3 筆）
+        self.assertEqual(out["dashboard"], 1)
+        self.assertEqual(out["dashboard_after_post"], 3)
+
+
+class PurgeSessionsTests(TestCase):
+    def test_deletes_only_expired_sessions_in_batches(self):
+        now = timezone.now()
+        for i in range(5):
+            Session.objects.create(session_key=f"old{i}", session_data="", expire_date=now - timedelta(days=1))
+        Session.objects.create(session_key="live", session_data="", expire_date=now + timedelta(days=1))
+
+        with override_settings(SESSION_ENGINE="django.contrib.sessions.backends.db"):
+            call_command("purge_sessions", batch_size=2, stdout=StringIO())
+
+        self.assertEqual(list(Session.objects.values_list("session_key", flat=True)), ["live"])
+
+
+class QueryProfilingTests(TestCase):
+    def test_recorder_counts_and_keeps_slowest(self):
+        Drug.objects.create(code="A1", name="Aspirin")
+        with QueryRecorder(top_n=2) as recorder:
+            for _ in range(3):
+                list(Drug.objects.all())
+            Drug.objects.count()
+        self.assertEqual(recorder.count, 4)
+        self.assertGreater(recorder.total_ms, 0)
+
+        slowest = recorder.slowest()
+        self.assertEqual(len(slowest), 2)
+        self.assertGreaterEqual(slowest[0]["ms"], slowest[1]["ms"])
+        self.assertEqual({q["db"] for q in slowest}, {"default"})
+
+        # 離開之後不再記錄
+        Drug.objects.count()
+        self.assertEqual(recorder.count, 4)
+
+    @override_settings(METRICS_DIR="", STORAGES=TEST_STORAGES)
+    def test_middleware_is_off_by_default(self):
+        self.assertFalse(settings.PROFILING_ENABLED)
+        response = self.client.get(reverse("public:home"))
+        self.assertNotIn("X-Query-Count", response)
+
+    def test_middleware_header_and_slow_log(self):
+        user = User.objects.create_user("pharm")
+        user.groups.add(Group.objects.create(name="PHARMACY"))
+        self.client.force_login(user)
+
+        with tempfile.TemporaryDirectory() as tmp:
+            log = os.path.join(tmp, "slow.jsonl")
+            with override_settings(
+                PROFILING_ENABLED=True, PROFILING_QUERY_COUNT_HEADER=True, PROFILING_SLOW_QUERY_COUNT=1,
+                PROFILING_SLOW_REQUEST_MS=60_000, PROFILING_SLOW_LOG=log, METRICS_DIR="", STORAGES=TEST_STORAGES,
+            ):
+                response = self.client.get(reverse("inventory:dashboard"))
+                with open(log, encoding="utf-8") as fp:
+                    [record] = [json.loads(line) for line in fp]
+
+        count = int(response["X-Query-Count"])
+        self.assertGreater(count, 0)
+        self.assertIn("X-Query-Time-Ms", response)
+        self.assertEqual(record["view"], "inventory:dashboard")
+        self.assertEqual(record["user"], "pharm")
+        self.assertEqual(record["query_count"], count)
+        self.assertLessEqual(len(record["slowest"]), settings.PROFILING_TOP_QUERIES)
+
+
+class MetricsTests(TestCase):
+    def test_render_prometheus(self):
+        registry = metrics.MetricsRegistry()
+        registry.inc(metrics.STOCK_TRANSACTIONS, 2, reason="dispense")
+        registry.inc(metrics.HTTP_REQUESTS, view='a"b', method="GET", status=200)
+        registry.observe(metrics.HTTP_LATENCY, 0.02, (0.01, 0.05), view="x")
+        registry.observe(metrics.HTTP_LATENCY, 0.5, (0.01, 0.05), view="x")
+
+        with override_settings(METRICS_DIR=""):
+            body = metrics.render_prometheus(registry.collect())
+
+        self.assertIn(f"# TYPE {metrics.STOCK_TRANSACTIONS} counter", body)
+        self.assertIn(f'{metrics.STOCK_TRANSACTIONS}{{reason="dispense"}} 2', body)
+        self.assertIn('view="a\\"b"', body)
+        self.assertIn(f'{metrics.HTTP_LATENCY}_bucket{{view="x",le="0.01"}} 0', body)
+        self.assertIn(f'{metrics.HTTP_LATENCY}_bucket{{view="x",le="0.05"}} 1', body)
+        self.assertIn(f'{metrics.HTTP_LATENCY}_bucket{{view="x",le="+Inf"}} 2', body)
+        self.assertIn(f'{metrics.HTTP_LATENCY}_count{{view="x"}} 2', body)
+
+    def test_files_from_all_workers_are_summed_and_dead_ones_retired(self):
+        # 一個跑完的子 process 當作已經結束的 worker，父 process 當作還活著的另一個 worker
+        dead = subprocess.Popen([sys.executable, "-c", "pass"])
+        dead.wait()
+
+        def worker_file(directory, pid, token, value):
+            registry = metrics.MetricsRegistry()
+            registry.inc(metrics.TICKETS_CALLED, value)
+            with open(os.path.join(directory, f"metrics-{pid}-{token}.json"), "w") as fp:
+                json.dump(registry.snapshot(), fp)
+
+        with tempfile.TemporaryDirectory() as tmp, override_settings(METRICS_DIR=tmp):
+            worker_file(tmp, dead.pid, "aa", 3)
+            worker_file(tmp, os.getppid(), "bb", 5)
+            # 同一個 PID 的舊檔（PID 被重複使用）
+            worker_file(tmp, os.getppid(), "cc", 7)
+            os.utime(os.path.join(tmp, f"metrics-{os.getppid()}-cc.json"), (0, 0))
+
+            registry = metrics.MetricsRegistry()
+            registry.inc(metrics.TICKETS_CALLED, 1)
+            key = (metrics.TICKETS_CALLED, ())
+            self.assertEqual(registry.collect()["counters"][key], 16)
+
+            files = sorted(os.listdir(tmp))
+            self.assertIn(metrics.RETIRED_FILE, files)
+            self.assertNotIn(f"metrics-{dead.pid}-aa.json", files)
+            self.assertNotIn(f"metrics-{os.getppid()}-cc.json", files)
+            self.assertIn(f"metrics-{os.getppid()}-bb.json", files)
+
+            # 再收一次：總數不變，retired 不會重複加
+            self.assertEqual(registry.collect()["counters"][key], 16)
+
+    @override_settings(METRICS_DIR="", METRICS_TOKEN="s3cret")
+    def test_view_requires_token_or_staff(self):
+        url = reverse("metrics")
+        self.assertEqual(self.client.get(url).status_code, 403)
+        self.assertEqual(self.client.get(url, HTTP_AUTHORIZATION="Bearer wrong").status_code, 403)
+
+        response = self.client.get(url, HTTP_AUTHORIZATION="Bearer s3cret")
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response["Content-Type"].startswith("text/plain; version=0.0.4"))
+
+        self.client.force_login(User.objects.create_user("clerk"))
+        self.assertEqual(self.client.get(url).status_code, 403)
+        self.client.force_login(User.objects.create_user("ops", is_staff=True))
+        self.assertEqual(self.client.get(url).status_code, 200)
+
+        with override_settings(METRICS_TOKEN=""):
+            self.client.logout()
+            self.assertEqual(self.client.get(url, HTTP_AUTHORIZATION="Bearer ").status_code, 403)
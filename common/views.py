@@ -1,3 +1,20 @@
-from django.shortcuts import render
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseForbidden
+from django.utils.crypto import constant_time_compare
 
-# Create your views here.
+from . import metrics
+
+
+def metrics_view(request):
+    """
+    Prometheus text format。
+    用 Authorization: Bearer <METRICS_TOKEN> 抓取，或以 staff 帳號登入瀏覽。
+    """
+    token = getattr(settings, "METRICS_TOKEN", "")
+    auth = request.headers.get("Authorization", "")
+    token_ok = bool(token) and constant_time_compare(auth, f"Bearer {token}")
+    if not token_ok and not (request.user.is_authenticated and request.user.is_staff):
+        return HttpResponseForbidden("forbidden")
+
+    body = metrics.render_prometheus(metrics.registry.collect())
+    return HttpResponse(body, content_type="text/plain; version=0.0.4; charset=utf-8")
@@ -1,12 +1,46 @@
 from __future__ import annotations
 
-import random
+import secrets
+
 from django import forms
+from django.conf import settings
 from django.contrib.auth.forms import AuthenticationForm
+from django.core import signing
+from django.core.cache import cache
 from django.core.exceptions import ValidationError
 
-CAPTCHA_SESSION_KEY = "login_captcha_answer"
-CAPTCHA_QUESTION_KEY = "login_captcha_question"
+CAPTCHA_SALT = "core.login_captcha"
+CAPTCHA_REPLAY_PREFIX = "login_captcha_used:"
+
+
+def make_captcha():
+    """
+    出一題加法，回傳 (題目, token)。
+    token 是 HMAC 簽過、帶時間戳的 "a:b:nonce"，放在表單 hidden 欄位；
+    伺服器不用存任何東西，登入頁 GET 就不會產生 session。
+    """
+    a = 2 + secrets.randbelow(8)
+    b = 1 + secrets.randbelow(9)
+    nonce = secrets.token_urlsafe(12)
+    token = signing.TimestampSigner(salt=CAPTCHA_SALT).sign(f"{a}:{b}:{nonce}")
+    return f"{a} + {b} = ?", token
+
+
+def check_captcha(token, answer):
+    """驗證 token 與答案；同一個 token 只能用一次（不論答對答錯）。"""
+    try:
+        value = signing.TimestampSigner(salt=CAPTCHA_SALT).unsign(
+            token, max_age=settings.LOGIN_CAPTCHA_MAX_AGE
+        )
+        a, b, nonce = value.split(":")
+    except (signing.BadSignature, ValueError):
+        return False
+
+    # replay cache：多個 worker 時要用共用的 CACHE_URL（redis）才擋得住跨 worker 重送
+    if not cache.add(CAPTCHA_REPLAY_PREFIX + nonce, 1, settings.LOGIN_CAPTCHA_MAX_AGE):
+        return False
+
+    return answer == str(int(a) + int(b))
 
 
 class CaptchaAuthenticationForm(AuthenticationForm):
@@ -22,6 +56,7 @@ class CaptchaAuthenticationForm(AuthenticationForm):
             "placeholder": "請輸入答案",
         })
     )
+    captcha_token = forms.CharField(required=False, widget=forms.HiddenInput)
 
     def __init__(self, request=None, *args, **kwargs):
         super().__init__(request, *args, **kwargs)
@@ -30,33 +65,14 @@ class CaptchaAuthenticationForm(AuthenticationForm):
         self.fields["username"].widget.attrs.update({"autocomplete": "username"})
         self.fields["password"].widget.attrs.update({"autocomplete": "current-password"})
 
-        
-        if request is not None:
-            sess = request.session
-            if CAPTCHA_SESSION_KEY not in sess or CAPTCHA_QUESTION_KEY not in sess:
-                a = random.randint(2, 9)
-                b = random.randint(1, 9)
-                sess[CAPTCHA_SESSION_KEY] = str(a + b)
-                sess[CAPTCHA_QUESTION_KEY] = f"{a} + {b} = ?"
-                sess.modified = True
+        # 每次顯示表單都出新題目（送出過的 token 已經不能再用）
+        self.captcha_question, self.captcha_new_token = make_captcha()
 
     def clean(self):
-        cleaned = super().clean()
-
-        request = getattr(self, "request", None)
-        if request is None:
-            raise ValidationError("系統無法取得驗證資訊，請重新整理後再試。")
-
-        expected = request.session.get(CAPTCHA_SESSION_KEY)
+        # 先擋人機驗證，錯了就不用去算密碼雜湊
+        token = self.cleaned_data.get("captcha_token") or ""
         got = (self.cleaned_data.get("captcha") or "").strip()
+        if not check_captcha(token, got):
+            raise ValidationError("人機驗證答案錯誤或已過期，請再試一次。")
 
-        if not expected or got != str(expected):
-           
-            a = random.randint(2, 9)
-            b = random.randint(1, 9)
-            request.session[CAPTCHA_SESSION_KEY] = str(a + b)
-            request.session[CAPTCHA_QUESTION_KEY] = f"{a} + {b} = ?"
-            request.session.modified = True
-            raise ValidationError("人機驗證答案錯誤，請再試一次。")
-
-        return cleaned
+        return super().clean()
@@ -1,3 +1,68 @@
-from django.test import TestCase
+from django.contrib.auth.models import User
+from django.core import signing
+from django.core.cache import cache
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
 
-# Create your tests here.
+from .forms import CAPTCHA_SALT, make_captcha
+
+TEST_STORAGES = {
+    "default": {"BACKEND": "django.core.files.storage.FileSystemStorage"},
+    "staticfiles": {"BACKEND": "django.contrib.staticfiles.storage.StaticFilesStorage"},
+}
+
+
+def answer_for(token):
+    a, b, _ = signing.TimestampSigner(salt=CAPTCHA_SALT).unsign(token).split(":")
+    return str(int(a) + int(b))
+
+
+@override_settings(PROFILING_SLOW_LOG=None, METRICS_DIR="", STORAGES=TEST_STORAGES)
+class LoginCaptchaTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        User.objects.create_user(username="staff", password="pw-123456")
+
+    def setUp(self):
+        cache.clear()
+
+    def _post(self, token, answer, password="pw-123456"):
+        return self.client.post(reverse("login"), {
+            "username": "staff", "password": password,
+            "captcha": answer, "captcha_token": token,
+        })
+
+    def test_login_page_does_not_touch_the_database(self):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(reverse("login"))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(ctx.captured_queries, [])
+        self.assertNotIn("sessionid", response.cookies)
+        self.assertContains(response, response.context["form"].captcha_question)
+
+    def test_correct_answer_logs_in_once(self):
+        _, token = make_captcha()
+        response = self._post(token, answer_for(token))
+        self.assertRedirects(response, "/internal/", fetch_redirect_response=False)
+
+        # 同一個 token 重送會被 replay cache 擋下
+        self.client.logout()
+        response = self._post(token, answer_for(token))
+        self.assertEqual(response.status_code, 200)
+        self.assertIn("人機驗證答案錯誤或已過期，請再試一次。", response.context["form"].non_field_errors())
+
+    def test_rejects_wrong_tampered_and_expired_tokens(self):
+        _, token = make_captcha()
+        wrong = str(int(answer_for(token)) + 1)
+        self.assertEqual(self._post(token, wrong).status_code, 200)
+
+        _, token = make_captcha()
+        self.assertEqual(self._post(token[:-2] + "xx", answer_for(token)).status_code, 200)
+
+        _, token = make_captcha()
+        with self.settings(LOGIN_CAPTCHA_MAX_AGE=-1):
+            self.assertEqual(self._post(token, answer_for(token)).status_code, 200)
+
+        self.assertNotIn("_auth_user_id", self.client.session)
@@ -13,6 +13,8 @@ https://docs.djangoproject.com/en/5.2/ref/settings/
 import os
 from pathlib import Path
 
+from .database import database_config
+
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
@@ -54,6 +56,8 @@ INSTALLED_APPS = [
 
 
 MIDDLEWARE = [
+    "common.middleware.QueryProfilingMiddleware",
+    "common.middleware.MetricsMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "whitenoise.middleware.WhiteNoiseMiddleware",
 
@@ -61,6 +65,7 @@ MIDDLEWARE = [
     "django.middleware.common.CommonMiddleware",
     "django.middleware.csrf.CsrfViewMiddleware",
     "django.contrib.auth.middleware.AuthenticationMiddleware",
+    "common.middleware.ReplicaPinMiddleware",
     # "common.middleware.LoginRequiredMiddleware",
     "django.contrib.messages.middleware.MessageMiddleware",
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
@@ -70,11 +75,19 @@ MIDDLEWARE = [
 
 ROOT_URLCONF = 'hospitalsys.urls'
 
+# 正式環境明確用 cached loader：模板只 parse 一次，之後每個 request 直接拿編譯好的版本；
+# DEBUG 時每次重新讀檔，改模板不用重啟
+_template_loaders = [
+    "django.template.loaders.filesystem.Loader",
+    "django.template.loaders.app_directories.Loader",
+]
+if not DEBUG:
+    _template_loaders = [("django.template.loaders.cached.Loader", _template_loaders)]
+
 TEMPLATES = [
     {
         "BACKEND": "django.template.backends.django.DjangoTemplates",
         "DIRS": [BASE_DIR / "templates"],
-        "APP_DIRS": True,
         "OPTIONS": {
             "context_processors": [
                 "django.template.context_processors.debug",
@@ -82,6 +95,7 @@ TEMPLATES = [
                 "django.contrib.auth.context_processors.auth",
                 "django.contrib.messages.context_processors.messages",
             ],
+            "loaders": _template_loaders,
         },
     },
 ]
@@ -92,13 +106,54 @@ WSGI_APPLICATION = 'hospitalsys.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
 
+# DATABASE_URL 沒設定時用 BASE_DIR/db.sqlite3；格式與調整參數見 hospitalsys/database.py
+
 DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
-    }
+    "default": database_config(os.environ.get("DATABASE_URL", ""), BASE_DIR),
 }
 
+# 報表類 view（@use_replica）的唯讀 replica；本機可指到第二個 SQLite 檔，再用 sync_replica 同步
+DATABASE_REPLICA_URL = os.environ.get("DATABASE_REPLICA_URL", "")
+if DATABASE_REPLICA_URL:
+    DATABASES["replica"] = database_config(DATABASE_REPLICA_URL, BASE_DIR)
+    DATABASES["replica"]["TEST"] = {"MIRROR": "default"}
+
+DATABASE_ROUTERS = ["common.routers.ReplicaRouter"]
+REPLICA_PIN_SECONDS = int(os.environ.get("REPLICA_PIN_SECONDS", "10"))
+
+
+# 快取：CACHE_URL 可用 redis://host:6379/0（需要 redis 套件）或 file:///path；
+# 沒設定時是每個 process 各自一份的 LocMemCache，多個 gunicorn worker 時建議用 redis。
+CACHE_URL = os.environ.get("CACHE_URL", "")
+CACHE_TIMEOUT = int(os.environ.get("CACHE_TIMEOUT", "300"))
+
+if CACHE_URL.startswith(("redis://", "rediss://")):
+    _cache = {"BACKEND": "django.core.cache.backends.redis.RedisCache", "LOCATION": CACHE_URL}
+elif CACHE_URL.startswith("file://"):
+    _cache = {"BACKEND": "django.core.cache.backends.filebased.FileBasedCache", "LOCATION": CACHE_URL[len("file://"):]}
+else:
+    _cache = {"BACKEND": "django.core.cache.backends.locmem.LocMemCache", "LOCATION": "hospitalsys"}
+
+# fragments：模板片段快取（{% cache ... using="fragments" %}），key 帶版本號，見 common/fragments.py
+_fragment_cache = dict(_cache)
+if _fragment_cache["BACKEND"].endswith("LocMemCache"):
+    _fragment_cache["LOCATION"] = "hospitalsys-fragments"
+
+CACHES = {
+    "default": {**_cache, "TIMEOUT": CACHE_TIMEOUT, "KEY_PREFIX": "hospitalsys"},
+    "fragments": {**_fragment_cache, "TIMEOUT": CACHE_TIMEOUT, "KEY_PREFIX": "hospitalsys-fragments"},
+}
+
+# Session：SESSION_BACKEND=db / cached_db / signed_cookies
+# - cached_db：讀 session 走快取，只有寫入才碰 DB；多個 worker 要設共用的 CACHE_URL，
+#   不然各 worker 的記憶體快取會各拿到舊版 session，所以沒設 CACHE_URL 時預設用 db
+# - signed_cookies：伺服器端完全不存；代價是登出只清 cookie，舊 cookie 在過期前仍有效
+SESSION_BACKENDS = ("db", "cached_db", "signed_cookies")
+SESSION_BACKEND = os.environ.get("SESSION_BACKEND", "cached_db" if CACHE_URL else "db")
+if SESSION_BACKEND not in SESSION_BACKENDS:
+    raise ValueError(f"不支援的 SESSION_BACKEND：{SESSION_BACKEND!r}（可用 {', '.join(SESSION_BACKENDS)}）")
+SESSION_ENGINE = f"django.contrib.sessions.backends.{SESSION_BACKEND}"
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
@@ -144,5 +199,33 @@ LOGIN_URL = "/login/"
 LOGIN_REDIRECT_URL = "/internal/"
 LOGOUT_REDIRECT_URL = "/internal/"
 
+# 登入頁的人機驗證題目有效秒數（題目簽章放在表單 hidden 欄位，不寫 session）
+LOGIN_CAPTCHA_MAX_AGE = int(os.environ.get("LOGIN_CAPTCHA_MAX_AGE", "600"))
+
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
+
+
+# 網頁匯入病人的檔案上限（bytes，預設 5 MB，約 4 萬筆）；匯入是在 request 裡同步跑的，
+# 更大的檔案用 python manage.py import_patients，才不會超過 worker timeout
+PATIENT_IMPORT_MAX_UPLOAD_BYTES = int(os.environ.get("PATIENT_IMPORT_MAX_UPLOAD_BYTES", str(5 * 1024 * 1024)))
+
+
+# 藥師審核通過時保留庫存的時數，逾時沒領藥就不再佔用批次（inventory.reservations）
+STOCK_RESERVATION_HOURS = int(os.environ.get("STOCK_RESERVATION_HOURS", "24"))
+
+
+# 效能剖析（common.middleware.QueryProfilingMiddleware）：預設關閉，要量的時候再用環境變數打開；
+# X-Query-Count / X-Query-Time-Ms header 連匿名的公開頁面都會帶，正式環境不要開
+PROFILING_ENABLED = os.environ.get("PROFILING_ENABLED", "0") == "1"
+PROFILING_SLOW_REQUEST_MS = int(os.environ.get("PROFILING_SLOW_REQUEST_MS", "500"))
+PROFILING_SLOW_QUERY_COUNT = int(os.environ.get("PROFILING_SLOW_QUERY_COUNT", "50"))
+PROFILING_TOP_QUERIES = int(os.environ.get("PROFILING_TOP_QUERIES", "5"))
+PROFILING_SLOW_LOG = os.environ.get("PROFILING_SLOW_LOG", str(BASE_DIR / "logs" / "slow_requests.jsonl"))
+PROFILING_QUERY_COUNT_HEADER = os.environ.get("PROFILING_QUERY_COUNT_HEADER", "0") == "1"
+
+# Prometheus 指標（/internal/metrics/）
+METRICS_ENABLED = os.environ.get("METRICS_ENABLED", "1") == "1"
+METRICS_DIR = os.environ.get("METRICS_DIR", str(BASE_DIR / "logs" / "metrics"))
+METRICS_FLUSH_SECONDS = float(os.environ.get("METRICS_FLUSH_SECONDS", "2"))
+METRICS_TOKEN = os.environ.get("METRICS_TOKEN", "")
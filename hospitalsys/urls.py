@@ -5,6 +5,7 @@ from django.contrib.auth import logout
 from django.shortcuts import redirect
 from core.views import index
 from core.forms import CaptchaAuthenticationForm
+from common.views import metrics_view
 
 
 def logout_view(request):
@@ -15,6 +16,7 @@ def logout_view(request):
 urlpatterns = [
     path("admin/", admin.site.urls),
     path("internal/", index, name="index"),
+    path("internal/metrics/", metrics_view, name="metrics"),
 
     path(
         "login/",
@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import Drug, StockTransaction
+from .models import AllergenSynonym, Drug, StockReservation, StockTransaction
 from .models import StockBatch
 
 
@@ -34,3 +34,17 @@ class StockBatchAdmin(admin.ModelAdmin):
     list_display = ("drug", "batch_no", "expiry_date", "quantity")
     list_filter = ("expiry_date", "drug")
     search_fields = ("drug__name", "batch_no")
+
+
+@admin.register(StockReservation)
+class StockReservationAdmin(admin.ModelAdmin):
+    list_display = ("prescription", "batch", "quantity", "status", "expires_at", "created_at")
+    list_filter = ("status",)
+    search_fields = ("batch__drug__name", "batch__batch_no")
+    raw_id_fields = ("batch", "prescription", "item")
+
+
+@admin.register(AllergenSynonym)
+class AllergenSynonymAdmin(admin.ModelAdmin):
+    list_display = ("term", "generic_name")
+    search_fields = ("term", "generic_name")
@@ -0,0 +1,198 @@
+"""
+庫存三層帳對帳：藥品總量（Drug.stock_quantity）、批次加總（StockBatch.quantity）、
+異動紀錄加總（StockTransaction.change）。
+
+手動調整（adjust_stock）和以前的 drug_create 只改藥品總量、寫沒有批次的異動，init_batches.py 又是另一套，
+三層常常對不起來。這裡以批次為準（FEFO 發藥、退藥都只看批次）：
+
+- 批次帳：每個批次的 quantity 要等於這個批次的異動加總，差額補一筆同批次的校正異動
+- 沒有批次的異動加總是正的：庫存還在、只是不知道在哪個批次，移到一個隔離中的「對帳暫存」批次
+  （效期先填當天），由藥師確認批號、效期後再解除隔離；不會直接沖掉
+- 沒有批次的異動加總是負的：不知道是從哪個批次扣的，只回報、不修，要人工處理
+- 藥品總量：改成批次加總（同 refresh_stock_quantity）
+
+整個檢查是五個 query（批次、藥品各讀一次，異動紀錄兩個 GROUP BY，再加一個查不明的異動原因），
+跟藥品、批次數量無關；修正時先鎖住批次和藥品再讀帳（見 check_inventory），寫入用 bulk。
+"""
+
+from collections import defaultdict
+from dataclasses import dataclass, field
+
+from django.db import transaction
+from django.db.models import Count, Sum
+from django.utils import timezone
+
+from common import fragments, metrics
+
+from .models import Drug, StockBatch, StockTransaction
+
+REPAIR_REASON = "adjust"
+PLACEHOLDER_BATCH_NO = "對帳暫存"
+
+
+@dataclass
+class BatchDrift:
+    batch_id: int
+    drug_id: int
+    batch_no: str
+    quantity: int
+    ledger: int
+
+    @property
+    def diff(self):
+        return self.quantity - self.ledger
+
+
+@dataclass
+class DrugDrift:
+    drug_id: int
+    code: str
+    name: str
+    stock_quantity: int
+    batch_total: int
+    ledger_total: int
+    unbatched: int
+
+    @property
+    def needs_review(self):
+        return self.unbatched < 0
+
+
+@dataclass
+class InventoryReport:
+    batches: list = field(default_factory=list)
+    drugs: list = field(default_factory=list)
+    unknown_reasons: dict = field(default_factory=dict)
+    checked_drugs: int = 0
+    checked_batches: int = 0
+
+    @property
+    def ok(self):
+        return not (self.batches or self.drugs or self.unknown_reasons)
+
+
+def check_inventory(*, lock=False):
+    """
+    lock=True 要在 transaction 裡呼叫：先鎖住全部批次、再鎖全部藥品（跟發藥、進貨、退藥同一個順序，
+    不會互相卡死），之後才讀異動紀錄。扣庫存、進貨都會改批次或藥品那一列，鎖住後就沒有人能在
+    兩個 query 之間 commit，READ COMMITTED 下讀到的也是同一個時間點的帳。
+    沒鎖（只回報）時剛好碰上發藥可能多報一筆，重跑就不見；修正一定要 lock=True。
+    """
+    report = InventoryReport()
+
+    batches = StockBatch.objects.order_by("pk").values_list("id", "drug_id", "batch_no", "quantity")
+    drugs = Drug.objects.order_by("pk").values_list("id", "code", "name", "stock_quantity")
+    if lock:
+        batches = batches.select_for_update()
+        drugs = drugs.select_for_update()
+    batches = list(batches)
+    drugs = list(drugs)
+
+    ledger_by_batch = dict(
+        StockTransaction.objects
+        .filter(batch__isnull=False)
+        .order_by()
+        .values("batch_id")
+        .annotate(total=Sum("change"))
+        .values_list("batch_id", "total")
+    )
+    unbatched = dict(
+        StockTransaction.objects
+        .filter(batch__isnull=True)
+        .order_by()
+        .values("drug_id")
+        .annotate(total=Sum("change"))
+        .values_list("drug_id", "total")
+    )
+
+    batch_total = defaultdict(int)
+    ledger_total = defaultdict(int)
+    for batch_id, drug_id, batch_no, quantity in batches:
+        report.checked_batches += 1
+        ledger = ledger_by_batch.get(batch_id) or 0
+        batch_total[drug_id] += quantity
+        ledger_total[drug_id] += ledger
+        if quantity != ledger:
+            report.batches.append(BatchDrift(batch_id, drug_id, batch_no, quantity, ledger))
+
+    for drug_id, code, name, stock_quantity in sorted(drugs, key=lambda row: row[1]):
+        report.checked_drugs += 1
+        loose = unbatched.get(drug_id) or 0
+        total = ledger_total[drug_id] + loose
+        if stock_quantity != batch_total[drug_id] or total != batch_total[drug_id]:
+            report.drugs.append(DrugDrift(
+                drug_id, code, name, stock_quantity, batch_total[drug_id], total, loose,
+            ))
+
+    valid = [value for value, _ in StockTransaction.REASON_CHOICES]
+    report.unknown_reasons = dict(
+        StockTransaction.objects
+        .exclude(reason__in=valid)
+        .order_by()
+        .values("reason")
+        .annotate(n=Count("id"))
+        .values_list("reason", "n")
+    )
+    return report
+
+
+@transaction.atomic
+def repair_inventory(operator=None):
+    """
+    在同一個 transaction 裡重新對帳，補校正異動、改藥品總量；回傳 (對帳結果, 新增的異動筆數)。
+    needs_review 的藥品和異動原因不在 REASON_CHOICES 的舊資料只回報、不改。
+    """
+    report = check_inventory(lock=True)
+    today = timezone.localdate()
+    entries = [
+        StockTransaction(
+            drug_id=d.drug_id,
+            batch_id=d.batch_id,
+            change=d.diff,
+            reason=REPAIR_REASON,
+            note=f"對帳校正：批次 {d.batch_no or '-'} 庫存 {d.quantity}，異動紀錄加總 {d.ledger}",
+            operator=operator,
+        )
+        for d in report.batches
+    ]
+
+    loose = [d for d in report.drugs if d.unbatched > 0]
+    placeholders = StockBatch.objects.bulk_create([
+        StockBatch(
+            drug_id=d.drug_id,
+            batch_no=PLACEHOLDER_BATCH_NO,
+            expiry_date=today,
+            quantity=d.unbatched,
+            status=StockBatch.STATUS_QUARANTINE,
+            quarantine_reason="source",
+            quarantine_note="對帳：沒有批次的庫存，請確認批號、效期後再解除隔離",
+        )
+        for d in loose
+    ])
+    for d, batch in zip(loose, placeholders):
+        # 一進一出：整個藥品的異動加總不變，沒有批次的部分歸零、暫存批次對得上
+        entries.append(StockTransaction(
+            drug_id=d.drug_id, change=-d.unbatched, reason=REPAIR_REASON, operator=operator,
+            note=f"對帳校正：沒有批次的庫存 {d.unbatched} 移到暫存批次",
+        ))
+        entries.append(StockTransaction(
+            drug_id=d.drug_id, batch_id=batch.pk, change=d.unbatched, reason=REPAIR_REASON, operator=operator,
+            note="對帳校正：沒有批次的庫存移入",
+        ))
+    StockTransaction.objects.bulk_create(entries)
+
+    drugs = []
+    for d in report.drugs:
+        if d.needs_review:
+            continue
+        total = d.batch_total + max(d.unbatched, 0)
+        if d.stock_quantity != total:
+            drugs.append(Drug(pk=d.drug_id, stock_quantity=total))
+    Drug.objects.bulk_update(drugs, ["stock_quantity"], batch_size=500)
+
+    if entries or drugs:
+        fragments.bump(fragments.DRUGS, fragments.STOCK)
+    if entries:
+        # bulk_create 不會觸發 post_save 的計數
+        metrics.inc(metrics.STOCK_TRANSACTIONS, len(entries), reason=REPAIR_REASON)
+    return report, len(entries)
@@ -18,7 +18,27 @@ class DrugForm(forms.ModelForm):
 
 
 
-        
+class DrugCreateForm(DrugForm):
+    """新增藥品時可以順便填初始庫存，會建成一個批次（跟進貨一樣），所以要填效期。"""
+    initial_quantity = forms.IntegerField(
+        label="初始庫存",
+        min_value=0,
+        required=False,
+        widget=forms.NumberInput(attrs={"class": "form-control"}),
+    )
+    initial_expiry_date = forms.DateField(
+        label="初始庫存有效期限",
+        required=False,
+        widget=forms.DateInput(attrs={"class": "form-control", "type": "date"}),
+    )
+
+    def clean(self):
+        cleaned = super().clean()
+        if cleaned.get("initial_quantity") and not cleaned.get("initial_expiry_date"):
+            self.add_error("initial_expiry_date", "有初始庫存時必須填有效期限")
+        return cleaned
+
+
 class StockAdjustForm(forms.Form):
     """
     給庫存調整用的表單 ：
@@ -28,7 +48,8 @@ class StockAdjustForm(forms.Form):
     """
     reason = forms.ChoiceField(
         label="異動類型",
-        choices=StockTransaction.REASON_CHOICES,
+        # 「初始庫存」只在新增藥品時由系統寫入
+        choices=[c for c in StockTransaction.REASON_CHOICES if c[0] != "initial"],
         widget=forms.Select(attrs={"class": "form-select"}),
     )
     quantity = forms.IntegerField(
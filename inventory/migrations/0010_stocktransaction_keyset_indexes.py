@@ -0,0 +1,28 @@
+# Generated by Django 5.2.8 on 2026-10-19 06:49
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventory', '0009_alter_stockbatch_quarantine_note_and_more'),
+        ('prescriptions', '0012_prescriptionitem_days_supply_and_more'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='stocktransaction',
+            index=models.Index(fields=['created_at', 'id'], name='inventory_s_created_33a470_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='stocktransaction',
+            index=models.Index(fields=['drug', 'created_at', 'id'], name='inventory_s_drug_id_6cd9f3_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='stocktransaction',
+            index=models.Index(fields=['reason', 'created_at', 'id'], name='inventory_s_reason_938660_idx'),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.2.8 on 2026-10-19 06:51
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventory', '0010_stocktransaction_keyset_indexes'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='stockbatch',
+            index=models.Index(fields=['drug', 'status', 'expiry_date'], name='inventory_s_drug_id_ef8b0b_idx'),
+        ),
+    ]
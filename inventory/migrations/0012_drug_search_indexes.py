@@ -0,0 +1,22 @@
+# Generated by Django 5.2.8 on 2026-10-19 07:36
+
+import django.db.models.functions.text
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventory', '0011_hot_path_indexes'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='drug',
+            index=models.Index(django.db.models.functions.text.Lower('name'), name='drug_name_lower_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='drug',
+            index=models.Index(django.db.models.functions.text.Lower('generic_name'), name='drug_generic_lower_idx'),
+        ),
+    ]
@@ -0,0 +1,48 @@
+# Generated by Django 5.2.8 on 2026-10-19 07:39
+
+from django.db import migrations, models
+
+# 常見的俗名 / 中文名 → 學名，其他的由藥師在 admin 補
+SEED = {
+    ("盤尼西林", "青黴素", "penicillin"): ("Penicillin", "Amoxicillin", "Ampicillin"),
+    ("阿斯匹靈", "aspirin"): ("Acetylsalicylic acid",),
+    ("普拿疼", "paracetamol"): ("Acetaminophen",),
+    ("磺胺", "sulfa"): ("Sulfamethoxazole",),
+}
+
+
+def seed_synonyms(apps, schema_editor):
+    AllergenSynonym = apps.get_model("inventory", "AllergenSynonym")
+    AllergenSynonym.objects.bulk_create(
+        [
+            AllergenSynonym(term=term, generic_name=generic)
+            for terms, generics in SEED.items()
+            for term in terms
+            for generic in generics
+        ],
+        ignore_conflicts=True,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventory', '0012_drug_search_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AllergenSynonym',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('term', models.CharField(help_text='例如：盤尼西林、青黴素、penicillin', max_length=100, verbose_name='過敏史用語')),
+                ('generic_name', models.CharField(help_text='跟藥品的「學名 / 成分」一致', max_length=100, verbose_name='對應學名 / 成分')),
+            ],
+            options={
+                'verbose_name': '過敏原同義詞',
+                'verbose_name_plural': '過敏原同義詞',
+                'constraints': [models.UniqueConstraint(fields=('term', 'generic_name'), name='uniq_allergen_synonym')],
+            },
+        ),
+        migrations.RunPython(seed_synonyms, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 5.2.8 on 2026-10-19 07:47
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventory', '0013_allergen_synonyms'),
+        ('prescriptions', '0014_patient_timeline_indexes'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StockReservation',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('quantity', models.PositiveIntegerField(verbose_name='保留數量')),
+                ('status', models.CharField(choices=[('active', '保留中'), ('consumed', '已領藥扣庫存'), ('released', '已釋放')], default='active', max_length=20, verbose_name='狀態')),
+                ('expires_at', models.DateTimeField(verbose_name='保留到期')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('batch', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='reservations', to='inventory.stockbatch', verbose_name='批次')),
+                ('created_by', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to=settings.AUTH_USER_MODEL, verbose_name='保留人員')),
+                ('item', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='stock_reservations', to='prescriptions.prescriptionitem', verbose_name='處方明細')),
+                ('prescription', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='stock_reservations', to='prescriptions.prescription', verbose_name='處方')),
+            ],
+            options={
+                'verbose_name': '庫存保留',
+                'verbose_name_plural': '庫存保留',
+                'indexes': [models.Index(fields=['batch', 'status', 'expires_at'], name='reservation_batch_idx'), models.Index(fields=['prescription', 'status'], name='reservation_rx_idx'), models.Index(fields=['status', 'expires_at'], name='reservation_expiry_idx')],
+            },
+        ),
+    ]
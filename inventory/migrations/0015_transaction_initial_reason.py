@@ -0,0 +1,18 @@
+# Generated by Django 5.2.8 on 2026-10-19 07:55
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventory', '0014_stock_reservations'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='stocktransaction',
+            name='reason',
+            field=models.CharField(choices=[('initial', '初始庫存'), ('purchase', '進貨'), ('dispense', '發藥'), ('return', '退藥'), ('adjust', '手動調整'), ('destroy', '報廢/銷毀')], max_length=20, verbose_name='原因'),
+        ),
+    ]
@@ -2,6 +2,7 @@ from django.db import models
 from django.conf import settings
 from django.utils import timezone
 from django.db.models import Max
+from django.db.models.functions import Lower
 import re
 
 
@@ -27,6 +28,11 @@ class Drug(models.Model):
     class Meta:
         verbose_name = "藥品"
         verbose_name_plural = "藥品"
+        indexes = [
+            # 開處方的藥品 typeahead：品名 / 學名不分大小寫的前綴搜尋（inventory.search）
+            models.Index(Lower("name"), name="drug_name_lower_idx"),
+            models.Index(Lower("generic_name"), name="drug_generic_lower_idx"),
+        ]
 
     def save(self, *args, **kwargs):
         if not self.code:
@@ -100,6 +106,10 @@ class StockBatch(models.Model):
         constraints = [
             models.UniqueConstraint(fields=["drug", "batch_no"], name="uniq_drug_batch_no"),
         ]
+        indexes = [
+            # FEFO 取批次：drug + 正常狀態，依效期排序
+            models.Index(fields=["drug", "status", "expiry_date"]),
+        ]
 
     def __str__(self):
         return f"{self.drug.name} / 批號 {self.batch_no or '-'} / 效期 {self.expiry_date} / 庫存 {self.quantity}"
@@ -131,6 +141,7 @@ class StockBatch(models.Model):
 
 class StockTransaction(models.Model):
     REASON_CHOICES = [
+        ("initial", "初始庫存"),  # drug_create 新增藥品時填的庫存
         ("purchase", "進貨"),
         ("dispense", "發藥"),
         ("return", "退藥"),
@@ -176,8 +187,92 @@ class StockTransaction(models.Model):
     class Meta:
         verbose_name = "庫存異動"
         verbose_name_plural = "庫存異動"
+        indexes = [
+            # stock_history 的 keyset 分頁 / 日期區間都走 (created_at, id)
+            models.Index(fields=["created_at", "id"]),
+            models.Index(fields=["drug", "created_at", "id"]),
+            models.Index(fields=["reason", "created_at", "id"]),
+        ]
 
     def __str__(self):
         sign = "+" if self.change >= 0 else ""
         batch_part = f" / 批號 {self.batch.batch_no}" if self.batch else ""
         return f"{self.drug.name}{batch_part} {sign}{self.change} ({self.get_reason_display()})"
+
+
+class AllergenSynonym(models.Model):
+    """
+    過敏原同義詞：病人過敏史寫的是「盤尼西林」「青黴素」，藥品學名寫的是 Amoxicillin，
+    靠這張表對起來（開處方時的過敏篩檢，見 prescriptions.screening）。
+    """
+
+    term = models.CharField("過敏史用語", max_length=100, help_text="例如：盤尼西林、青黴素、penicillin")
+    generic_name = models.CharField("對應學名 / 成分", max_length=100, help_text="跟藥品的「學名 / 成分」一致")
+
+    class Meta:
+        verbose_name = "過敏原同義詞"
+        verbose_name_plural = "過敏原同義詞"
+        constraints = [
+            models.UniqueConstraint(fields=["term", "generic_name"], name="uniq_allergen_synonym"),
+        ]
+
+    def __str__(self):
+        return f"{self.term} → {self.generic_name}"
+
+
+class StockReservation(models.Model):
+    """
+    藥師審核通過時先把處方要用的批次「保留」起來（FEFO），領藥時直接照保留扣，
+    作廢 / 醫師改處方 / 逾時就釋放。批次可承諾量 = quantity - 有效保留量（見 inventory.reservations）。
+    """
+
+    STATUS_ACTIVE = "active"
+    STATUS_CONSUMED = "consumed"
+    STATUS_RELEASED = "released"
+    STATUS_CHOICES = [
+        (STATUS_ACTIVE, "保留中"),
+        (STATUS_CONSUMED, "已領藥扣庫存"),
+        (STATUS_RELEASED, "已釋放"),
+    ]
+
+    batch = models.ForeignKey(StockBatch, on_delete=models.CASCADE, related_name="reservations", verbose_name="批次")
+    prescription = models.ForeignKey(
+        "prescriptions.Prescription",
+        on_delete=models.CASCADE,
+        related_name="stock_reservations",
+        verbose_name="處方",
+    )
+    item = models.ForeignKey(
+        "prescriptions.PrescriptionItem",
+        on_delete=models.CASCADE,
+        related_name="stock_reservations",
+        verbose_name="處方明細",
+    )
+    quantity = models.PositiveIntegerField("保留數量")
+    status = models.CharField("狀態", max_length=20, choices=STATUS_CHOICES, default=STATUS_ACTIVE)
+    expires_at = models.DateTimeField("保留到期")
+
+    created_by = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name="+",
+        verbose_name="保留人員",
+    )
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        verbose_name = "庫存保留"
+        verbose_name_plural = "庫存保留"
+        indexes = [
+            # 可承諾量：某幾個批次的有效保留加總
+            models.Index(fields=["batch", "status", "expires_at"], name="reservation_batch_idx"),
+            # 領藥 / 釋放：某張處方的有效保留
+            models.Index(fields=["prescription", "status"], name="reservation_rx_idx"),
+            # 逾時清理
+            models.Index(fields=["status", "expires_at"], name="reservation_expiry_idx"),
+        ]
+
+    def __str__(self):
+        return f"處方 #{self.prescription_id} 保留 {self.batch} × {self.quantity}（{self.get_status_display()}）"
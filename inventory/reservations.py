@@ -0,0 +1,220 @@
+"""
+庫存保留（soft reservation）：藥師審核通過時就照 FEFO 把批次保留給這張處方，
+領藥時直接照保留扣，不用再鎖著批次重新配一次；作廢、醫師改處方、逾時就釋放。
+
+一個批次的可承諾量 = quantity - 有效保留量（status=active 且還沒過 expires_at），
+有效保留量是 (batch, status, expires_at) 索引上的一個 SUM。逾時的保留不用等清理就不算數，
+release_stock_reservations 指令只是把狀態改成已釋放。
+"""
+
+from collections import defaultdict
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from common import fragments
+
+from .models import StockBatch, StockReservation
+
+
+def active_holds():
+    return StockReservation.objects.filter(status=StockReservation.STATUS_ACTIVE, expires_at__gt=timezone.now())
+
+
+def with_held(batches, *, exclude_prescription_ids=()):
+    """
+    StockBatch queryset 加上 held（有效保留量）欄位，是 SELECT 裡的子查詢，不多一個 query。
+    exclude_prescription_ids 的保留不算（自己的保留不擋自己）。
+    """
+    holds = active_holds().filter(batch=OuterRef("pk"))
+    if exclude_prescription_ids:
+        holds = holds.exclude(prescription_id__in=exclude_prescription_ids)
+    total = holds.order_by().values("batch").annotate(total=Sum("quantity")).values("total")
+    return batches.annotate(held=Coalesce(Subquery(total), 0))
+
+
+def held_by_prescription(batch_ids):
+    """{(batch_id, prescription_id): 有效保留量}；面板一次算每張處方「別人保留了多少」。"""
+    if not batch_ids:
+        return {}
+    rows = (
+        active_holds()
+        .filter(batch_id__in=batch_ids)
+        .order_by()
+        .values("batch_id", "prescription_id")
+        .annotate(total=Sum("quantity"))
+    )
+    return {(row["batch_id"], row["prescription_id"]): row["total"] for row in rows}
+
+
+def usable_batches(drug_ids, *, lock=False, exclude_prescription_ids=()):
+    """正常、有庫存、沒過期的批次，效期早的在前；每個批次帶 held（別張處方的保留量）。"""
+    qs = (
+        StockBatch.objects
+        .filter(
+            drug_id__in=drug_ids,
+            status=StockBatch.STATUS_NORMAL,
+            quantity__gt=0,
+            expiry_date__gte=timezone.localdate(),
+        )
+        .order_by("expiry_date", "id")
+    )
+    if lock:
+        qs = qs.select_for_update()
+    return list(with_held(qs, exclude_prescription_ids=exclude_prescription_ids))
+
+
+def allocate(items, batches_by_drug, available, *, min_valid_days=0):
+    """
+    FEFO 幫一張處方的明細配批次。available 是 {batch_pk: 還能用的量}（已扣掉別人的保留），
+    這裡不會改它。回傳 ([(item, batch, 數量)], [問題])；有問題時配到的量不該拿來用。
+    """
+    today = timezone.localdate()
+    taken = defaultdict(int)
+    picks = []
+    problems = []
+
+    for item in items:
+        qty = int(item.quantity or 0)
+        if qty <= 0:
+            continue
+        need_days = max(int(item.treatment_days or 0), int(min_valid_days or 0))
+        min_expiry_date = today + timedelta(days=need_days)
+
+        remain = qty
+        for b in batches_by_drug.get(item.drug_id, ()):
+            if b.expiry_date < min_expiry_date:
+                continue
+            take = min(available.get(b.pk, 0) - taken[b.pk], remain)
+            if take <= 0:
+                continue
+            taken[b.pk] += take
+            picks.append((item, b, take))
+            remain -= take
+            if remain == 0:
+                break
+
+        if remain > 0:
+            problems.append(f"{item.drug.name} 可用庫存/效期不足（需 {qty}，仍缺 {remain}）")
+
+    return picks, problems
+
+
+def reserve_prescriptions(prescriptions, user=None, *, min_valid_days=0):
+    """
+    審核通過時呼叫，要在 transaction 裡；處方要先 prefetch items__drug。
+    每張處方要嘛整張保留成功、要嘛一筆都不留，回傳 {prescription_pk: 保留不到的原因}。
+    保留不到不影響審核結果，領藥時會退回原本的現場配批次。
+    """
+    prescriptions = sorted(prescriptions, key=lambda rx: rx.pk)
+    if not prescriptions:
+        return {}
+
+    # 重新審核的處方先放掉舊保留
+    release_prescriptions([rx.pk for rx in prescriptions])
+
+    batches = usable_batches({it.drug_id for rx in prescriptions for it in rx.items.all()}, lock=True)
+    by_drug = defaultdict(list)
+    available = {}
+    for b in batches:
+        by_drug[b.drug_id].append(b)
+        available[b.pk] = b.quantity - b.held
+
+    expires_at = timezone.now() + timedelta(hours=settings.STOCK_RESERVATION_HOURS)
+    failed = {}
+    holds = []
+    for rx in prescriptions:
+        picks, problems = allocate(rx.items.all(), by_drug, available, min_valid_days=min_valid_days)
+        if problems:
+            failed[rx.pk] = "；".join(problems)
+            continue
+        for item, batch, qty in picks:
+            available[batch.pk] -= qty
+            holds.append(StockReservation(
+                batch=batch, prescription=rx, item=item, quantity=qty, expires_at=expires_at, created_by=user,
+            ))
+
+    if holds:
+        StockReservation.objects.bulk_create(holds)
+        fragments.bump(fragments.STOCK)
+    return failed
+
+
+def with_batch_held(holds):
+    """StockReservation queryset 加上 batch_held（該批次全部的有效保留量，含自己），子查詢不多一個 query。"""
+    total = (
+        active_holds().filter(batch=OuterRef("batch_id"))
+        .order_by().values("batch").annotate(total=Sum("quantity")).values("total")
+    )
+    return holds.annotate(batch_held=Coalesce(Subquery(total), 0))
+
+
+def holds_cover(holds, items, *, min_valid_days=0):
+    """
+    保留是否剛好涵蓋每個明細的開立量，而且照現在的規則還能扣：
+    批次正常、效期 >= 今天 + max(給藥天數, min_valid_days)（跟 allocate 一樣），
+    批次庫存夠這個批次上全部的有效保留（holds 要先 with_batch_held）。
+    """
+    today = timezone.localdate()
+    items = {it.pk: it for it in items}
+    per_item = defaultdict(int)
+    for h in holds:
+        item = items.get(h.item_id)
+        if item is None:
+            return False
+        per_item[h.item_id] += h.quantity
+        need_days = max(int(item.treatment_days or 0), int(min_valid_days or 0))
+        if h.batch.status != StockBatch.STATUS_NORMAL or h.batch.expiry_date < today + timedelta(days=need_days):
+            return False
+        if h.batch.quantity < h.batch_held:
+            return False
+    wanted = {pk: int(it.quantity or 0) for pk, it in items.items() if int(it.quantity or 0) > 0}
+    return dict(per_item) == wanted
+
+
+def consume_prescription(prescription, items, *, min_valid_days=0):
+    """
+    領藥時取出這張處方的有效保留（鎖住批次）。保留完整就回傳保留清單，
+    呼叫端照著扣（inventory.utils.deduct_allocations）後要 mark_consumed；
+    不完整（逾時、被隔離、效期不夠、醫師改過明細）就全部釋放、回傳 None，改用現場配批次。
+    """
+    holds = list(
+        with_batch_held(active_holds().filter(prescription=prescription))
+        .select_related("batch", "item__drug")
+        .select_for_update()
+        .order_by("batch__expiry_date", "id")
+    )
+    if holds and holds_cover(holds, items, min_valid_days=min_valid_days):
+        for h in holds:
+            h.prescription = prescription
+        return holds
+    if holds:
+        release_prescriptions([prescription.pk])
+    return None
+
+
+def mark_consumed(holds):
+    if holds:
+        StockReservation.objects.filter(pk__in=[h.pk for h in holds]).update(status=StockReservation.STATUS_CONSUMED)
+
+
+def release_prescriptions(prescription_ids):
+    """作廢、退回重審、醫師改處方時釋放保留；回傳釋放的筆數。"""
+    released = StockReservation.objects.filter(
+        prescription_id__in=prescription_ids, status=StockReservation.STATUS_ACTIVE,
+    ).update(status=StockReservation.STATUS_RELEASED)
+    if released:
+        fragments.bump(fragments.STOCK)
+    return released
+
+
+def release_expired(now=None):
+    released = StockReservation.objects.filter(
+        status=StockReservation.STATUS_ACTIVE, expires_at__lte=now or timezone.now(),
+    ).update(status=StockReservation.STATUS_RELEASED)
+    if released:
+        fragments.bump(fragments.STOCK)
+    return released
@@ -0,0 +1,92 @@
+"""
+開處方用的藥品 typeahead：代碼 / 品名 / 學名前綴搜尋。
+
+- 前綴寫成 >= prefix AND < prefix + U+10FFFF 的範圍條件（同 patients.search），
+  品名、學名用 LOWER() 的 expression index，大小寫都查得到又能走 B-tree。
+- 藥品基本資料依「片段快取的 drugs 版本號」快取，藥品一改版本就換掉；
+  可承諾量每次都即時從批次加總、扣掉有效保留（一個 query），不會拿到快取裡的舊數字。
+"""
+
+import hashlib
+
+from django.core.cache import caches
+from django.db.models import F, Q, Sum
+from django.db.models.functions import Lower
+from django.utils import timezone
+
+from common import fragments
+
+from .models import Drug, StockBatch
+from .reservations import with_held
+
+MAX_RESULTS = 20
+SEARCH_TIMEOUT = 600
+
+_PREFIX_END = "\U0010ffff"
+
+
+def _prefix(field, prefix):
+    return Q(**{f"{field}__gte": prefix, f"{field}__lt": prefix + _PREFIX_END})
+
+
+def _cache_key(query, limit):
+    digest = hashlib.md5(query.encode()).hexdigest()
+    return f"drugsearch:{fragments.get_version(fragments.DRUGS)}:{limit}:{digest}"
+
+
+def _match(query, limit):
+    lowered = query.lower()
+    qs = (
+        Drug.objects
+        .filter(is_active=True)
+        .alias(name_lower=Lower("name"), generic_lower=Lower("generic_name"))
+        .filter(
+            _prefix("code", query.upper())
+            | _prefix("name_lower", lowered)
+            | _prefix("generic_lower", lowered)
+        )
+        .order_by("name", "id")
+        .values("id", "code", "name", "generic_name", "strength", "unit")
+    )
+    return list(qs[:limit])
+
+
+def available_stock(drug_ids):
+    """
+    {drug_id: 可承諾量}；只算正常、未過期、還有庫存的批次（同 Drug.non_expired_quantity），
+    每個批次先扣掉已審核處方的有效保留（inventory.reservations），保留量走 (batch, status, expires_at) 索引。
+    """
+    if not drug_ids:
+        return {}
+    batches = StockBatch.objects.filter(
+        drug_id__in=drug_ids,
+        status=StockBatch.STATUS_NORMAL,
+        expiry_date__gte=timezone.localdate(),
+        quantity__gt=0,
+    )
+    rows = (
+        with_held(batches)
+        .values("drug_id")
+        .annotate(total=Sum(F("quantity") - F("held")))
+    )
+    return {row["drug_id"]: max(row["total"], 0) for row in rows}
+
+
+def search_drugs(query, limit=MAX_RESULTS):
+    query = " ".join((query or "").split())
+    if not query:
+        return []
+
+    cache = caches[fragments.FRAGMENT_CACHE]
+    key = _cache_key(query.lower(), limit)
+    drugs = cache.get(key)
+    if drugs is None:
+        drugs = _match(query, limit)
+        cache.set(key, drugs, SEARCH_TIMEOUT)
+
+    stock = available_stock([d["id"] for d in drugs])
+    return [{**d, "available": stock.get(d["id"], 0)} for d in drugs]
+
+
+def drug_label(drug):
+    return " ".join(part for part in (drug.code, drug.name, drug.strength) if part)
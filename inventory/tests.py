@@ -1,3 +1,301 @@
-from django.test import TestCase
+from datetime import datetime, timedelta
+from io import StringIO
+from unittest import skipUnless
 
-# Create your tests here.
+from django.contrib.auth.models import Group, User
+from django.core.cache import caches
+from django.core.management import call_command
+from django.db import connection, transaction
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from common.pagination import KeysetPaginator
+
+from . import search
+from .consistency import check_inventory, repair_inventory
+from .models import Drug, StockBatch, StockTransaction
+from .utils import adjust_stock, stock_in
+
+TEST_STORAGES = {
+    "default": {"BACKEND": "django.core.files.storage.FileSystemStorage"},
+    "staticfiles": {"BACKEND": "django.contrib.staticfiles.storage.StaticFilesStorage"},
+}
+
+
+@override_settings(PROFILING_SLOW_LOG=None, METRICS_DIR="", STORAGES=TEST_STORAGES)
+class StockHistoryKeysetTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user("pharm")
+        cls.user.groups.add(Group.objects.create(name="PHARMACY"))
+        cls.drug = Drug.objects.create(code="A1", name="Aspirin")
+
+        # 每兩筆共用同一個 created_at，確認同時間的資料靠 id 排序不會漏 / 重複
+        base = timezone.make_aware(datetime(2025, 3, 1, 8, 0))
+        txs = StockTransaction.objects.bulk_create(
+            StockTransaction(drug=cls.drug, change=1, reason="purchase") for _ in range(65)
+        )
+        for i, tx in enumerate(txs):
+            StockTransaction.objects.filter(pk=tx.pk).update(created_at=base + timedelta(hours=i // 2))
+
+        cls.expected = list(
+            StockTransaction.objects.order_by("-created_at", "-id").values_list("pk", flat=True)
+        )
+
+    def setUp(self):
+        self.client.force_login(self.user)
+
+    def _page(self, **params):
+        return self.client.get(reverse("inventory:stock_history"), params)
+
+    def test_walks_every_row_once_in_order(self):
+        seen, params, pages = [], {}, 0
+        while True:
+            page = self._page(**params).context["transactions"]
+            seen.extend(tx.pk for tx in page)
+            pages += 1
+            if not page.has_next:
+                break
+            params = {"after": page.next_cursor}
+
+        self.assertEqual(pages, 4)
+        self.assertEqual(seen, self.expected)
+
+        back = self._page(before=page.previous_cursor).context["transactions"]
+        self.assertEqual([tx.pk for tx in back], self.expected[40:60])
+        self.assertTrue(back.has_previous)
+
+    def test_deep_page_costs_the_same_as_first(self):
+        self._page()
+        with CaptureQueriesContext(connection) as first:
+            page = self._page().context["transactions"]
+        cursor = self.expected[59]
+        tx = StockTransaction.objects.get(pk=cursor)
+        after = KeysetPaginator(StockTransaction.objects.all(), ("-created_at", "-id")).encode_cursor(tx)
+        with CaptureQueriesContext(connection) as deep:
+            deep_page = self._page(after=after).context["transactions"]
+
+        # 深頁不重算整個範圍的總覽，query 數只會比第一頁少
+        self.assertEqual(len(deep), len(first) - 1)
+        self.assertEqual([t.pk for t in deep_page], self.expected[60:])
+        self.assertTrue(page.has_next)
+        for q in deep.captured_queries:
+            self.assertNotIn("OFFSET", q["sql"].upper())
+            self.assertNotIn("SUM(", q["sql"].upper())
+
+    def test_summary_on_first_page_or_on_request(self):
+        first = self._page()
+        self.assertEqual(first.context["total_count"], 65)
+        self.assertEqual(first.context["total_in"], 65)
+
+        after = first.context["transactions"].next_cursor
+        deep = self._page(after=after)
+        self.assertFalse(deep.context["show_summary"])
+        self.assertContains(deep, "summary=1")
+
+        asked = self._page(after=after, summary="1")
+        self.assertEqual(asked.context["total_count"], 65)
+        self.assertNotIn("summary", asked.context["base_query"])
+
+    def test_date_range_is_half_open_on_local_days(self):
+        # 2025-03-01 08:00 起每小時兩筆，到 03-02 00:00 前共 16 小時 = 32 筆
+        resp = self._page(date_from="2025-03-01", date_to="2025-03-01")
+        self.assertEqual(resp.context["total_count"], 32)
+        resp = self._page(date_from="2025-03-02")
+        self.assertEqual(resp.context["total_count"], 33)
+
+    def test_bad_cursor_or_date_falls_back_to_first_page(self):
+        page = self._page(after="not-a-cursor", date_to="2025-02-30").context["transactions"]
+        self.assertEqual([tx.pk for tx in page], self.expected[:20])
+        self.assertFalse(page.has_previous)
+
+
+@override_settings(PROFILING_SLOW_LOG=None, METRICS_DIR="", STORAGES=TEST_STORAGES)
+class DrugSearchTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user("doctor")
+        cls.aspirin = Drug.objects.create(code="ASP100", name="Aspirin", generic_name="Acetylsalicylic acid", strength="100mg")
+        cls.panadol = Drug.objects.create(code="PAN500", name="普拿疼", generic_name="Acetaminophen", strength="500mg")
+        Drug.objects.create(code="OLD1", name="Aspirin 停用", is_active=False)
+        today = timezone.localdate()
+        StockBatch.objects.create(drug=cls.panadol, batch_no="B1", quantity=30, expiry_date=today + timedelta(days=90))
+        StockBatch.objects.create(drug=cls.panadol, batch_no="B0", quantity=99, expiry_date=today - timedelta(days=1))
+
+    def setUp(self):
+        caches["fragments"].clear()
+
+    def _codes(self, query):
+        return [d["code"] for d in search.search_drugs(query)]
+
+    def test_prefixes(self):
+        self.assertEqual(self._codes("asp"), ["ASP100"])
+        self.assertEqual(self._codes("pan"), ["PAN500"])
+        self.assertEqual(self._codes("普拿"), ["PAN500"])
+        self.assertEqual(self._codes("ACET"), ["ASP100", "PAN500"])
+        self.assertEqual(self._codes("疼"), [])
+        self.assertEqual(self._codes("  "), [])
+
+    def test_cached_results_keep_live_stock(self):
+        self.assertEqual(search.search_drugs("普拿")[0]["available"], 30)
+
+        with CaptureQueriesContext(connection) as ctx:
+            result = search.search_drugs("普拿")
+        # 命中快取：只剩即時庫存那一個 query
+        self.assertEqual(len(ctx.captured_queries), 1)
+        self.assertEqual(result[0]["available"], 30)
+
+        StockBatch.objects.filter(drug=self.panadol, batch_no="B1").update(quantity=5)
+        self.assertEqual(search.search_drugs("普拿")[0]["available"], 5)
+
+        # 改名會換版本號，舊的搜尋結果不會再被用到
+        self.panadol.name = "普拿疼加強錠"
+        self.panadol.save()
+        self.assertEqual(search.search_drugs("普拿")[0]["name"], "普拿疼加強錠")
+
+    @skipUnless(connection.vendor == "sqlite", "查詢計畫的格式是 SQLite 的")
+    def test_uses_indexes(self):
+        qs = Drug.objects.filter(is_active=True).alias(
+            name_lower=search.Lower("name"), generic_lower=search.Lower("generic_name"),
+        ).filter(
+            search._prefix("code", "A") | search._prefix("name_lower", "a") | search._prefix("generic_lower", "a")
+        )
+        plan = qs.explain()
+        for index in ("drug_name_lower_idx", "drug_generic_lower_idx"):
+            self.assertIn(index, plan)
+
+    def test_endpoint(self):
+        self.client.force_login(self.user)
+        data = self.client.get(reverse("inventory:drug_search"), {"q": "pan"}).json()
+        self.assertEqual(
+            data["results"],
+            [{
+                "id": self.panadol.pk, "code": "PAN500", "name": "普拿疼", "generic_name": "Acetaminophen",
+                "strength": "500mg", "unit": "顆", "available": 30,
+            }],
+        )
+
+    def test_prescription_item_widget(self):
+        from prescriptions.forms import PrescriptionItemForm
+
+        html = str(PrescriptionItemForm()["drug"])
+        self.assertNotIn("<option", html)
+        self.assertIn(reverse("inventory:drug_search"), html)
+
+        form = PrescriptionItemForm(data={"drug": self.panadol.pk, "quantity": 1, "treatment_days": 3})
+        self.assertTrue(form.is_valid(), form.errors)
+        self.assertIn("PAN500 普拿疼 500mg", str(form["drug"]))
+
+
+@override_settings(PROFILING_SLOW_LOG=None, METRICS_DIR="", STORAGES=TEST_STORAGES)
+class InventoryConsistencyTests(TestCase):
+    def setUp(self):
+        expiry = timezone.localdate() + timedelta(days=180)
+        # 對得起來的藥品
+        self.good = Drug.objects.create(code="G1", name="正常藥")
+        stock_in(self.good, 10, expiry)
+        # 舊的 adjust_stock 只改總量、寫沒有批次的異動
+        self.loose = Drug.objects.create(code="L1", name="沒有批次")
+        adjust_stock(self.loose, 8, "initial")
+        # 批次被直接改過，異動紀錄沒跟上
+        self.drift = Drug.objects.create(code="D1", name="批次飄掉")
+        self.batch = stock_in(self.drift, 20, expiry)
+        StockBatch.objects.filter(pk=self.batch.pk).update(quantity=15)
+
+    def test_check_reports_drift(self):
+        report = check_inventory()
+        self.assertFalse(report.ok)
+        self.assertEqual((report.checked_drugs, report.checked_batches), (3, 2))
+
+        [batch] = report.batches
+        self.assertEqual((batch.batch_id, batch.quantity, batch.ledger, batch.diff), (self.batch.pk, 15, 20, -5))
+
+        drugs = {d.code: d for d in report.drugs}
+        self.assertEqual(set(drugs), {"L1", "D1"})
+        self.assertEqual(
+            (drugs["L1"].stock_quantity, drugs["L1"].batch_total, drugs["L1"].ledger_total, drugs["L1"].unbatched),
+            (8, 0, 8, 8),
+        )
+        self.assertEqual((drugs["D1"].stock_quantity, drugs["D1"].batch_total), (20, 15))
+
+    def test_query_count_does_not_grow(self):
+        with self.assertNumQueries(5):
+            check_inventory()
+        for i in range(5):
+            Drug.objects.create(code=f"X{i}", name=f"藥{i}", stock_quantity=1)
+        with self.assertNumQueries(5):
+            report = check_inventory()
+        self.assertEqual(len(report.drugs), 7)
+        # 修正用的上鎖版本也是同樣的 query 數（批次、藥品先 SELECT ... FOR UPDATE）
+        with transaction.atomic(), self.assertNumQueries(5):
+            self.assertEqual(len(check_inventory(lock=True).drugs), 7)
+
+    def test_repair(self):
+        before = StockTransaction.objects.count()
+        report, created = repair_inventory()
+        self.assertEqual(created, 3)
+        self.assertEqual(StockTransaction.objects.count(), before + 3)
+        self.assertTrue(check_inventory().ok)
+
+        self.loose.refresh_from_db()
+        self.drift.refresh_from_db()
+        self.assertEqual((self.loose.stock_quantity, self.drift.stock_quantity), (8, 15))
+
+        # 沒有批次的庫存不沖掉，移到隔離中的暫存批次等人確認
+        placeholder = self.loose.batches.get()
+        self.assertEqual(placeholder.quantity, 8)
+        self.assertEqual(placeholder.status, StockBatch.STATUS_QUARANTINE)
+
+        # 再跑一次不會重複補
+        self.assertEqual(repair_inventory()[1], 0)
+
+    def test_negative_unbatched_is_left_for_review(self):
+        adjust_stock(self.good, -3, "adjust")
+        report, _ = repair_inventory()
+
+        [drug] = [d for d in report.drugs if d.code == "G1"]
+        self.assertTrue(drug.needs_review)
+        self.good.refresh_from_db()
+        self.assertEqual(self.good.stock_quantity, 7)
+        self.assertEqual(self.good.batches.get().quantity, 10)
+        self.assertEqual([d.code for d in check_inventory().drugs], ["G1"])
+
+    def test_drug_create_opening_stock_is_batched(self):
+        user = User.objects.create_user("admin", is_superuser=True)
+        self.client.force_login(user)
+        data = {"name": "新藥", "unit": "顆", "unit_price": 1, "reorder_level": 0, "is_active": "on"}
+
+        response = self.client.post(reverse("inventory:drug_create"), {**data, "initial_quantity": 12})
+        self.assertEqual(response.status_code, 200)
+        self.assertIn("initial_expiry_date", response.context["form"].errors)
+
+        expiry = (timezone.localdate() + timedelta(days=90)).isoformat()
+        self.client.post(
+            reverse("inventory:drug_create"),
+            {**data, "initial_quantity": 12, "initial_expiry_date": expiry},
+        )
+        drug = Drug.objects.get(name="新藥")
+        self.assertEqual(drug.stock_quantity, 12)
+        self.assertEqual(drug.batches.get().quantity, 12)
+        self.assertEqual(drug.transactions.get().reason, "initial")
+        self.assertNotIn(drug.pk, [d.drug_id for d in check_inventory().drugs])
+
+    def test_unknown_reason_is_reported_not_changed(self):
+        StockTransaction.objects.create(drug=self.good, batch=self.good.batches.get(), change=0, reason="legacy")
+        report = check_inventory()
+        self.assertEqual(report.unknown_reasons, {"legacy": 1})
+        repair_inventory()
+        self.assertEqual(check_inventory().unknown_reasons, {"legacy": 1})
+
+    def test_command(self):
+        out = StringIO()
+        call_command("check_inventory", stdout=out)
+        self.assertIn("2 種藥品、1 個批次對不起來", out.getvalue())
+        self.assertIn("L1", out.getvalue())
+
+        out = StringIO()
+        call_command("check_inventory", "--repair", stdout=out)
+        self.assertIn("已補 3 筆校正異動", out.getvalue())
+        self.assertTrue(check_inventory().ok)
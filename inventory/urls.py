@@ -8,6 +8,7 @@ urlpatterns = [
 
     path("drugs/", views.drug_list, name="drug_list"),
     path("drugs/new/", views.drug_create, name="drug_create"),
+    path("drugs/search.json", views.drug_search, name="drug_search"),
     path("drugs/<int:pk>/edit/", views.edit_drug, name="edit_drug"),
     path("drugs/<int:drug_id>/stock-in/", views.stock_in, name="stock_in"),
 
@@ -6,7 +6,10 @@ from django.utils import timezone
 from django.db import transaction, models
 from django.db.models import Sum
 
+from common import fragments, metrics
+
 from .models import Drug, StockBatch, StockTransaction
+from .reservations import with_held
 
 
 
@@ -86,6 +89,7 @@ def stock_in(
     operator=None,
     note: str = "",
     supplier_batch_no: str = "",
+    reason: str = "purchase",
 ):
 
     if quantity <= 0:
@@ -104,7 +108,7 @@ def stock_in(
         drug=drug,
         batch=batch,
         change=quantity,
-        reason="purchase",
+        reason=reason,
         note=note or (f"進貨入庫{(' / 廠商批號 ' + supplier_batch_no) if supplier_batch_no else ''}"),
         operator=operator,
     )
@@ -201,12 +205,14 @@ def use_drug_from_prescription_item(
             f"藥品「{drug.name}」沒有符合效期要求的可用批次（需效期 >= {min_expiry_date:%Y-%m-%d}） "
         )
 
+    # 別張處方審核時保留的量不能拿來用
+    batches = with_held(batches, exclude_prescription_ids=[presc.pk] if presc else ())
 
     for batch in batches:
         if remain <= 0:
             break
 
-        take = min(batch.quantity, remain)
+        take = min(batch.quantity - batch.held, remain)
         if take <= 0:
             continue
 
@@ -232,7 +238,7 @@ def use_drug_from_prescription_item(
             f"藥品「{drug.name}」可用庫存/效期不足：仍缺 {remain}{getattr(drug, 'unit', '')}  "
         )
 
-def can_dispense_item(item, *, min_valid_days=0) -> tuple[bool, str, int]:
+def can_dispense_item(item, *, min_valid_days=0, batches=None, held=None) -> tuple[bool, str, int]:
     drug = item.drug
     qty = int(item.quantity or 0)
     if qty <= 0:
@@ -243,22 +249,29 @@ def can_dispense_item(item, *, min_valid_days=0) -> tuple[bool, str, int]:
     need_days = max(int(treatment_days), int(min_valid_days or 0))
     min_expiry_date = today + timedelta(days=need_days)
 
-    qs = (
-        StockBatch.objects
-        .filter(
-            drug=drug,
-            status=StockBatch.STATUS_NORMAL,   
-            expiry_date__gte=min_expiry_date,  
-            quantity__gt=0,
+    if batches is not None:
+        # 呼叫端已經 prefetch 好「正常、有庫存、依效期排序」的批次，這裡只過濾效期
+        qs = [b for b in batches if b.expiry_date >= min_expiry_date]
+    else:
+        qs = (
+            StockBatch.objects
+            .filter(
+                drug=drug,
+                status=StockBatch.STATUS_NORMAL,   
+                expiry_date__gte=min_expiry_date,  
+                quantity__gt=0,
+            )
+            .order_by("expiry_date", "id")
         )
-        .order_by("expiry_date", "id")
-    )
 
+    # held：{batch_pk: 別張處方的保留量}，沒給就當作沒有保留
+    held = held or {}
     remain = qty
     available_total = 0
     for b in qs:
-        available_total += b.quantity
-        take = min(b.quantity, remain)
+        usable = max(b.quantity - held.get(b.pk, 0), 0)
+        available_total += usable
+        take = min(usable, remain)
         remain -= take
         if remain <= 0:
             return True, "", available_total
@@ -299,9 +312,12 @@ def preview_use_drug_from_prescription_item(
         .order_by("expiry_date", "id")
     )
 
+    presc = getattr(item, "prescription", None)
+    batches = with_held(batches, exclude_prescription_ids=[presc.pk] if presc else ())
+
     remain = qty
     for b in batches:
-        take = min(b.quantity, remain)
+        take = min(max(b.quantity - b.held, 0), remain)
         remain -= take
         if remain <= 0:
             return
@@ -311,6 +327,135 @@ def preview_use_drug_from_prescription_item(
         f"藥品「{drug.name}」可用庫存/效期不足：仍缺 {remain}{getattr(drug, 'unit', '')}  "
     )
 
+def deduct_allocations(allocations, *, operator=None):
+    """
+    照配好的批次一次扣庫存：批次、藥品庫存各一個 bulk_update，StockTransaction 一個 bulk_create。
+    allocations 的每一筆要有 prescription / item / batch / quantity（批次領藥的 Allocation、
+    或是 StockReservation 都可以）。要在 transaction 裡呼叫，批次要先鎖好。
+    """
+    if not allocations:
+        return
+
+    batches = {}
+    for a in allocations:
+        batch = batches.setdefault(a.batch.pk, a.batch)
+        batch.quantity -= a.quantity
+        if batch.quantity < 0:
+            raise ValueError(f"批次 {batch.batch_no} 庫存不足，無法扣除 {a.quantity}  ")
+    StockBatch.objects.bulk_update(batches.values(), ["quantity"])
+
+    StockTransaction.objects.bulk_create([
+        StockTransaction(
+            drug_id=a.item.drug_id,
+            batch=a.batch,
+            change=-a.quantity,
+            reason="dispense",
+            prescription=a.prescription,
+            operator=operator,
+            note=f"處方明細 #{a.item.pk} 扣庫存（批號 {a.batch.batch_no or '-'}）",
+        )
+        for a in allocations
+    ])
+
+    refresh_stock_quantities({a.item.drug_id: a.item.drug for a in allocations}.values())
+
+    # bulk 寫入不會觸發 post_save：片段快取版本和計數器自己處理
+    fragments.bump(fragments.DRUGS, fragments.STOCK)
+    metrics.inc(metrics.STOCK_TRANSACTIONS, len(allocations), reason="dispense")
+
+
+def refresh_stock_quantities(drugs):
+    """refresh_stock_quantity 的批次版：一個 GROUP BY 加總、一個 bulk_update。"""
+    drugs = list(drugs)
+    totals = dict(
+        StockBatch.objects
+        .filter(drug__in=drugs)
+        .order_by()
+        .values("drug")
+        .annotate(total=Sum("quantity"))
+        .values_list("drug", "total")
+    )
+    for drug in drugs:
+        drug.stock_quantity = totals.get(drug.pk) or 0
+    Drug.objects.bulk_update(drugs, ["stock_quantity"])
+
+
+@transaction.atomic
+def return_prescription_stock(prescription, *, operator=None):
+    """
+    退藥：照這張處方當初發藥的 StockTransaction 把數量加回原本的批次。
+    每個批次的淨發出量 = dispense + 之前的 return 加總，所以重複呼叫也只會退一次。
+
+    - 批次被隔離的照樣加回，但維持隔離、不能再發；已銷毀的批次加回後改成隔離，讓藥師決定
+    - 過期的批次一樣加回（FEFO 本來就不會再拿過期批次），異動備註會註明
+    - 發藥紀錄沒有批次（批次已被刪除）的量沒辦法加回，回傳給呼叫端記錄
+
+    回傳 (新增的退藥 StockTransaction 清單, {drug: 沒辦法加回的數量})。
+    """
+    # 先鎖住處方再讀發藥紀錄：同一張處方同時兩個退藥請求，第二個要等第一個 commit
+    # 才算淨發出量，不然兩邊都會算出同樣的量、退兩次
+    list(type(prescription).objects.select_for_update().filter(pk=prescription.pk).values_list("pk"))
+    rows = (
+        StockTransaction.objects
+        .filter(prescription=prescription, reason__in=["dispense", "return"])
+        .order_by()
+        .values("drug_id", "batch_id")
+        .annotate(net=Sum("change"))
+    )
+    outstanding = [(row["drug_id"], row["batch_id"], -row["net"]) for row in rows if row["net"] < 0]
+    if not outstanding:
+        return [], {}
+
+    drugs = Drug.objects.in_bulk({drug_id for drug_id, _, _ in outstanding})
+    batches = StockBatch.objects.select_for_update().in_bulk(
+        [batch_id for _, batch_id, _ in outstanding if batch_id]
+    )
+
+    today = timezone.localdate()
+    restored = []
+    unbatched = {}
+    for drug_id, batch_id, qty in outstanding:
+        drug = drugs[drug_id]
+        batch = batches.get(batch_id)
+        if batch is None:
+            unbatched[drug] = unbatched.get(drug, 0) + qty
+            continue
+
+        note = f"處方 #{prescription.pk} 退藥（批號 {batch.batch_no or '-'}）"
+        if batch.status == StockBatch.STATUS_DESTROYED:
+            batch.status = StockBatch.STATUS_QUARANTINE
+            batch.quarantine_reason = "other"
+            batch.quarantine_note = "已銷毀批次收到退藥，待藥師處理"
+            note += "；批次已銷毀，改為隔離"
+        elif batch.status == StockBatch.STATUS_QUARANTINE:
+            note += "；批次隔離中，不可再發"
+        if batch.expiry_date < today:
+            note += "；批次已過期"
+
+        batch.quantity += qty
+        restored.append(StockTransaction(
+            drug=drug,
+            batch=batch,
+            change=qty,
+            reason="return",
+            note=note,
+            prescription=prescription,
+            operator=operator,
+        ))
+
+    if restored:
+        StockBatch.objects.bulk_update(
+            {t.batch.pk: t.batch for t in restored}.values(),
+            ["quantity", "status", "quarantine_reason", "quarantine_note"],
+        )
+        StockTransaction.objects.bulk_create(restored)
+        refresh_stock_quantities({t.drug.pk: t.drug for t in restored}.values())
+        fragments.bump(fragments.DRUGS, fragments.STOCK)
+        metrics.inc(metrics.STOCK_TRANSACTIONS, len(restored), reason="return")
+
+    return restored, unbatched
+
+
 @transaction.atomic
 def quarantine_batch(batch: StockBatch,*,operator=None,reason: str = "",note: str = "藥師隔離批次",) -> StockBatch:
     if batch.status == StockBatch.STATUS_QUARANTINE:
@@ -1,26 +1,31 @@
 import csv
 from django.contrib import messages
 from django.db import transaction
-from django.db.models import F, Q, Sum  
+from django.db.models import Count, F, Q, Sum  
 from django.shortcuts import get_object_or_404, redirect, render
 from django.contrib.auth.decorators import login_required, permission_required
 
 from django.urls import reverse
 
 from inventory.utils import adjust_stock
-from datetime import timedelta
+from datetime import datetime, time, timedelta
 from django.utils import timezone
+from django.utils.dateparse import parse_date
 
-from .forms import DrugForm, StockAdjustForm, StockBatchForm
+from .forms import DrugCreateForm, DrugForm, StockAdjustForm, StockBatchForm
 from common.utils import group_required
+from common.routers import use_replica
 from .models import Drug, StockBatch, StockTransaction
+from .search import search_drugs
 from django.core.paginator import Paginator 
+from common.pagination import KeysetPaginator
 from inventory.utils import stock_in as stock_in_utils
 from inventory.utils import quarantine_batch, unquarantine_batch, destroy_batch
-from django.http import HttpResponse
+from django.http import HttpResponse, JsonResponse
 
 
 @group_required("PHARMACY")
+@use_replica
 def dashboard(request):
     
     drugs = Drug.objects.filter(is_active=True).order_by("name")
@@ -106,28 +111,38 @@ def drug_list(request):
 
 
 
+@login_required
+def drug_search(request):
+    # 開處方表單的藥品 typeahead；基本資料有快取，可用庫存是即時的
+    return JsonResponse({"results": search_drugs(request.GET.get("q", ""))})
+
+
 @login_required
 @permission_required("inventory.add_drug", raise_exception=True)
 def drug_create(request):
     if request.method == "POST":
-        form = DrugForm(request.POST)
+        form = DrugCreateForm(request.POST)
         if form.is_valid():
-            drug = form.save()
-
-            
-            if drug.stock_quantity > 0:
-                StockTransaction.objects.create(
-                    drug=drug,
-                    change=drug.stock_quantity,
-                    reason="initial",
-                    note="新增藥品初始庫存",
-                )
+            with transaction.atomic():
+                drug = form.save()
+
+                # 初始庫存跟進貨一樣建成批次，批次、異動紀錄、藥品總量三邊一致
+                qty = form.cleaned_data.get("initial_quantity")
+                if qty:
+                    stock_in_utils(
+                        drug,
+                        qty,
+                        form.cleaned_data["initial_expiry_date"],
+                        operator=request.user,
+                        note="新增藥品初始庫存",
+                        reason="initial",
+                    )
 
             messages.success(request, "藥品新增成功 ！")
             return redirect("inventory:drug_list")
 
     else:
-        form = DrugForm()
+        form = DrugCreateForm()
 
     return render(request, "inventory/drug_create.html", {"form": form})
 
@@ -216,83 +231,64 @@ def stock_adjust(request, pk):
 
 
 @group_required("PHARMACY")
+@use_replica
 def stock_history(request):
    
     back_url = request.GET.get("back")
     if not back_url:
         back_url = request.META.get("HTTP_REFERER") or reverse("inventory:dashboard")
 
-   
-    qs = (
-        StockTransaction.objects
-        .select_related("drug", "operator", "prescription")
-        .order_by("-created_at")
-    )
+    qs, filters = _filter_stock_transactions(request)
+    qs = qs.select_related("drug", "operator", "prescription")
 
-   
-    drug_id = request.GET.get("drug")
+    drug_id = filters["drug"]
     selected_drug = None
     if drug_id:
-        qs = qs.filter(drug_id=drug_id)
         selected_drug = Drug.objects.filter(pk=drug_id).first()
 
-   
-    q_drug = request.GET.get("q_drug") or ""
-    if q_drug:
-        qs = qs.filter(drug__name__icontains=q_drug)
-
-    
-    q_operator = request.GET.get("q_operator") or ""
-    if q_operator:
-        qs = qs.filter(
-            Q(operator__username__icontains=q_operator)
-            | Q(operator__first_name__icontains=q_operator)
-            | Q(operator__last_name__icontains=q_operator)
+    after = request.GET.get("after")
+    before = request.GET.get("before")
+
+    # 總覽要掃整個篩選範圍，只在第一頁（或 ?summary=1）算，往後翻頁的成本才不會跟著範圍變大
+    show_summary = not (after or before) or request.GET.get("summary") == "1"
+    total_count = total_in = raw_total_out = net_change = 0
+    if show_summary:
+        # 筆數跟進出合計用同一個 aggregate，只掃一次
+        summary = qs.aggregate(
+            total_count=Count("id"),
+            total_in=Sum("change", filter=Q(change__gt=0)),
+            total_out=Sum("change", filter=Q(change__lt=0)),
         )
+        total_count = summary["total_count"]
+        total_in = summary["total_in"] or 0
+        raw_total_out = summary["total_out"] or 0
+        net_change = total_in + raw_total_out
 
-    
-    date_from = request.GET.get("date_from") or ""
-    date_to = request.GET.get("date_to") or ""
-    if date_from:
-        qs = qs.filter(created_at__date__gte=date_from)
-    if date_to:
-        qs = qs.filter(created_at__date__lte=date_to)
-
-   
-    reason = request.GET.get("reason") or ""
-    if reason:
-        qs = qs.filter(reason=reason)
+    # keyset 分頁：沿 (created_at, id) 的 index 往下找，不用 OFFSET
+    paginator = KeysetPaginator(qs, ("-created_at", "-id"), per_page=20)
+    transactions = paginator.page(after=after, before=before)
 
-  
-    total_count = qs.count()
-
-    summary = qs.aggregate(
-        total_in=Sum("change", filter=Q(change__gt=0)),
-        total_out=Sum("change", filter=Q(change__lt=0)),
-    )
-    total_in = summary["total_in"] or 0
-    raw_total_out = summary["total_out"] or 0   
-    net_change = total_in + raw_total_out
-
-   
-    paginator = Paginator(qs, 20)
-    page = request.GET.get("page")
-    transactions = paginator.get_page(page)
+    base_query = request.GET.copy()
+    for key in ("after", "before", "page", "summary"):
+        base_query.pop(key, None)
+    base_query["back"] = back_url
 
     context = {
         "transactions": transactions,
         "selected_drug": selected_drug,
         "drug_id": drug_id,
         "back_url": back_url,
+        "base_query": base_query.urlencode(),
 
        
-        "q_drug": q_drug,
-        "q_operator": q_operator,
-        "date_from": date_from,
-        "date_to": date_to,
-        "reason": reason,
-
-        
+        "q_drug": filters["q_drug"],
+        "q_operator": filters["q_operator"],
+        "date_from": filters["date_from"],
+        "date_to": filters["date_to"],
+        "reason": filters["reason"],
+
+        "show_summary": show_summary,
+        "summary_query": request.GET.urlencode(),
         "total_count": total_count,
         "total_in": total_in,
         "total_out": abs(raw_total_out),  
@@ -301,6 +297,54 @@ def stock_history(request):
     return render(request, "inventory/stock_history.html", context)
 
 
+def _filter_stock_transactions(request):
+    """
+    stock_history 跟 CSV 匯出共用的篩選。
+    日期用半開區間 [date_from 00:00, date_to 隔天 00:00) 直接比 created_at，
+    不用 created_at__date（包函式會讓 index 失效）。
+    """
+    filters = {
+        key: (request.GET.get(key) or "").strip()
+        for key in ("drug", "q_drug", "q_operator", "date_from", "date_to", "reason")
+    }
+    qs = StockTransaction.objects.all()
+
+    if filters["drug"]:
+        qs = qs.filter(drug_id=filters["drug"])
+    if filters["q_drug"]:
+        qs = qs.filter(drug__name__icontains=filters["q_drug"])
+    if filters["q_operator"]:
+        q_operator = filters["q_operator"]
+        qs = qs.filter(
+            Q(operator__username__icontains=q_operator)
+            | Q(operator__first_name__icontains=q_operator)
+            | Q(operator__last_name__icontains=q_operator)
+        )
+
+    date_from = _parse_day(filters["date_from"])
+    date_to = _parse_day(filters["date_to"])
+    if date_from:
+        qs = qs.filter(created_at__gte=_local_midnight(date_from))
+    if date_to:
+        qs = qs.filter(created_at__lt=_local_midnight(date_to + timedelta(days=1)))
+
+    if filters["reason"]:
+        qs = qs.filter(reason=filters["reason"])
+
+    return qs, filters
+
+
+def _parse_day(value):
+    try:
+        return parse_date(value) if value else None
+    except ValueError:
+        return None
+
+
+def _local_midnight(day):
+    return timezone.make_aware(datetime.combine(day, time.min))
+
+
 @login_required
 def stock_history_drug(request, drug_id):
    
@@ -310,6 +354,7 @@ def stock_history_drug(request, drug_id):
 
 
 @group_required("PHARMACY")
+@use_replica
 def expiry_dashboard(request):
     """
     藥品效期管理儀表板：
@@ -517,37 +562,14 @@ def batch_unquarantine(request, batch_id):
     return redirect("inventory:quarantine_dashboard")
 
 @group_required("PHARMACY")
+@use_replica
 def stock_history_export_csv(request):
+    qs, _ = _filter_stock_transactions(request)
     qs = (
-        StockTransaction.objects
-        .select_related("drug", "batch", "operator", "prescription")
-        .order_by("-created_at")
+        qs.select_related("drug", "batch", "operator", "prescription")
+        .order_by("-created_at", "-id")
     )
 
-    drug_id = (request.GET.get("drug") or "").strip()
-    reason = (request.GET.get("reason") or "").strip()
-    q_operator = (request.GET.get("q_operator") or "").strip()
-    date_from = (request.GET.get("date_from") or "").strip()
-    date_to = (request.GET.get("date_to") or "").strip()
-    q_drug = (request.GET.get("q_drug") or "").strip()
-
-    if drug_id:
-        qs = qs.filter(drug_id=drug_id)
-    if reason:
-        qs = qs.filter(reason=reason)
-    if q_drug:
-        qs = qs.filter(drug__name__icontains=q_drug)
-    if q_operator:
-        qs = qs.filter(
-            Q(operator__username__icontains=q_operator)
-            | Q(operator__first_name__icontains=q_operator)
-            | Q(operator__last_name__icontains=q_operator)
-        )
-    if date_from:
-        qs = qs.filter(created_at__date__gte=date_from)
-    if date_to:
-        qs = qs.filter(created_at__date__lte=date_to)
-
     resp = HttpResponse(content_type="text/csv; charset=utf-8")
     resp["Content-Disposition"] = 'attachment; filename="stock_history.csv"'
     resp.write("\ufeff")  # Excel 友善 BOM  
@@ -566,7 +588,8 @@ def stock_history_export_csv(request):
         "Note",
     ])
 
-    for tx in qs:
+    # 一年份的異動也不要一次全部載進記憶體
+    for tx in qs.iterator(chunk_size=2000):
         w.writerow([
             tx.created_at.strftime("%Y-%m-%d %H:%M"),
             tx.drug.code if tx.drug else "",
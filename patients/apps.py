@@ -4,3 +4,16 @@ from django.apps import AppConfig
 class PatientsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'patients'
+
+    def ready(self):
+        from django.db.models.signals import post_migrate
+
+        post_migrate.connect(repair_search_triggers, sender=self)
+
+
+def repair_search_triggers(using, **kwargs):
+    from django.db import connections
+
+    from .search import repair_triggers
+
+    repair_triggers(connections[using])
@@ -0,0 +1,221 @@
+"""
+重複病人偵測與合併。
+
+前台掛號用身分證 get_or_create，身分證打錯一碼就會多開一本病歷，就診紀錄被拆成兩半。
+這裡批次找出疑似同一人的病人放進審核佇列（DuplicateCandidate），確認後再合併。
+
+不做兩兩全比對：先依生日分組（依生日排序串流讀，一次只放一天的病人在記憶體），
+同一天內再用「電話」或「姓名片段（中文兩字一組、英文一個字）」分區塊，
+只有落在同一個區塊的兩個人才算相似度，所以成本大致跟病人數成正比。
+"""
+
+import re
+import unicodedata
+from collections import defaultdict
+from dataclasses import dataclass
+from difflib import SequenceMatcher
+from itertools import combinations, groupby
+
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.utils import timezone
+
+from .models import DuplicateCandidate, Patient
+
+DEFAULT_THRESHOLD = 0.75
+# 同一個區塊超過這麼多人（例如大家都填同一支代表號）就不比了，不然又變回兩兩比對
+MAX_BLOCK = 50
+
+NAME_WEIGHT = 0.45
+NATIONAL_ID_WEIGHT = 0.35
+PHONE_WEIGHT = 0.2
+
+# 合併時兩邊都有內容就串起來的欄位（過敏、病史不能因為合併而弄丟）
+MERGE_TEXT_FIELDS = ("allergies", "chronic_diseases", "family_disease_notes", "other_risk_notes")
+# 保留的那筆是空的才拿另一筆來補
+FILL_BLANK_FIELDS = (
+    "nhi_no", "gender", "phone", "email", "address", "height_cm", "weight_kg",
+    "emergency_contact_name", "emergency_contact_phone", "emergency_contact_relation",
+)
+
+
+def normalize_name(name):
+    name = unicodedata.normalize("NFKC", name or "").upper()
+    return re.sub(r"[\s\W_]+", " ", name).strip()
+
+
+def normalize_phone(phone):
+    digits = re.sub(r"\D", "", phone or "")
+    if digits.startswith("886"):
+        digits = "0" + digits[3:]
+    # 太短的（分機、亂填的）當作沒有
+    return digits if len(digits) >= 8 else ""
+
+
+def name_tokens(name):
+    tokens = set()
+    for word in name.split():
+        if word.isascii():
+            tokens.add(word)
+        elif len(word) <= 2:
+            tokens.add(word)
+        else:
+            tokens.update(word[i:i + 2] for i in range(len(word) - 1))
+    return tokens
+
+
+@dataclass(frozen=True)
+class _Row:
+    id: int
+    name: str
+    national_id: str
+    phone: str
+
+    def block_keys(self):
+        keys = {("n", t) for t in name_tokens(self.name)}
+        if self.phone:
+            keys.add(("p", self.phone))
+        return keys
+
+
+@dataclass
+class DuplicateMatch:
+    patient_a_id: int
+    patient_b_id: int
+    score: float
+    reasons: list
+
+
+def score_pair(a, b):
+    """回傳 (分數 0~1, 原因)；呼叫前已經確定生日相同。"""
+    reasons = ["生日相同"]
+
+    name = SequenceMatcher(None, a.name, b.name).ratio() if a.name and b.name else 0.0
+    if name == 1.0:
+        reasons.append("姓名相同")
+    elif name >= 0.6:
+        reasons.append("姓名相似")
+
+    nid = SequenceMatcher(None, a.national_id, b.national_id).ratio()
+    if nid >= 0.8:
+        reasons.append("身分證相近")
+
+    phone = 1.0 if a.phone and a.phone == b.phone else 0.0
+    if phone:
+        reasons.append("電話相同")
+
+    score = NAME_WEIGHT * name + NATIONAL_ID_WEIGHT * nid + PHONE_WEIGHT * phone
+    return round(score, 4), reasons
+
+
+def _match_day(rows, threshold, max_block):
+    blocks = defaultdict(list)
+    for row in rows:
+        for key in row.block_keys():
+            blocks[key].append(row)
+
+    seen = set()
+    for members in blocks.values():
+        if len(members) < 2 or len(members) > max_block:
+            continue
+        # rows 依 id 排序，所以 a.id < b.id
+        for a, b in combinations(members, 2):
+            if (a.id, b.id) in seen:
+                continue
+            seen.add((a.id, b.id))
+            score, reasons = score_pair(a, b)
+            if score >= threshold:
+                yield DuplicateMatch(a.id, b.id, score, reasons)
+
+
+def find_duplicates(patients=None, threshold=DEFAULT_THRESHOLD, max_block=MAX_BLOCK):
+    """逐一產生疑似重複的病人配對（DuplicateMatch）。"""
+    qs = (
+        (patients if patients is not None else Patient.objects.all())
+        .order_by("birth_date", "id")
+        .values_list("birth_date", "id", "full_name", "national_id", "phone")
+    )
+    for _, day in groupby(qs.iterator(chunk_size=5000), key=lambda r: r[0]):
+        rows = [
+            _Row(pk, normalize_name(name), (national_id or "").upper(), normalize_phone(phone))
+            for _, pk, name, national_id, phone in day
+        ]
+        if len(rows) > 1:
+            yield from _match_day(rows, threshold, max_block)
+
+
+def refresh_review_queue(matches, batch_size=1000):
+    """把配對寫進審核佇列；已經在佇列裡（包含排除過的）的配對不動。回傳新增筆數。"""
+    before = DuplicateCandidate.objects.count()
+    batch = []
+    for m in matches:
+        batch.append(DuplicateCandidate(
+            patient_a_id=m.patient_a_id,
+            patient_b_id=m.patient_b_id,
+            score=m.score,
+            reasons="、".join(m.reasons),
+        ))
+        if len(batch) >= batch_size:
+            DuplicateCandidate.objects.bulk_create(batch, ignore_conflicts=True)
+            batch = []
+    if batch:
+        DuplicateCandidate.objects.bulk_create(batch, ignore_conflicts=True)
+    return DuplicateCandidate.objects.count() - before
+
+
+def _patient_relations():
+    # 掛號、叫號、處方……所有指向病人的 FK；審核佇列本身會跟著被刪掉的病人一起 CASCADE
+    for rel in Patient._meta.related_objects:
+        if rel.related_model is not DuplicateCandidate and rel.one_to_many:
+            yield rel.related_model, rel.field.name
+
+
+class MergeRefused(ValueError):
+    """這兩筆不能直接合併（例如要刪掉的病歷綁著病人帳號），要人工處理。"""
+
+
+def merge_patients(keep, duplicate, user=None):
+    """
+    把 duplicate 併進 keep：關聯資料一個 model 一個 UPDATE 整批改指過去，
+    空白欄位用 duplicate 補、過敏 / 病史串起來，最後刪掉 duplicate。
+    兩筆病人先 select_for_update 重讀：合併途中別人改了 keep 不會被舊資料蓋掉，
+    也不會有新掛號掛到 duplicate 上、再跟著 CASCADE 被刪掉。
+    回傳 {model label: 搬過去的筆數}。
+    """
+    if keep.pk == duplicate.pk:
+        raise ValueError("不能跟自己合併")
+
+    moved = {}
+    with transaction.atomic():
+        locked = Patient.objects.select_for_update().in_bulk([keep.pk, duplicate.pk])
+        if len(locked) != 2:
+            raise MergeRefused("病人資料已不存在，可能已經合併過了")
+        keep, duplicate = locked[keep.pk], locked[duplicate.pk]
+
+        # 病人帳號用 username 對病歷號，刪掉的病歷綁著帳號的話登入後就找不到資料
+        if duplicate.chart_no and get_user_model().objects.filter(username=duplicate.chart_no).exists():
+            raise MergeRefused(f"病歷號 {duplicate.chart_no} 綁著病人帳號，請改保留這一筆或先處理帳號")
+
+        for model, field in _patient_relations():
+            moved[model._meta.label] = model.objects.filter(**{field: duplicate}).update(**{field: keep})
+
+        changed = ["note"]
+        for field in MERGE_TEXT_FIELDS:
+            mine = (getattr(keep, field) or "").strip()
+            theirs = (getattr(duplicate, field) or "").strip()
+            if theirs and theirs not in mine:
+                setattr(keep, field, f"{mine}；{theirs}" if mine else theirs)
+                changed.append(field)
+        for field in FILL_BLANK_FIELDS:
+            if getattr(keep, field) in (None, "") and getattr(duplicate, field) not in (None, ""):
+                setattr(keep, field, getattr(duplicate, field))
+                changed.append(field)
+
+        stamp = timezone.localtime().strftime("%Y-%m-%d %H:%M")
+        by = f"，{user.get_username()}" if user is not None else ""
+        line = f"[{stamp}{by}] 合併重複病歷 {duplicate.chart_no}（{duplicate.full_name}，身分證 {duplicate.national_id}）"
+        keep.note = f"{keep.note}\n{line}" if keep.note else line
+        keep.save(update_fields=changed)
+
+        duplicate.delete()
+    return moved
@@ -1,4 +1,5 @@
 from django import forms
+from django.conf import settings
 from .models import Patient
 
 
@@ -90,3 +91,25 @@ class PatientForm(forms.ModelForm):
             "height_cm": "可略過，若已知請填整數（公分）",
             "weight_kg": "可略過，若已知請填公斤，最多一位小數",
         }
+
+
+class PatientImportForm(forms.Form):
+    file = forms.FileField(
+        label="檔案（CSV 或 JSONL）",
+        help_text="CSV 第一列為欄位名稱；JSONL 一行一個 JSON 物件。必填：full_name、national_id、birth_date",
+    )
+    update_existing = forms.BooleanField(
+        label="身分證已存在時更新資料",
+        required=False,
+        initial=True,
+    )
+
+    def clean_file(self):
+        # 網頁匯入是同步跑的，大檔會超過 worker timeout，改用 python manage.py import_patients
+        uploaded = self.cleaned_data["file"]
+        limit = settings.PATIENT_IMPORT_MAX_UPLOAD_BYTES
+        if uploaded.size > limit:
+            raise forms.ValidationError(
+                f"檔案超過 {limit // (1024 * 1024)} MB，請改用 python manage.py import_patients 匯入 。"
+            )
+        return uploaded
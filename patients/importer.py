@@ -0,0 +1,168 @@
+"""
+病人資料批次匯入（CSV / JSONL）。
+
+邊讀邊處理，一次一個 chunk：
+- 一個 national_id IN (...) 查出 chunk 內已存在的病人
+- 新病人一次保留一整段病歷號，再 bulk_create
+- 已存在的病人只更新檔案裡有填的欄位，用 bulk_update；空白格視為沒提供，不會把舊資料清掉
+記憶體只跟 chunk 大小有關，跟檔案總筆數無關。
+"""
+
+import csv
+import io
+import json
+from dataclasses import dataclass, field
+
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.utils import timezone
+
+from common import fragments
+
+from .forms import PatientForm
+from .models import Patient
+
+IMPORT_FIELDS = tuple(PatientForm.Meta.fields)
+REQUIRED_FIELDS = ("full_name", "national_id", "birth_date")
+MAX_ERROR_SAMPLES = 100
+
+
+@dataclass
+class ImportResult:
+    created: int = 0
+    updated: int = 0
+    skipped: int = 0
+    errors: list = field(default_factory=list)
+    error_count: int = 0
+
+    def add_error(self, line, message):
+        self.error_count += 1
+        if len(self.errors) < MAX_ERROR_SAMPLES:
+            self.errors.append((line, message))
+
+
+def detect_format(filename):
+    return "jsonl" if filename.lower().endswith((".jsonl", ".ndjson")) else "csv"
+
+
+def iter_records(fp, fmt):
+    """逐行產生 (行號, dict)；fp 是文字模式的檔案物件。"""
+    if fmt == "jsonl":
+        for line_no, line in enumerate(fp, start=1):
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError as e:
+                yield line_no, e
+                continue
+            yield line_no, record if isinstance(record, dict) else ValueError("每一行必須是 JSON 物件")
+    else:
+        reader = csv.DictReader(fp)
+        for record in reader:
+            yield reader.line_num, record
+
+
+def open_upload(uploaded):
+    # 上傳檔以 bytes 讀；utf-8-sig 順便吃掉 Excel 存 CSV 時加的 BOM
+    return io.TextIOWrapper(uploaded.file, encoding="utf-8-sig", newline="")
+
+
+def _clean(record):
+    values = {}
+    for name in IMPORT_FIELDS:
+        if name not in record:
+            continue
+        model_field = Patient._meta.get_field(name)
+        raw = record[name]
+        if raw is None or (isinstance(raw, str) and not raw.strip()):
+            # 不放進 values：新病人用欄位預設值，舊病人保留原本的資料
+            continue
+        try:
+            value = model_field.to_python(raw.strip() if isinstance(raw, str) else raw)
+            # max_length、email 格式等欄位本身的 validator
+            model_field.run_validators(value)
+        except ValidationError as e:
+            raise ValidationError(f"{name}：{'; '.join(e.messages)}")
+        if model_field.choices and value not in dict(model_field.flatchoices):
+            raise ValidationError(f"{name} 不是有效的選項：{value!r}")
+        values[name] = value
+
+    missing = [name for name in REQUIRED_FIELDS if not values.get(name)]
+    if missing:
+        raise ValidationError(f"缺少必填欄位：{', '.join(missing)}")
+    values["national_id"] = values["national_id"].upper()
+    return values
+
+
+def _import_chunk(rows, result, update_existing):
+    # 同一個 chunk 裡同一個身分證出現多次時，以最後一筆為準
+    by_id = {}
+    for values in rows:
+        by_id[values["national_id"]] = values
+
+    with transaction.atomic():
+        existing = {
+            p.national_id: p
+            for p in Patient.objects.filter(national_id__in=list(by_id))
+        }
+
+        new_rows = [v for nid, v in by_id.items() if nid not in existing]
+        if new_rows:
+            chart_nos = Patient.allocate_chart_nos(len(new_rows))
+            Patient.objects.bulk_create(
+                [Patient(chart_no=chart_no, **v) for chart_no, v in zip(chart_nos, new_rows)]
+            )
+            result.created += len(new_rows)
+
+        if not existing:
+            return
+        if not update_existing:
+            result.skipped += len(existing)
+            return
+
+        # 只更新真的有變的病人 / 欄位：重複匯入同一份檔案幾乎不用寫入
+        changed, changed_fields = [], set()
+        now = timezone.now()
+        for nid, patient in existing.items():
+            diff = [name for name, value in by_id[nid].items() if getattr(patient, name) != value]
+            if not diff:
+                continue
+            for name in diff:
+                setattr(patient, name, by_id[nid][name])
+            patient.updated_at = now
+            changed.append(patient)
+            changed_fields.update(diff)
+        if changed:
+            # bulk_update 每批是一個 CASE WHEN id=… 的 UPDATE，批次太大反而變慢
+            Patient.objects.bulk_update(changed, sorted(changed_fields | {"updated_at"}), batch_size=100)
+        result.updated += len(changed)
+        result.skipped += len(existing) - len(changed)
+
+
+def import_patients(records, chunk_size=1000, update_existing=True):
+    """
+    records：iter_records() 產生的 (行號, dict)。
+    單筆資料錯誤只記下來、不中斷；每個 chunk 各自一個交易。
+    """
+    result = ImportResult()
+    chunk = []
+    for line_no, record in records:
+        if isinstance(record, Exception):
+            result.add_error(line_no, str(record))
+            continue
+        try:
+            chunk.append(_clean(record))
+        except ValidationError as e:
+            result.add_error(line_no, "; ".join(e.messages))
+            continue
+        if len(chunk) >= chunk_size:
+            _import_chunk(chunk, result, update_existing)
+            chunk = []
+    if chunk:
+        _import_chunk(chunk, result, update_existing)
+
+    if result.updated:
+        # bulk_update 不會觸發 post_save，看板 / 藥局面板上的病人姓名要另外讓片段快取失效
+        fragments.bump(fragments.TICKETS, fragments.PRESCRIPTIONS)
+    return result
@@ -0,0 +1,35 @@
+# Generated by Django 5.2.8 on 2026-10-19 07:08
+
+from django.db import migrations, models
+
+
+def install_search(apps, schema_editor):
+    # SQLite：FTS5 trigram 表 + 同步 trigger；PostgreSQL：pg_trgm GIN index
+    from patients.search import install
+
+    install(schema_editor.connection)
+
+
+def uninstall_search(apps, schema_editor):
+    from patients.search import uninstall
+
+    uninstall(schema_editor.connection)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('patients', '0005_patient_other_risk_notes'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='patient',
+            index=models.Index(fields=['phone'], name='patients_pa_phone_fc49bb_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='patient',
+            index=models.Index(fields=['full_name'], name='patients_pa_full_na_b75abe_idx'),
+        ),
+        migrations.RunPython(install_search, uninstall_search),
+    ]
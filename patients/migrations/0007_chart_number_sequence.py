@@ -0,0 +1,39 @@
+# Generated by Django 5.2.8 on 2026-10-19 07:11
+
+import re
+
+from django.db import migrations, models
+
+
+def seed_sequence(apps, schema_editor):
+    # 從現有最大病歷號接續（P999 < P1000 不能靠字串排序，逐筆解析）
+    Patient = apps.get_model("patients", "Patient")
+    ChartNumberSequence = apps.get_model("patients", "ChartNumberSequence")
+    best = 0
+    for chart_no in Patient.objects.values_list("chart_no", flat=True).iterator(chunk_size=5000):
+        m = re.search(r"(\d+)$", chart_no or "")
+        if m:
+            best = max(best, int(m.group(1)))
+    ChartNumberSequence.objects.update_or_create(name="chart_no", defaults={"last_value": best})
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('patients', '0006_search_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ChartNumberSequence',
+            fields=[
+                ('name', models.CharField(max_length=30, primary_key=True, serialize=False)),
+                ('last_value', models.PositiveBigIntegerField(default=0)),
+            ],
+            options={
+                'verbose_name': '流水號',
+                'verbose_name_plural': '流水號',
+            },
+        ),
+        migrations.RunPython(seed_sequence, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 5.2.8 on 2026-10-19 07:28
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('patients', '0007_chart_number_sequence'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DuplicateCandidate',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('score', models.FloatField(verbose_name='相似度')),
+                ('reasons', models.CharField(blank=True, max_length=200, verbose_name='相似原因')),
+                ('status', models.CharField(choices=[('pending', '待確認'), ('dismissed', '不是同一人')], default='pending', max_length=10, verbose_name='狀態')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='建立時間')),
+                ('reviewed_at', models.DateTimeField(blank=True, null=True, verbose_name='確認時間')),
+                ('patient_a', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='patients.patient')),
+                ('patient_b', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='patients.patient')),
+                ('reviewed_by', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': '疑似重複病人',
+                'verbose_name_plural': '疑似重複病人',
+                'indexes': [models.Index(fields=['status', '-score', 'id'], name='patients_du_status_dceff1_idx')],
+                'constraints': [models.UniqueConstraint(fields=('patient_a', 'patient_b'), name='uniq_duplicate_pair')],
+            },
+        ),
+    ]
@@ -1,5 +1,5 @@
-from django.db import models
-from django.db.models import Max
+from django.db import models, transaction
+from django.db.models import F, Max
 import re
 from django.utils import timezone
 
@@ -111,6 +111,11 @@ class Patient(models.Model):
         verbose_name = "病人"
         verbose_name_plural = "病人"
         ordering = ["chart_no"]
+        indexes = [
+            # 病人搜尋的電話 / 姓名前綴（patients.search）
+            models.Index(fields=["phone"]),
+            models.Index(fields=["full_name"]),
+        ]
 
     def __str__(self):
         return f"{self.chart_no} {self.full_name}"
@@ -130,23 +135,110 @@ class Patient(models.Model):
     def save(self, *args, **kwargs):
        
         if not self.chart_no:
-            self.chart_no = self._generate_chart_no()
+            self.chart_no = self.allocate_chart_nos(1)[0]
         super().save(*args, **kwargs)
 
     @staticmethod
-    def _generate_chart_no():
+    def format_chart_no(number):
+        return f"{CHART_NO_PREFIX}{number:03d}"
+
+    @classmethod
+    def allocate_chart_nos(cls, count):
         """
-        自動產生下一個病歷號：
-        找出目前最大尾碼 → +1 → P001, P002, P003...  
+        從流水號一次保留 count 個病歷號：P001, P002, P003...
+        大量匯入時一次拿一整段，不用每筆都去搶計數器。
         """
-        last = Patient.objects.order_by("-id").first()
-        if not last or not last.chart_no:
-            num = 1
-        else:
-            m = re.search(r"(\d+)$", last.chart_no or "")
-            if m:
-                num = int(m.group(1)) + 1
-            else:
-                
-                num = (last.id or 0) + 1
-        return f"P{num:03d}"
\ No newline at end of file
+        return [cls.format_chart_no(n) for n in ChartNumberSequence.reserve(count)]
+
+
+CHART_NO_PREFIX = "P"
+
+
+def max_chart_number(patients):
+    """現有病歷號的最大流水號（P999 < P1000 不能靠字串排序，所以逐筆解析）。"""
+    best = 0
+    for chart_no in patients.values_list("chart_no", flat=True).iterator(chunk_size=5000):
+        m = re.search(r"(\d+)$", chart_no or "")
+        if m:
+            best = max(best, int(m.group(1)))
+    return best
+
+
+class ChartNumberSequence(models.Model):
+    """
+    病歷號流水號計數器。
+
+    配號只靠一個 UPDATE last_value = last_value + n：這一列會被鎖到交易結束，
+    同時掛號的 request（前台、櫃台）排隊拿到不重複的號碼，不會再撞 unique。
+    """
+
+    CHART_NO = "chart_no"
+
+    name = models.CharField(max_length=30, primary_key=True)
+    last_value = models.PositiveBigIntegerField(default=0)
+
+    class Meta:
+        verbose_name = "流水號"
+        verbose_name_plural = "流水號"
+
+    def __str__(self):
+        return f"{self.name} = {self.last_value}"
+
+    @classmethod
+    def reserve(cls, count=1, name=CHART_NO):
+        if count < 1:
+            raise ValueError("count 必須 >= 1")
+        with transaction.atomic():
+            updated = cls.objects.filter(name=name).update(last_value=F("last_value") + count)
+            if not updated:
+                # 計數器還不存在（例如直接建表的測試 DB）：從現有最大病歷號接續
+                cls.objects.get_or_create(
+                    name=name, defaults={"last_value": max_chart_number(Patient.objects.all())},
+                )
+                cls.objects.filter(name=name).update(last_value=F("last_value") + count)
+            last = cls.objects.values_list("last_value", flat=True).get(name=name)
+        return range(last - count + 1, last + 1)
+
+
+class DuplicateCandidate(models.Model):
+    """
+    疑似重複的病人（patients.dedup 批次找出來的），等人工確認後合併或排除。
+    patient_a 一律是 id 比較小的那個，同一對只會有一筆；排除過的不會再跑出來。
+    """
+
+    STATUS_PENDING = "pending"
+    STATUS_DISMISSED = "dismissed"
+    STATUS_CHOICES = [
+        (STATUS_PENDING, "待確認"),
+        (STATUS_DISMISSED, "不是同一人"),
+    ]
+
+    patient_a = models.ForeignKey(Patient, on_delete=models.CASCADE, related_name="+")
+    patient_b = models.ForeignKey(Patient, on_delete=models.CASCADE, related_name="+")
+    score = models.FloatField("相似度")
+    reasons = models.CharField("相似原因", max_length=200, blank=True)
+    status = models.CharField("狀態", max_length=10, choices=STATUS_CHOICES, default=STATUS_PENDING)
+
+    created_at = models.DateTimeField("建立時間", auto_now_add=True)
+    reviewed_by = models.ForeignKey(
+        "auth.User",
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name="+",
+    )
+    reviewed_at = models.DateTimeField("確認時間", null=True, blank=True)
+
+    class Meta:
+        verbose_name = "疑似重複病人"
+        verbose_name_plural = "疑似重複病人"
+        constraints = [
+            models.UniqueConstraint(fields=["patient_a", "patient_b"], name="uniq_duplicate_pair"),
+        ]
+        indexes = [
+            # 審核佇列：待確認的依相似度高到低
+            models.Index(fields=["status", "-score", "id"]),
+        ]
+
+    def __str__(self):
+        return f"{self.patient_a_id} ~ {self.patient_b_id} ({self.score:.2f})"
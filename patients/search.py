@@ -0,0 +1,177 @@
+"""
+病人搜尋：依關鍵字的樣子決定走哪個 index，不再對每個欄位做 icontains 全表掃描。
+
+- P + 數字（P001）          → 病歷號前綴
+- 英文字母 + 數字（A12345） → 身分證前綴
+- 純數字（0912…）          → 電話前綴
+- 其他視為姓名：
+  * 3 個字以上：SQLite 用 FTS5 trigram 全文索引（任意位置子字串），
+    PostgreSQL 用 pg_trgm 的 GIN index（UPPER(full_name) gin_trgm_ops）
+  * 1–2 個字：trigram 用不上，改用姓名前綴（通常是查姓氏）
+
+前綴一律寫成 >= prefix AND < prefix + U+10FFFF 的範圍條件：SQLite 的 LIKE 預設不分大小寫，
+用不到一般 index，範圍條件在兩種資料庫都能直接走 B-tree。
+"""
+
+import re
+import sqlite3
+
+from django.db import connections, router
+from django.db.models import Q
+from django.db.models.expressions import RawSQL
+
+from .models import Patient
+
+FTS_TABLE = "patients_patient_fts"
+TRGM_INDEX = "patients_patient_full_name_trgm"
+MIN_TRIGRAM_LENGTH = 3
+
+CHART_NO_RE = re.compile(r"^P\d{1,8}$", re.IGNORECASE)
+NATIONAL_ID_RE = re.compile(r"^[A-Z]\d{0,9}$", re.IGNORECASE)
+PHONE_RE = re.compile(r"^[\d\-\s()+]+$")
+
+_PREFIX_END = "\U0010ffff"
+
+_fts_enabled = {}
+
+
+# ---------------------------------------------------------------------------
+# 建立 / 維護搜尋用的結構（migration 與 post_migrate 共用）
+
+SQLITE_FTS_SQL = [
+    f"""
+    CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5(
+        full_name, content='patients_patient', content_rowid='id', tokenize='trigram'
+    )
+    """,
+]
+
+SQLITE_TRIGGER_SQL = [
+    f"""
+    CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ai AFTER INSERT ON patients_patient BEGIN
+        INSERT INTO {FTS_TABLE}(rowid, full_name) VALUES (new.id, new.full_name);
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ad AFTER DELETE ON patients_patient BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, full_name) VALUES ('delete', old.id, old.full_name);
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_au AFTER UPDATE OF full_name ON patients_patient BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, full_name) VALUES ('delete', old.id, old.full_name);
+        INSERT INTO {FTS_TABLE}(rowid, full_name) VALUES (new.id, new.full_name);
+    END
+    """,
+]
+
+POSTGRES_SQL = [
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+    f"CREATE INDEX IF NOT EXISTS {TRGM_INDEX} ON patients_patient USING gin (UPPER(full_name) gin_trgm_ops)",
+]
+
+
+def sqlite_supports_fts(connection):
+    # trigram tokenizer 要 SQLite 3.34+，而且要有編進 FTS5
+    if sqlite3.sqlite_version_info < (3, 34):
+        return False
+    with connection.cursor() as cursor:
+        cursor.execute("PRAGMA compile_options")
+        return any(row[0] == "ENABLE_FTS5" for row in cursor.fetchall())
+
+
+def install(connection):
+    if connection.vendor == "sqlite":
+        if not sqlite_supports_fts(connection):
+            return
+        with connection.cursor() as cursor:
+            for sql in SQLITE_FTS_SQL + SQLITE_TRIGGER_SQL:
+                cursor.execute(sql)
+            cursor.execute(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')")
+    elif connection.vendor == "postgresql":
+        with connection.cursor() as cursor:
+            for sql in POSTGRES_SQL:
+                cursor.execute(sql)
+    _fts_enabled.pop(connection.alias, None)
+
+
+def uninstall(connection):
+    with connection.cursor() as cursor:
+        if connection.vendor == "sqlite":
+            for suffix in ("ai", "ad", "au"):
+                cursor.execute(f"DROP TRIGGER IF EXISTS {FTS_TABLE}_{suffix}")
+            cursor.execute(f"DROP TABLE IF EXISTS {FTS_TABLE}")
+        elif connection.vendor == "postgresql":
+            cursor.execute(f"DROP INDEX IF EXISTS {TRGM_INDEX}")
+    _fts_enabled.pop(connection.alias, None)
+
+
+def repair_triggers(connection):
+    """
+    SQLite 改欄位時 Django 會重建 patients_patient（複製到新表再改名），trigger 會跟著不見。
+    post_migrate 時補回 trigger；有補的話把 FTS 索引整個重建一次。
+    """
+    if connection.vendor != "sqlite" or not fts_enabled(connection):
+        return
+    names = [f"{FTS_TABLE}_{s}" for s in ("ai", "ad", "au")]
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT COUNT(*) FROM sqlite_master WHERE type = 'trigger' AND name IN (%s, %s, %s)", names,
+        )
+        if cursor.fetchone()[0] == len(names):
+            return
+        for sql in SQLITE_TRIGGER_SQL:
+            cursor.execute(sql)
+        cursor.execute(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')")
+
+
+def fts_enabled(connection):
+    if connection.vendor != "sqlite":
+        return False
+    if connection.alias not in _fts_enabled:
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = %s", [FTS_TABLE])
+            _fts_enabled[connection.alias] = cursor.fetchone() is not None
+    return _fts_enabled[connection.alias]
+
+
+# ---------------------------------------------------------------------------
+# 查詢
+
+
+def _prefix(field, prefix):
+    return Q(**{f"{field}__gte": prefix, f"{field}__lt": prefix + _PREFIX_END})
+
+
+def search_patients(query, queryset=None):
+    """
+    回傳 (queryset, ordering)。ordering 的第一個欄位就是用來找資料的 index，
+    交給 KeysetPaginator 分頁時可以沿著同一個 index 往下走。
+    """
+    qs = Patient.objects.all() if queryset is None else queryset
+    query = " ".join(query.split())
+    if not query:
+        return qs, ("id",)
+
+    if CHART_NO_RE.match(query):
+        return qs.filter(_prefix("chart_no", query.upper())), ("chart_no", "id")
+
+    if NATIONAL_ID_RE.match(query):
+        return qs.filter(_prefix("national_id", query.upper())), ("national_id", "id")
+
+    if PHONE_RE.match(query):
+        digits = re.sub(r"\D", "", query)
+        if digits:
+            return qs.filter(_prefix("phone", digits)), ("phone", "id")
+
+    if len(query) < MIN_TRIGRAM_LENGTH:
+        return qs.filter(_prefix("full_name", query)), ("full_name", "id")
+
+    connection = connections[router.db_for_read(Patient)]
+    if fts_enabled(connection):
+        phrase = '"' + query.replace('"', '""') + '"'
+        matches = RawSQL(f"SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s", [phrase])
+        return qs.filter(pk__in=matches), ("id",)
+
+    # PostgreSQL：icontains 會產生 UPPER(full_name) LIKE UPPER(...)，剛好對上 trigram GIN index
+    return qs.filter(full_name__icontains=query), ("id",)
@@ -1,3 +1,447 @@
-from django.test import TestCase
+import io
+import json
+import os
+import subprocess
+import sys
+import tempfile
+from datetime import date, time, timedelta
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from appointments.models import Appointment
+from common.pagination import KeysetPaginator
+from doctors.models import Doctor
+from inventory.models import Drug
+from prescriptions.models import Prescription, PrescriptionItem, PrescriptionLog
+from queues.models import VisitTicket
+
+from . import dedup, importer, search, timeline, views
+from .models import ChartNumberSequence, DuplicateCandidate, Patient
+
+TEST_STORAGES = {
+    "default": {"BACKEND": "django.core.files.storage.FileSystemStorage"},
+    "staticfiles": {"BACKEND": "django.contrib.staticfiles.storage.StaticFilesStorage"},
+}
+
+
+def make_patient(n, full_name, phone=""):
+    return Patient.objects.create(
+        full_name=full_name, national_id=f"A{n:09d}", phone=phone, birth_date=date(1980, 1, 1),
+    )
+
+
+class PatientSearchTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.wang = make_patient(1, "王小明", phone="0912345678")
+        cls.lin = make_patient(2, "林美玲", phone="0922000111")
+        cls.wang2 = make_patient(3, "王大明", phone="0912999000")
+
+    def _names(self, query):
+        qs, ordering = search.search_patients(query)
+        return [p.full_name for p in qs.order_by(*ordering)]
+
+    def test_identifier_prefixes(self):
+        self.assertEqual(self._names(self.lin.chart_no), ["林美玲"])
+        self.assertEqual(self._names(self.lin.chart_no.lower()), ["林美玲"])
+        self.assertEqual(self._names("a00000000"), ["王小明", "林美玲", "王大明"])
+        self.assertEqual(self._names("A000000003"), ["王大明"])
+        self.assertEqual(self._names("0912"), ["王小明", "王大明"])
+        self.assertEqual(self._names("0922-000"), ["林美玲"])
+
+    def test_names(self):
+        # 1–2 個字：姓名前綴；3 個字以上：任意位置子字串
+        self.assertEqual(self._names("王"), ["王大明", "王小明"])
+        self.assertEqual(self._names("小明"), [])
+        self.assertEqual(self._names("王小明"), ["王小明"])
+        self.assertEqual(self._names("美玲 "), [])
+        self.assertEqual(self._names('林美玲"'), [])
+
+    @skipUnless(connection.vendor == "sqlite", "FTS5 trigram 是 SQLite 專用")
+    def test_fts_index_follows_writes(self):
+        self.assertTrue(search.fts_enabled(connection))
+        make_patient(4, "陳小明同學")
+        self.assertEqual(self._names("小明同"), ["陳小明同學"])
+
+        self.wang.full_name = "王曉明"
+        self.wang.save()
+        self.assertEqual(self._names("王小明"), [])
+        self.assertEqual(self._names("王曉明"), ["王曉明"])
+
+        self.lin.delete()
+        self.assertEqual(self._names("林美玲"), [])
+
+    @skipUnless(connection.vendor == "sqlite", "EXPLAIN QUERY PLAN 的輸出格式是 SQLite 專用")
+    def test_searches_use_indexes(self):
+        table = Patient._meta.db_table
+        for query in ("", self.lin.chart_no, "A0000", "0912", "王", "王小明"):
+            qs, ordering = search.search_patients(query)
+            page = KeysetPaginator(qs, ordering, per_page=1).page()
+            with CaptureQueriesContext(connection) as ctx:
+                KeysetPaginator(qs, ordering, per_page=1).page(after=page.next_cursor)
+            with self.subTest(query=query), connection.cursor() as cursor:
+                cursor.execute("EXPLAIN QUERY PLAN " + ctx.captured_queries[0]["sql"])
+                plan = [row[-1] for row in cursor.fetchall()]
+                self.assertFalse([p for p in plan if p.split()[:2] == ["SCAN", table]], plan)
+
+
+@override_settings(PROFILING_SLOW_LOG=None, METRICS_DIR="", STORAGES=TEST_STORAGES)
+class PatientListViewTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user("reception")
+        for n in range(1, 8):
+            make_patient(n, f"王{n}號", phone=f"09120000{n:02d}")
+
+    def test_search_and_keyset_pages(self):
+        self.client.force_login(self.user)
+        url = reverse("patients:patient_list")
+        with mock.patch.object(views, "PER_PAGE", 3):
+            first = self.client.get(url, {"q": "王"})
+            page = first.context["patients"]
+            second = self.client.get(f"{url}?{first.context['base_query']}&after={page.next_cursor}")
+
+        self.assertEqual([p.full_name for p in first.context["patients"]], ["王1號", "王2號", "王3號"])
+        self.assertEqual([p.full_name for p in second.context["patients"]], ["王4號", "王5號", "王6號"])
+        self.assertTrue(second.context["patients"].has_previous)
+        self.assertContains(second, "上一頁")
+
+
+class ChartNumberTests(TestCase):
+    def test_sequential_and_block_allocation(self):
+        first = make_patient(1, "甲")
+        block = Patient.allocate_chart_nos(3)
+        second = make_patient(2, "乙")
+        self.assertEqual(first.chart_no, "P001")
+        self.assertEqual(block, ["P002", "P003", "P004"])
+        self.assertEqual(second.chart_no, "P005")
+
+    def test_missing_counter_resumes_after_existing_numbers(self):
+        make_patient(1, "甲")
+        Patient.objects.filter(chart_no="P001").update(chart_no="P1200")
+        ChartNumberSequence.objects.all().delete()
+        self.assertEqual(make_patient(2, "乙").chart_no, "P1201")
+
+
+CONCURRENT_REGISTRATION_SCRIPT = """
+import threading
+from datetime import date, time, timedelta
+import django
+django.setup()
+from django.core.management import call_command
+from django.db import connections
+from patients.models import Patient
+
+call_command("migrate", verbosity=0)
+
+WORKERS, ROUNDS = 8, 15
+errors = []
+start = threading.Barrier(WORKERS)
+
+def register(w):
+    start.wait()
+    try:
+        for r in range(ROUNDS):
+            Patient.objects.create(
+                full_name=f"病人{w}-{r}", national_id=f"C{w:02d}{r:07d}", birth_date=date(1980, 1, 1),
+            )
+    except Exception as e:
+        errors.append(repr(e))
+    finally:
+        connections.close_all()
+
+threads = [threading.Thread(target=register, args=(w,)) for w in range(WORKERS)]
+for t in threads:
+    t.start()
+for t in threads:
+    t.join()
+
+numbers = sorted(int(c[1:]) for c in Patient.objects.values_list("chart_no", flat=True))
+print(numbers == list(range(1, WORKERS * ROUNDS + 1)), len(errors), errors[:3])
+"""
+
+
+class ConcurrentChartNumberTests(SimpleTestCase):
+
+    def test_parallel_registrations_get_distinct_numbers(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            env = dict(
+                os.environ,
+                DJANGO_SETTINGS_MODULE="hospitalsys.settings",
+                DATABASE_URL=f"sqlite:///{tmp}/chart_no.sqlite3",
+            )
+            result = subprocess.run(
+                [sys.executable, "-c", CONCURRENT_REGISTRATION_SCRIPT],
+                cwd=settings.BASE_DIR, env=env, capture_output=True, text=True, timeout=300,
+            )
+        self.assertEqual(result.returncode, 0, result.stderr)
+        contiguous, error_count, samples = result.stdout.strip().split(" ", 2)
+        self.assertEqual(int(error_count), 0, samples)
+        self.assertEqual(contiguous, "True")
+
+
+@override_settings(PROFILING_SLOW_LOG=None, METRICS_DIR="", STORAGES=TEST_STORAGES)
+class PatientImportTests(TestCase):
+    CSV = (
+        "full_name,national_id,birth_date,phone\n"
+        "王小明,a123456789,1980-01-02,0911\n"
+        "林美玲,B223456789,1975-05-06,\n"
+        "缺生日,C123456789,,\n"
+        "陳大文,D123456789,1990-02-30,\n"
+        "王小明改,A123456789,1980-01-02,0999\n"
+    )
+
+    def test_csv_creates_updates_and_reports_bad_rows(self):
+        existing = make_patient(1, "舊名字")
+        existing.national_id = "B223456789"
+        existing.save()
+        chart_no = existing.chart_no
+
+        with CaptureQueriesContext(connection) as ctx:
+            result = importer.import_patients(
+                importer.iter_records(io.StringIO(self.CSV), "csv"), chunk_size=2,
+            )
+
+        self.assertEqual((result.created, result.updated, result.error_count), (1, 2, 2))
+        self.assertEqual([line for line, _ in result.errors], [4, 5])
+
+        # 3 筆有效資料、chunk_size=2 → 2 個 chunk，各一個身分證 IN 查詢
+        lookups = [q for q in ctx.captured_queries if '"national_id" IN' in q["sql"]]
+        self.assertEqual(len(lookups), 2)
+
+        created = Patient.objects.get(national_id="A123456789")
+        self.assertEqual((created.full_name, created.phone), ("王小明改", "0999"))
+        self.assertRegex(created.chart_no, r"^P\d{3,}$")
+        existing.refresh_from_db()
+        self.assertEqual((existing.full_name, existing.chart_no), ("林美玲", chart_no))
+
+    def test_jsonl_upload_view(self):
+        user = User.objects.create_superuser("admin", password="pw")
+        self.client.force_login(user)
+        upload = SimpleUploadedFile(
+            "patients.jsonl",
+            "\n".join([
+                json.dumps({"full_name": "張三", "national_id": "E123456789", "birth_date": "1970-01-01"}),
+                "not json",
+                "",
+            ]).encode(),
+        )
+        response = self.client.post(reverse("patients:patient_import"), {"file": upload, "update_existing": "on"})
+        self.assertEqual(response.status_code, 200)
+        result = response.context["result"]
+        self.assertEqual((result.created, result.error_count), (1, 1))
+        self.assertTrue(Patient.objects.filter(national_id="E123456789").exists())
+
+    def test_blank_cells_do_not_wipe_existing_values(self):
+        existing = make_patient(1, "舊名字")
+        Patient.objects.filter(pk=existing.pk).update(phone="0912", address="台北市", allergies="盤尼西林")
+        csv_text = (
+            "full_name,national_id,birth_date,phone,address,allergies\n"
+            f"新名字,{existing.national_id},{existing.birth_date},,,\n"
+        )
+        result = importer.import_patients(importer.iter_records(io.StringIO(csv_text), "csv"))
+
+        self.assertEqual(result.updated, 1)
+        existing.refresh_from_db()
+        self.assertEqual(
+            (existing.full_name, existing.phone, existing.address, existing.allergies),
+            ("新名字", "0912", "台北市", "盤尼西林"),
+        )
+
+    @override_settings(PATIENT_IMPORT_MAX_UPLOAD_BYTES=100)
+    def test_large_upload_is_sent_to_the_command(self):
+        self.client.force_login(User.objects.create_superuser("admin", password="pw"))
+        upload = SimpleUploadedFile("patients.csv", self.CSV.encode() * 2)
+        response = self.client.post(reverse("patients:patient_import"), {"file": upload})
+
+        self.assertIsNone(response.context["result"])
+        self.assertIn("import_patients", str(response.context["form"].errors["file"]))
+        self.assertFalse(Patient.objects.exists())
+
+    def test_import_requires_permission(self):
+        self.client.force_login(User.objects.create_user("nobody"))
+        self.assertEqual(self.client.get(reverse("patients:patient_import")).status_code, 403)
+
+
+
+def add_visit(patient, doctor, drug, day, n):
+    Appointment.objects.create(patient=patient, doctor=doctor, date=day, time=time(9, n % 60))
+    ticket = VisitTicket.objects.create(patient=patient, doctor=doctor, date=day, number=n)
+    rx = Prescription.objects.create(patient=patient, doctor=doctor, date=day, visit_ticket=ticket)
+    PrescriptionItem.objects.create(prescription=rx, drug=drug, quantity=n)
+    PrescriptionLog.objects.create(prescription=rx, action=PrescriptionLog.ACTION_DISPENSE)
+    PrescriptionLog.objects.create(prescription=rx, action=PrescriptionLog.ACTION_UPDATE)
+
+
+@override_settings(PROFILING_SLOW_LOG=None, METRICS_DIR="", STORAGES=TEST_STORAGES)
+class PatientTimelineTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user("reception")
+        cls.patient = make_patient(1, "王小明")
+        cls.doctor = Doctor.objects.create(name="林醫師", department="內科")
+        cls.drug = Drug.objects.create(code="D001", name="普拿疼")
+        # 4 次就診、兩兩同一天 → 12 筆
+        for n in range(1, 5):
+            add_visit(cls.patient, cls.doctor, cls.drug, date(2024, 1, 1) + timedelta(days=n // 2), n)
+
+    def _all_pages(self, per_page):
+        keys, after, queries = [], None, []
+        while True:
+            with CaptureQueriesContext(connection) as ctx:
+                page = timeline.build_timeline(self.patient, after=after, per_page=per_page)
+                [timeline.entry_to_dict(e) for e in page]
+            queries.append(len(ctx.captured_queries))
+            keys += [(e.date, timeline.KIND_RANK[e.kind], e.obj.pk) for e in page]
+            if not page.has_next:
+                return keys, queries
+            after = page.next_cursor
+
+    def test_pages_are_merged_newest_first_without_gaps(self):
+        keys, _ = self._all_pages(per_page=5)
+        self.assertEqual(len(keys), 12)
+        self.assertEqual(len(set(keys)), 12)
+        self.assertEqual(keys, sorted(keys, reverse=True))
+        # 同一天：處方 → 叫號 → 掛號
+        self.assertEqual([rank for _, rank, _ in keys[:3]], [2, 1, 0])
+
+    def test_query_count_does_not_grow_with_history(self):
+        _, small = self._all_pages(per_page=5)
+        for n in range(5, 40):
+            add_visit(self.patient, self.doctor, self.drug, date(2023, 1, 1) + timedelta(days=n), n)
+        _, large = self._all_pages(per_page=5)
+        # 掛號、叫號、處方 + items / logs 兩個 prefetch
+        self.assertEqual(max(small), 5)
+        self.assertEqual(max(large), 5)
+
+    def test_views(self):
+        self.client.force_login(self.user)
+        response = self.client.get(reverse("patients:patient_timeline", args=[self.patient.pk]))
+        self.assertContains(response, "普拿疼")
+        self.assertContains(response, "藥局完成領藥")
+        self.assertNotContains(response, "修改處方")
+
+        data = self.client.get(reverse("patients:patient_timeline_api", args=[self.patient.pk])).json()
+        self.assertFalse(data["has_next"])
+        self.assertEqual(len(data["entries"]), 12)
+        rx = data["entries"][0]
+        self.assertEqual(rx["kind"], "prescription")
+        self.assertEqual(rx["items"][0]["drug"], "普拿疼")
+        self.assertEqual([e["action"] for e in rx["dispensing"]], ["dispense"])
+
+    def test_bad_cursor_falls_back_to_first_page(self):
+        self.client.force_login(self.user)
+        url = reverse("patients:patient_timeline_api", args=[self.patient.pk])
+        self.assertEqual(len(self.client.get(url, {"after": "!!garbage"}).json()["entries"]), 12)
+
+
+@override_settings(PROFILING_SLOW_LOG=None, METRICS_DIR="", STORAGES=TEST_STORAGES)
+class DuplicateDetectionTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        def person(nid, name, birth, phone=""):
+            return Patient.objects.create(full_name=name, national_id=nid, phone=phone, birth_date=birth)
+
+        day = date(1980, 5, 6)
+        cls.original = person("A123456789", "王小明", day, "0912-345-678")
+        cls.typo = person("A123456780", "王小明", day, "+886912345678")
+        # 雙胞胎：同生日同電話，名字與身分證不同
+        cls.twin_a = person("B223456781", "陳怡君", day, "0922000111")
+        cls.twin_b = person("B224987650", "陳怡安", day, "0922000111")
+        # 同名但生日不同不會被比到
+        cls.other_day = person("A123456788", "王小明", date(1981, 5, 6), "0912345678")
+
+    def test_blocking_and_scoring(self):
+        pairs = {(m.patient_a_id, m.patient_b_id): m for m in dedup.find_duplicates()}
+        self.assertEqual(set(pairs), {(self.original.pk, self.typo.pk)})
+        match = pairs[(self.original.pk, self.typo.pk)]
+        self.assertIn("電話相同", match.reasons)
+        self.assertIn("身分證相近", match.reasons)
+
+        self.assertEqual(dedup.refresh_review_queue(dedup.find_duplicates()), 1)
+        # 再跑一次不會重複放入
+        self.assertEqual(dedup.refresh_review_queue(dedup.find_duplicates()), 0)
+
+    def test_oversized_blocks_are_skipped(self):
+        self.assertEqual(list(dedup.find_duplicates(max_block=1)), [])
+
+    def test_merge_repoints_history(self):
+        doctor = Doctor.objects.create(name="林醫師", department="內科")
+        drug = Drug.objects.create(code="D001", name="普拿疼")
+        add_visit(self.typo, doctor, drug, date(2024, 1, 2), 1)
+        add_visit(self.original, doctor, drug, date(2024, 1, 1), 2)
+        self.typo.allergies = "盤尼西林"
+        self.typo.save()
+
+        dedup.refresh_review_queue(dedup.find_duplicates())
+        candidate = DuplicateCandidate.objects.get()
+        admin = User.objects.create_superuser("admin", password="pw")
+        self.client.force_login(admin)
+
+        self.assertContains(self.client.get(reverse("patients:duplicate_review")), self.typo.chart_no)
+        with CaptureQueriesContext(connection) as ctx:
+            dedup.merge_patients(self.original, self.typo, user=admin)
+        repoints = [q for q in ctx.captured_queries if q["sql"].startswith("UPDATE") and '"patient_id"' in q["sql"]]
+        self.assertEqual(len(repoints), 3)
+
+        self.assertFalse(Patient.objects.filter(pk=self.typo.pk).exists())
+        self.assertFalse(DuplicateCandidate.objects.filter(pk=candidate.pk).exists())
+        self.assertEqual(Appointment.objects.filter(patient=self.original).count(), 2)
+        self.assertEqual(VisitTicket.objects.filter(patient=self.original).count(), 2)
+        self.assertEqual(Prescription.objects.filter(patient=self.original).count(), 2)
+        self.original.refresh_from_db()
+        self.assertEqual(self.original.allergies, "盤尼西林")
+        self.assertIn(self.typo.chart_no, self.original.note)
+
+    def test_merge_rereads_both_patients(self):
+        keep, duplicate = Patient.objects.get(pk=self.original.pk), Patient.objects.get(pk=self.typo.pk)
+        # 審核頁載入之後，護理師才補上過敏史
+        Patient.objects.filter(pk=self.original.pk).update(allergies="阿斯匹靈")
+        Patient.objects.filter(pk=self.typo.pk).update(allergies="盤尼西林")
+
+        dedup.merge_patients(keep, duplicate)
+        self.original.refresh_from_db()
+        self.assertEqual(self.original.allergies, "阿斯匹靈；盤尼西林")
+
+    def test_merge_refused_when_duplicate_has_a_login(self):
+        User.objects.create_user(self.typo.chart_no)
+        with self.assertRaises(dedup.MergeRefused):
+            dedup.merge_patients(self.original, self.typo)
+        self.assertTrue(Patient.objects.filter(pk=self.typo.pk).exists())
+
+        dedup.refresh_review_queue(dedup.find_duplicates())
+        candidate = DuplicateCandidate.objects.get()
+        self.client.force_login(User.objects.create_superuser("admin", password="pw"))
+        response = self.client.post(
+            reverse("patients:duplicate_resolve", args=[candidate.pk]), {"action": "keep_a"}, follow=True,
+        )
+        self.assertContains(response, "無法合併")
+        self.assertTrue(Patient.objects.filter(pk=self.typo.pk).exists())
+
+    def test_resolve_view(self):
+        dedup.refresh_review_queue(dedup.find_duplicates())
+        candidate = DuplicateCandidate.objects.get()
+        url = reverse("patients:duplicate_resolve", args=[candidate.pk])
+
+        self.client.force_login(User.objects.create_user("nobody"))
+        self.assertEqual(self.client.post(url, {"action": "dismiss"}).status_code, 403)
+
+        self.client.force_login(User.objects.create_superuser("admin", password="pw"))
+        self.client.post(url, {"action": "dismiss"})
+        candidate.refresh_from_db()
+        self.assertEqual(candidate.status, DuplicateCandidate.STATUS_DISMISSED)
+        # 排除過的配對不會再跑回佇列
+        self.assertEqual(dedup.refresh_review_queue(dedup.find_duplicates()), 0)
+
+        candidate.status = DuplicateCandidate.STATUS_PENDING
+        candidate.save()
+        self.client.post(url, {"action": "keep_b"})
+        self.assertFalse(Patient.objects.filter(pk=self.original.pk).exists())
+        self.assertTrue(Patient.objects.filter(pk=self.typo.pk).exists())
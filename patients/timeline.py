@@ -0,0 +1,178 @@
+"""
+病人時間軸：掛號、叫號、處方（含用藥明細與領藥 / 退藥紀錄）依日期合併成一條，新的在前。
+
+排序鍵是 (date, 種類, id)，三個來源各自沿 (patient, date, id) index 往回取 per_page + 1 筆，
+在 Python 合併後切一頁；cursor 就是這頁最後一筆的排序鍵。
+不管病人有幾年的紀錄，每頁都是固定幾個 query、不用 OFFSET。
+"""
+
+import base64
+import heapq
+import json
+from dataclasses import dataclass
+from datetime import date
+
+from django.db.models import Prefetch, Q
+
+from appointments.models import Appointment
+from prescriptions.models import Prescription, PrescriptionItem, PrescriptionLog
+from queues.models import VisitTicket
+
+# 同一天內的先後：掛號 → 叫號 → 處方（時間軸倒序時處方在最上面）
+KIND_APPOINTMENT = "appointment"
+KIND_TICKET = "ticket"
+KIND_PRESCRIPTION = "prescription"
+KIND_RANK = {KIND_APPOINTMENT: 0, KIND_TICKET: 1, KIND_PRESCRIPTION: 2}
+
+DISPENSING_ACTIONS = (
+    PrescriptionLog.ACTION_DISPENSE,
+    PrescriptionLog.ACTION_CANCEL,
+    PrescriptionLog.ACTION_RETURN,
+)
+
+
+@dataclass
+class TimelineEntry:
+    kind: str
+    date: date
+    obj: object
+
+    @property
+    def key(self):
+        return (self.date, KIND_RANK[self.kind], self.obj.pk)
+
+
+@dataclass
+class TimelinePage:
+    entries: list
+    has_next: bool
+    next_cursor: str | None
+
+    def __iter__(self):
+        return iter(self.entries)
+
+    def __len__(self):
+        return len(self.entries)
+
+
+def encode_cursor(key):
+    raw = json.dumps([key[0].isoformat(), key[1], key[2]], separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor):
+    # 壞掉或被竄改的 cursor 當作第一頁
+    if not cursor:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        day, rank, pk = json.loads(raw)
+        return (date.fromisoformat(day), int(rank), int(pk))
+    except (ValueError, TypeError):
+        return None
+
+
+def _before(kind, cursor):
+    """排在 cursor 之後（也就是更舊）的條件；同一個來源的種類固定，所以只剩 date / id。"""
+    day, rank, pk = cursor
+    mine = KIND_RANK[kind]
+    if mine < rank:
+        return Q(date__lte=day)
+    if mine > rank:
+        return Q(date__lt=day)
+    return Q(date__lt=day) | Q(date=day, id__lt=pk)
+
+
+def _sources(patient):
+    return {
+        KIND_APPOINTMENT: (
+            Appointment.objects
+            .filter(patient=patient)
+            .select_related("doctor")
+        ),
+        KIND_TICKET: (
+            VisitTicket.objects
+            .filter(patient=patient)
+            .select_related("doctor")
+        ),
+        KIND_PRESCRIPTION: (
+            Prescription.objects
+            .filter(patient=patient)
+            .select_related("doctor", "verified_by", "dispensed_by")
+            .prefetch_related(
+                Prefetch("items", queryset=PrescriptionItem.objects.select_related("drug").order_by("id")),
+                Prefetch(
+                    "logs",
+                    queryset=PrescriptionLog.objects
+                    .filter(action__in=DISPENSING_ACTIONS)
+                    .select_related("operator")
+                    .order_by("created_at", "id"),
+                    to_attr="dispensing_events",
+                ),
+            )
+        ),
+    }
+
+
+def build_timeline(patient, after=None, per_page=30):
+    cursor = decode_cursor(after)
+    streams = []
+    for kind, qs in _sources(patient).items():
+        if cursor is not None:
+            qs = qs.filter(_before(kind, cursor))
+        rows = qs.order_by("-date", "-id")[: per_page + 1]
+        streams.append([TimelineEntry(kind, row.date, row) for row in rows])
+
+    merged = list(heapq.merge(*streams, key=lambda e: e.key, reverse=True))
+    entries = merged[:per_page]
+    has_next = len(merged) > per_page
+    return TimelinePage(
+        entries=entries,
+        has_next=has_next,
+        next_cursor=encode_cursor(entries[-1].key) if has_next else None,
+    )
+
+
+def entry_to_dict(entry):
+    obj = entry.obj
+    data = {"kind": entry.kind, "id": obj.pk, "date": entry.date.isoformat()}
+    if entry.kind == KIND_APPOINTMENT:
+        data.update(
+            time=obj.time.strftime("%H:%M"),
+            status=obj.status,
+            doctor=obj.doctor.name,
+        )
+    elif entry.kind == KIND_TICKET:
+        data.update(
+            number=obj.number,
+            status=obj.status,
+            doctor=obj.doctor.name,
+            called_at=obj.called_at.isoformat() if obj.called_at else None,
+            finished_at=obj.finished_at.isoformat() if obj.finished_at else None,
+        )
+    else:
+        data.update(
+            status=obj.status,
+            verify_status=obj.verify_status,
+            pharmacy_status=obj.pharmacy_status,
+            doctor=obj.doctor.name,
+            items=[
+                {
+                    "drug": item.drug.name,
+                    "quantity": item.quantity,
+                    "usage": item.usage,
+                    "treatment_days": item.treatment_days,
+                }
+                for item in obj.items.all()
+            ],
+            dispensing=[
+                {
+                    "action": log.action,
+                    "at": log.created_at.isoformat(),
+                    "operator": log.operator.username if log.operator else None,
+                    "message": log.message,
+                }
+                for log in obj.dispensing_events
+            ],
+        )
+    return data
@@ -10,7 +10,15 @@ urlpatterns = [
 
     path("create/", views.patient_create, name="patient_create"),
 
+    path("import/", views.patient_import, name="patient_import"),
+
+    path("duplicates/", views.duplicate_review, name="duplicate_review"),
+    path("duplicates/<int:pk>/resolve/", views.duplicate_resolve, name="duplicate_resolve"),
+
     path("<int:pk>/", views.patient_detail, name="patient_detail"),
 
     path("<int:pk>/edit/", views.patient_update, name="patient_update"),
+
+    path("<int:pk>/timeline/", views.patient_timeline, name="patient_timeline"),
+    path("<int:pk>/timeline.json", views.patient_timeline_api, name="patient_timeline_api"),
 ]
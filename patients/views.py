@@ -1,9 +1,20 @@
+from django.contrib import messages
+from django.http import JsonResponse
 from django.shortcuts import render, get_object_or_404, redirect
-from django.contrib.auth.decorators import login_required
-from .models import Patient
-from .forms import PatientForm
-from django.db.models import Q 
+from django.contrib.auth.decorators import login_required, permission_required
+from django.utils import timezone
+from django.views.decorators.http import require_POST
+from .models import DuplicateCandidate, Patient
+from .dedup import MergeRefused, merge_patients
+from .forms import PatientForm, PatientImportForm
+from .importer import detect_format, import_patients, iter_records, open_upload
+from .search import search_patients
+from .timeline import build_timeline, entry_to_dict
 from appointments.models import Appointment
+from common.pagination import KeysetPaginator
+
+PER_PAGE = 50
+TIMELINE_PER_PAGE = 30
 
 
 @login_required
@@ -11,22 +22,23 @@ def patient_list(request):
     
     query = request.GET.get("q", "").strip()
 
-    
-    patients = Patient.objects.all().order_by("id")
+    # 依關鍵字型態走病歷號 / 身分證 / 電話前綴或姓名全文索引，見 patients.search
+    patients, ordering = search_patients(query)
 
-    
-    if query:
-        patients = patients.filter(
-            Q(name__icontains=query) |
-            Q(id_number__icontains=query) |
-            Q(phone__icontains=query) |
-            Q(medical_record_number__icontains=query)
-        )
+    # keyset 分頁：沿著搜尋用的 index 往下找，不做 COUNT(*)、也不用 OFFSET
+    page = KeysetPaginator(patients, ordering, per_page=PER_PAGE).page(
+        after=request.GET.get("after"),
+        before=request.GET.get("before"),
+    )
+
+    base_query = request.GET.copy()
+    for key in ("after", "before"):
+        base_query.pop(key, None)
 
-    
     context = {
-        "patients": patients,
+        "patients": page,
         "query": query,
+        "base_query": base_query.urlencode(),
     }
     return render(request, "patients/patient_list.html", context)
 
@@ -75,3 +87,91 @@ def patient_update(request, pk):
     else:
         form = PatientForm(instance=patient)
     return render(request, "patients/patient_form.html", {"form": form, "mode": "edit", "patient": patient})
+
+
+@login_required
+@permission_required("patients.add_patient", raise_exception=True)
+def patient_import(request):
+    result = None
+    if request.method == "POST":
+        form = PatientImportForm(request.POST, request.FILES)
+        if form.is_valid():
+            uploaded = form.cleaned_data["file"]
+            result = import_patients(
+                iter_records(open_upload(uploaded), detect_format(uploaded.name)),
+                update_existing=form.cleaned_data["update_existing"],
+            )
+    else:
+        form = PatientImportForm()
+    return render(request, "patients/patient_import.html", {"form": form, "result": result})
+
+
+@login_required
+def patient_timeline(request, pk):
+    patient = get_object_or_404(Patient, pk=pk)
+    page = build_timeline(patient, after=request.GET.get("after"), per_page=TIMELINE_PER_PAGE)
+    return render(request, "patients/patient_timeline.html", {"patient": patient, "timeline": page})
+
+
+@login_required
+def patient_timeline_api(request, pk):
+    patient = get_object_or_404(Patient, pk=pk)
+    page = build_timeline(patient, after=request.GET.get("after"), per_page=TIMELINE_PER_PAGE)
+    return JsonResponse({
+        "patient": {"id": patient.pk, "chart_no": patient.chart_no, "full_name": patient.full_name},
+        "entries": [entry_to_dict(e) for e in page],
+        "has_next": page.has_next,
+        "next_cursor": page.next_cursor,
+    })
+
+
+@login_required
+@permission_required("patients.change_patient", raise_exception=True)
+def duplicate_review(request):
+    candidates = (
+        DuplicateCandidate.objects
+        .filter(status=DuplicateCandidate.STATUS_PENDING)
+        .select_related("patient_a", "patient_b")
+    )
+    page = KeysetPaginator(candidates, ("-score", "id"), per_page=PER_PAGE).page(
+        after=request.GET.get("after"),
+        before=request.GET.get("before"),
+    )
+    return render(request, "patients/patient_duplicates.html", {"candidates": page})
+
+
+@require_POST
+@login_required
+@permission_required("patients.delete_patient", raise_exception=True)
+def duplicate_resolve(request, pk):
+    candidate = get_object_or_404(
+        DuplicateCandidate.objects.select_related("patient_a", "patient_b"),
+        pk=pk,
+        status=DuplicateCandidate.STATUS_PENDING,
+    )
+    action = request.POST.get("action")
+
+    if action == "dismiss":
+        candidate.status = DuplicateCandidate.STATUS_DISMISSED
+        candidate.reviewed_by = request.user
+        candidate.reviewed_at = timezone.now()
+        candidate.save(update_fields=["status", "reviewed_by", "reviewed_at"])
+        messages.info(request, "已標記為不同人")
+    elif action in ("keep_a", "keep_b"):
+        keep, duplicate = candidate.patient_a, candidate.patient_b
+        if action == "keep_b":
+            keep, duplicate = duplicate, keep
+        # 合併後 duplicate 被刪除，這筆佇列紀錄也跟著 CASCADE 掉
+        try:
+            moved = merge_patients(keep, duplicate, user=request.user)
+        except MergeRefused as exc:
+            messages.error(request, f"無法合併：{exc}")
+        else:
+            messages.success(
+                request,
+                f"已將 {duplicate.chart_no} 併入 {keep.chart_no}（搬移 {sum(moved.values())} 筆紀錄）",
+            )
+    else:
+        messages.error(request, "未知的動作，請再試一次。")
+
+    return redirect("patients:duplicate_review")
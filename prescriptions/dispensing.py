@@ -0,0 +1,226 @@
+"""
+批次領藥：尖峰時段一次勾多張已審核的處方，合併成一張撿藥單（依藥品、FEFO 批次分組），
+藥師照單走一趟藥架，確認後一次扣完。
+
+審核時已經保留好批次的處方（inventory.reservations）直接照保留發；沒有保留或保留不完整的，
+照逐張領藥的規則現場配：正常、有庫存、效期 >= 今天 + max(給藥天數, MIN_VALID_DAYS) 的批次，
+效期早的先用，扣掉別張處方的保留。多張處方共用同一份剩餘量，依處方編號依序配；
+某張配不齊就整張跳過，不影響其他張。
+
+確認時整批在一個 transaction 裡：批次、藥品庫存、處方各一個 bulk_update，
+StockTransaction、PrescriptionLog、PrescriptionAuditLog 各一個 bulk_create，
+勾幾張都是固定幾個 query。bulk 寫入不會觸發 post_save，片段快取版本和計數器要自己處理。
+"""
+
+import hashlib
+from collections import defaultdict
+from dataclasses import dataclass, field
+from functools import cached_property
+
+from django.db import transaction
+from django.utils import timezone
+
+from common import fragments, metrics
+from inventory import reservations
+from inventory.models import Drug, StockBatch, StockReservation
+from inventory.utils import deduct_allocations, use_drug_from_prescription_item
+
+from .models import Prescription, PrescriptionAuditLog, PrescriptionLog
+
+# 跟藥局面板、逐張確認頁一致：發出去的藥至少還要能放 7 天
+MIN_VALID_DAYS = 7
+
+
+@dataclass
+class Allocation:
+    prescription: Prescription
+    item: object
+    batch: StockBatch
+    quantity: int
+    reservation: StockReservation = None
+
+
+@dataclass
+class PickLine:
+    drug: Drug
+    batch: StockBatch
+    quantity: int
+    prescription_ids: list
+
+
+@dataclass
+class Skipped:
+    prescription_id: int
+    reason: str
+    prescription: Prescription = None
+
+
+@dataclass
+class DispensePlan:
+    prescriptions: list = field(default_factory=list)
+    skipped: list = field(default_factory=list)
+    allocations: list = field(default_factory=list)
+
+    @cached_property
+    def pick_list(self):
+        """同一個批次合成一行，依藥名、效期排；模板用 regroup 再按藥品分組。"""
+        lines = {}
+        for a in self.allocations:
+            line = lines.get(a.batch.pk)
+            if line is None:
+                line = lines[a.batch.pk] = PickLine(a.item.drug, a.batch, 0, [])
+            line.quantity += a.quantity
+            if a.prescription.pk not in line.prescription_ids:
+                line.prescription_ids.append(a.prescription.pk)
+        return sorted(lines.values(), key=lambda l: (l.drug.name, l.drug.pk, l.batch.expiry_date, l.batch.pk))
+
+    @cached_property
+    def signature(self):
+        """撿藥單的指紋：確認時重算一次，庫存在預覽之後變過就不會一樣。"""
+        raw = ";".join(
+            f"{a.prescription.pk}:{a.item.pk}:{a.batch.pk}:{a.quantity}" for a in self.allocations
+        )
+        return hashlib.sha1(raw.encode()).hexdigest()[:16]
+
+
+def _status_problem(rx):
+    if rx.verify_status != Prescription.VERIFY_APPROVED:
+        return "尚未通過藥師審核"
+    if rx.pharmacy_status == Prescription.PHARMACY_CANCELLED:
+        return "已作廢或退藥"
+    if rx.pharmacy_status == Prescription.PHARMACY_DONE:
+        return "已完成領藥"
+    if not rx.items.all():
+        return "沒有用藥項目"
+    return ""
+
+
+def plan_dispense(prescription_ids, *, lock=False, min_valid_days=MIN_VALID_DAYS):
+    """
+    幫勾選的處方配批次，回傳 DispensePlan（不寫入）。
+    lock=True 時處方和批次都 select_for_update，要在 transaction 裡呼叫。
+    """
+    ids = list(dict.fromkeys(int(pk) for pk in prescription_ids))
+    plan = DispensePlan()
+
+    qs = Prescription.objects.select_related("patient").prefetch_related("items__drug")
+    if lock:
+        qs = qs.select_for_update()
+    found = qs.in_bulk(ids)
+
+    ready = []
+    for pk in ids:
+        rx = found.get(pk)
+        problem = "找不到處方" if rx is None else _status_problem(rx)
+        if problem:
+            plan.skipped.append(Skipped(pk, problem, rx))
+        else:
+            ready.append(rx)
+    ready.sort(key=lambda rx: rx.pk)
+
+    # 審核時已經保留好的處方直接照保留發，不用重配
+    holds = reservations.with_batch_held(
+        reservations.active_holds().filter(prescription_id__in=[rx.pk for rx in ready])
+    )
+    if lock:
+        holds = holds.select_for_update()
+    holds_by_rx = defaultdict(list)
+    for h in holds.select_related("batch").order_by("batch__expiry_date", "id"):
+        holds_by_rx[h.prescription_id].append(h)
+    covered = {
+        rx.pk for rx in ready
+        if holds_by_rx.get(rx.pk)
+        and reservations.holds_cover(holds_by_rx[rx.pk], rx.items.all(), min_valid_days=min_valid_days)
+    }
+
+    # 其他的現場配：別張處方的保留照扣，這幾張自己不完整的保留不算
+    unheld = [rx for rx in ready if rx.pk not in covered]
+    batches = reservations.usable_batches(
+        {it.drug_id for rx in unheld for it in rx.items.all()},
+        lock=lock,
+        exclude_prescription_ids=[rx.pk for rx in unheld],
+    )
+    by_drug = defaultdict(list)
+    available = {}
+    for b in batches:
+        by_drug[b.drug_id].append(b)
+        available[b.pk] = b.quantity - b.held
+
+    for rx in ready:
+        if rx.pk in covered:
+            items = {it.pk: it for it in rx.items.all()}
+            plan.allocations.extend(
+                Allocation(rx, items[h.item_id], h.batch, h.quantity, reservation=h) for h in holds_by_rx[rx.pk]
+            )
+            plan.prescriptions.append(rx)
+            continue
+
+        picks, problems = reservations.allocate(rx.items.all(), by_drug, available, min_valid_days=min_valid_days)
+        if problems:
+            plan.skipped.append(Skipped(rx.pk, "；".join(problems), rx))
+            continue
+        for item, batch, qty in picks:
+            available[batch.pk] -= qty
+            plan.allocations.append(Allocation(rx, item, batch, qty))
+        plan.prescriptions.append(rx)
+
+    return plan
+
+
+def dispense_prescriptions(prescription_ids, user, *, expected_signature=None, min_valid_days=MIN_VALID_DAYS):
+    """
+    照撿藥單一次扣庫存、完成領藥。expected_signature 是預覽時的 plan.signature，
+    重算出來不一樣（庫存或處方在預覽後變了）就 ValueError，什麼都不寫。
+    """
+    with transaction.atomic():
+        plan = plan_dispense(prescription_ids, lock=True, min_valid_days=min_valid_days)
+        if expected_signature is not None and expected_signature != plan.signature:
+            raise ValueError("庫存或處方狀態在預覽後有變動，撿藥單已重新計算，請再確認一次 。")
+        if not plan.prescriptions:
+            return plan
+
+        deduct_allocations(plan.allocations, operator=user)
+        reservations.mark_consumed([a.reservation for a in plan.allocations if a.reservation])
+        # 現場配的處方如果還有不完整的舊保留，一起放掉
+        reservations.release_prescriptions([rx.pk for rx in plan.prescriptions])
+
+        now = timezone.now()
+        for rx in plan.prescriptions:
+            rx.pharmacy_status = Prescription.PHARMACY_DONE
+            rx.dispensed_by = user
+            rx.dispensed_at = now
+            rx.status = Prescription.STATUS_FINAL
+        Prescription.objects.bulk_update(
+            plan.prescriptions, ["pharmacy_status", "dispensed_by", "dispensed_at", "status"],
+        )
+
+        message = f"藥局批次領藥並扣庫存（同批 {len(plan.prescriptions)} 張）"
+        PrescriptionLog.objects.bulk_create([
+            PrescriptionLog(prescription=rx, action=PrescriptionLog.ACTION_DISPENSE, message=message, operator=user)
+            for rx in plan.prescriptions
+        ])
+        PrescriptionAuditLog.objects.bulk_create([
+            PrescriptionAuditLog(prescription=rx, action="DISPENSE", performed_by=user, detail=message)
+            for rx in plan.prescriptions
+        ])
+
+        fragments.bump(fragments.PRESCRIPTIONS)
+
+    metrics.inc(metrics.PRESCRIPTIONS_DISPENSED, len(plan.prescriptions))
+    return plan
+
+
+def deduct_prescription_stock(prescription, items, operator, *, min_valid_days=0):
+    """
+    逐張領藥扣庫存：審核時保留完整就照保留扣，不用再配批次；
+    沒有保留或保留不完整就照原本的 FEFO 現場配（use_drug_from_prescription_item）。
+    """
+    holds = reservations.consume_prescription(prescription, items, min_valid_days=min_valid_days)
+    if holds:
+        deduct_allocations(holds, operator=operator)
+        reservations.mark_consumed(holds)
+        return
+    for item in items:
+        use_drug_from_prescription_item(
+            item, operator=operator, prescription=prescription, min_valid_days=min_valid_days,
+        )
@@ -1,5 +1,9 @@
 from django import forms
-from django.forms import inlineformset_factory
+from django.forms import BaseInlineFormSet, inlineformset_factory
+from django.urls import reverse
+from django.utils.html import format_html
+
+from inventory.search import drug_label
 
 from .models import Prescription, PrescriptionItem
 
@@ -19,21 +23,67 @@ class PrescriptionForm(forms.ModelForm):
         }
 
 
+class DrugTypeaheadWidget(forms.TextInput):
+    """
+    藥品欄位：hidden 的 drug id + 一個搜尋框，候選藥品由 inventory:drug_search 即時查，
+    不再把整份藥品清單塞進每一列的 <select>。label 是目前選到的藥品，由表單設定。
+    """
+
+    def __init__(self, attrs=None):
+        super().__init__(attrs)
+        self.label = ""
+
+    def render(self, name, value, attrs=None, renderer=None):
+        attrs = self.build_attrs(self.attrs, attrs)
+        return format_html(
+            '<div class="drug-typeahead" data-url="{}">'
+            '<input type="hidden" name="{}" value="{}" id="{}">'
+            '<input type="text" class="form-control drug-typeahead-input" value="{}" '
+            'placeholder="輸入藥品代碼或名稱" autocomplete="off">'
+            '<div class="drug-typeahead-menu" hidden></div>'
+            "</div>",
+            reverse("inventory:drug_search"),
+            name,
+            self.format_value(value) or "",
+            attrs.get("id", ""),
+            self.label,
+        )
+
+
 class PrescriptionItemForm(forms.ModelForm):
     class Meta:
         model = PrescriptionItem
         fields = ["drug", "quantity", "treatment_days", "usage"]
         widgets = {
+            "drug": DrugTypeaheadWidget(),
             "usage": forms.Textarea(attrs={"rows": 2}),
             "treatment_days": forms.NumberInput(attrs={"min": 1, "class": "form-control"}),
         }
 
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        if self.instance.drug_id:
+            self.fields["drug"].widget.label = drug_label(self.instance.drug)
+
+    def clean_drug(self):
+        drug = self.cleaned_data.get("drug")
+        # 驗證失敗重新顯示表單時，搜尋框要顯示剛剛選的藥
+        self.fields["drug"].widget.label = drug_label(drug) if drug else ""
+        return drug
+
+
+class BasePrescriptionItemFormSet(BaseInlineFormSet):
+    def __init__(self, *args, **kwargs):
+        # 每一列顯示藥品名稱用，一起 JOIN 進來
+        kwargs.setdefault("queryset", PrescriptionItem.objects.select_related("drug"))
+        super().__init__(*args, **kwargs)
 
 
 PrescriptionItemFormSet = inlineformset_factory(
     Prescription,
     PrescriptionItem,
     form=PrescriptionItemForm,
+    formset=BasePrescriptionItemFormSet,
     extra=1,          
     can_delete=True, 
 )
@@ -0,0 +1,26 @@
+# Generated by Django 5.2.8 on 2026-10-19 06:51
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('doctors', '0008_alter_doctorschedule_session'),
+        ('patients', '0005_patient_other_risk_notes'),
+        ('prescriptions', '0012_prescriptionitem_days_supply_and_more'),
+        ('queues', '0003_hot_path_indexes'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='prescription',
+            index=models.Index(fields=['date', 'status', 'verify_status', 'pharmacy_status'], name='prescriptio_date_f3b821_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='prescription',
+            index=models.Index(condition=models.Q(('pharmacy_status', 'pending'), ('status', 'final'), ('verify_status', 'approved')), fields=['date', 'id'], name='rx_pharmacy_queue_idx'),
+        ),
+    ]
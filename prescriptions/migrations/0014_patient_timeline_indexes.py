@@ -0,0 +1,22 @@
+# Generated by Django 5.2.8 on 2026-10-19 07:25
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('doctors', '0008_alter_doctorschedule_session'),
+        ('patients', '0007_chart_number_sequence'),
+        ('prescriptions', '0013_hot_path_indexes'),
+        ('queues', '0003_hot_path_indexes'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='prescription',
+            index=models.Index(fields=['patient', 'date', 'id'], name='prescriptio_patient_fb5d52_idx'),
+        ),
+    ]
@@ -1,4 +1,5 @@
 from django.db import models
+from django.db.models import Q
 from django.utils import timezone
 from patients.models import Patient
 from doctors.models import Doctor
@@ -92,6 +93,20 @@ class Prescription(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=["date", "status", "verify_status", "pharmacy_status"]),
+            # 藥局待領藥清單只看「已完成 + 審核通過 + 待領藥」，partial index 只收這一小群。
+            # SQLite 用 bound parameter 時不會挑 partial index，會走上面那個複合 index。
+            models.Index(
+                fields=["date", "id"],
+                condition=Q(status="final", verify_status="approved", pharmacy_status="pending"),
+                name="rx_pharmacy_queue_idx",
+            ),
+            # 病人時間軸（patients.timeline）依 (date, id) 往回翻
+            models.Index(fields=["patient", "date", "id"]),
+        ]
+
     def __str__(self):
         return f"Prescription #{self.pk} for {self.patient}"
 
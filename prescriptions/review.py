@@ -0,0 +1,108 @@
+"""
+藥師批次審核：早上積了一堆待審處方時，勾選後一次核准 / 退回。
+
+整批在一個 transaction 裡：處方用一個 bulk_update 改審核欄位，
+PrescriptionLog、PrescriptionAuditLog 各一個 bulk_create，不管勾了幾張都是固定幾個 query。
+bulk_update 不會觸發 post_save，所以藥局面板的片段快取版本要自己 bump。
+核准的處方同時保留庫存（inventory.reservations），整批也是一個 bulk_create。
+"""
+
+from dataclasses import dataclass
+
+from django.db import transaction
+from django.utils import timezone
+
+from common import fragments
+from inventory import reservations
+
+from .dispensing import MIN_VALID_DAYS
+from .models import Prescription, PrescriptionAuditLog, PrescriptionLog
+
+ACTION_APPROVE = "approve"
+ACTION_REJECT = "reject"
+
+DEFAULT_REJECT_NOTE = "處方需醫師修正"
+
+
+@dataclass
+class ReviewResult:
+    prescription_id: int
+    ok: bool
+    message: str
+    prescription: Prescription = None
+
+
+def _log_messages(action, note):
+    """回傳 (PrescriptionLog 訊息, PrescriptionAuditLog 內容)，跟逐張審核的寫法一致。"""
+    if action == ACTION_APPROVE:
+        msg = "藥師審核通過"
+        if note:
+            msg += f"（備註：{note}）"
+        return msg, f"藥師審核通過。verify_status=approved；note={note}"
+    return f"藥師退回處方。原因：{note}", f"藥師退回處方。verify_status=rejected；note={note}"
+
+
+def review_prescriptions(prescription_ids, action, user, note=""):
+    """
+    批次核准 / 退回。只處理「已完成、待審核」的處方，其他的回報原因、不動。
+    回傳每張處方一筆 ReviewResult（依傳入順序）。
+    """
+    if action not in (ACTION_APPROVE, ACTION_REJECT):
+        raise ValueError(f"未知的審核動作：{action!r}")
+
+    note = (note or "").strip()
+    if action == ACTION_REJECT:
+        note = note or DEFAULT_REJECT_NOTE
+    verify_status = Prescription.VERIFY_APPROVED if action == ACTION_APPROVE else Prescription.VERIFY_REJECTED
+    log_msg, audit_detail = _log_messages(action, note)
+
+    ids = list(dict.fromkeys(int(pk) for pk in prescription_ids))
+    results = []
+
+    with transaction.atomic():
+        qs = Prescription.objects.select_for_update().select_related("patient")
+        if action == ACTION_APPROVE:
+            qs = qs.prefetch_related("items__drug")
+        found = qs.in_bulk(ids)
+        now = timezone.now()
+        changed = []
+
+        for pk in ids:
+            rx = found.get(pk)
+            if rx is None:
+                results.append(ReviewResult(pk, False, "找不到處方"))
+            elif rx.status != Prescription.STATUS_FINAL:
+                results.append(ReviewResult(pk, False, "處方尚未完成，無法審核", rx))
+            elif rx.verify_status != Prescription.VERIFY_PENDING:
+                results.append(ReviewResult(pk, False, f"已經審核過（{rx.get_verify_status_display()}）", rx))
+            else:
+                rx.verify_status = verify_status
+                rx.verified_by = user
+                rx.verified_at = now
+                rx.verify_note = note
+                changed.append(rx)
+                results.append(ReviewResult(pk, True, "已通過審核" if action == ACTION_APPROVE else "已退回醫師", rx))
+
+        if changed:
+            Prescription.objects.bulk_update(
+                changed, ["verify_status", "verified_by", "verified_at", "verify_note"],
+            )
+            PrescriptionLog.objects.bulk_create([
+                PrescriptionLog(
+                    prescription=rx, action=PrescriptionLog.ACTION_UPDATE, message=log_msg[:200], operator=user,
+                )
+                for rx in changed
+            ])
+            PrescriptionAuditLog.objects.bulk_create([
+                PrescriptionAuditLog(prescription=rx, action="UPDATE", performed_by=user, detail=audit_detail)
+                for rx in changed
+            ])
+            fragments.bump(fragments.PRESCRIPTIONS)
+
+            if action == ACTION_APPROVE:
+                failed = reservations.reserve_prescriptions(changed, user, min_valid_days=MIN_VALID_DAYS)
+                for result in results:
+                    if result.prescription_id in failed:
+                        result.message += f"（庫存未保留：{failed[result.prescription_id]}）"
+
+    return results
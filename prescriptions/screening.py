@@ -0,0 +1,166 @@
+"""
+開處方時的用藥篩檢：過敏、同成分重複開立。
+
+過敏史是自由文字，所以反過來做：把整份藥典（品名、學名）加上過敏原同義詞表
+編成一個 Aho-Corasick 自動機，病人的過敏史只要從頭掃一遍，就知道提到了哪些成分，
+再跟這張處方的藥比對；過敏史多長、藥典多大，掃描時間都只跟過敏史長度成正比。
+
+自動機每個 process 編一次，key 是片段快取裡的 formulary 版本號：只有藥品的品名、學名、上下架
+或同義詞表改了才換號（扣庫存、進貨、退藥不算），平常存檔只多一次快取讀取加上掃一段短文字。
+"""
+
+import hashlib
+import unicodedata
+from collections import defaultdict, deque
+from dataclasses import dataclass
+
+from common import fragments
+from inventory.models import AllergenSynonym, Drug
+
+KIND_ALLERGY = "allergy"
+KIND_DUPLICATE = "duplicate"
+
+# 會影響自動機的 Drug 欄位；存檔只動到其他欄位（例如 stock_quantity）就不重編
+FORMULARY_FIELDS = frozenset({"name", "generic_name", "is_active"})
+
+# 一個字的關鍵字（例如單字藥名）太容易誤判，不放進自動機
+MIN_KEYWORD_LENGTH = 2
+
+
+def normalize(text):
+    return unicodedata.normalize("NFKC", text or "").lower().strip()
+
+
+class KeywordAutomaton:
+    """Aho-Corasick：一次掃描找出文字裡出現的所有關鍵字，回傳關鍵字對應的 payload。"""
+
+    def __init__(self):
+        self._goto = [{}]
+        self._fail = [0]
+        self._out = [set()]
+
+    def add(self, keyword, payload):
+        node = 0
+        for ch in keyword:
+            nxt = self._goto[node].get(ch)
+            if nxt is None:
+                nxt = len(self._goto)
+                self._goto[node][ch] = nxt
+                self._goto.append({})
+                self._fail.append(0)
+                self._out.append(set())
+            node = nxt
+        self._out[node].add(payload)
+
+    def build(self):
+        queue = deque(self._goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for ch, nxt in self._goto[node].items():
+                queue.append(nxt)
+                fail = self._fail[node]
+                while fail and ch not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[nxt] = self._goto[fail].get(ch, 0)
+                self._out[nxt] |= self._out[self._fail[nxt]]
+        return self
+
+    def find(self, text):
+        found = set()
+        node = 0
+        for ch in text:
+            while node and ch not in self._goto[node]:
+                node = self._fail[node]
+            node = self._goto[node].get(ch, 0)
+            if self._out[node]:
+                found |= self._out[node]
+        return found
+
+
+def generic_key(drug):
+    # 沒填學名的藥就用品名當成分
+    return normalize(drug.generic_name) or normalize(drug.name)
+
+
+def compile_matcher():
+    """藥典 + 同義詞 → 自動機；payload 是成分（正規化過的學名）。"""
+    automaton = KeywordAutomaton()
+    for name, generic in Drug.objects.filter(is_active=True).values_list("name", "generic_name"):
+        ingredient = normalize(generic) or normalize(name)
+        for keyword in {normalize(name), normalize(generic)}:
+            if len(keyword) >= MIN_KEYWORD_LENGTH:
+                automaton.add(keyword, ingredient)
+    for term, generic in AllergenSynonym.objects.values_list("term", "generic_name"):
+        term, generic = normalize(term), normalize(generic)
+        if len(term) >= MIN_KEYWORD_LENGTH and generic:
+            automaton.add(term, generic)
+    return automaton.build()
+
+
+_compiled = {"version": None, "matcher": None}
+
+
+def get_matcher():
+    version = fragments.get_version(fragments.FORMULARY)
+    if _compiled["version"] != version:
+        _compiled["matcher"] = compile_matcher()
+        _compiled["version"] = version
+    return _compiled["matcher"]
+
+
+@dataclass
+class ScreeningAlert:
+    kind: str
+    message: str
+    drugs: list
+
+    @property
+    def is_allergy(self):
+        return self.kind == KIND_ALLERGY
+
+
+def screen(patient, drugs):
+    """
+    drugs：這張處方要開的藥（Drug，可重複）。回傳 ScreeningAlert 清單，沒問題就是空的。
+    """
+    alerts = []
+    drugs = [d for d in drugs if d is not None]
+
+    allergy_text = normalize(patient.allergies)
+    if allergy_text and drugs:
+        ingredients = get_matcher().find(allergy_text)
+        seen = set()
+        for drug in drugs:
+            if drug.pk in seen:
+                continue
+            haystacks = (generic_key(drug), normalize(drug.name))
+            # 成分也用「包含」比對：過敏 Amoxicillin 要抓到 Amoxicillin / Clavulanate 複方
+            hits = sorted(i for i in ingredients if any(i in h for h in haystacks))
+            if hits:
+                seen.add(drug.pk)
+                alerts.append(ScreeningAlert(
+                    KIND_ALLERGY,
+                    f"{drug.name}：病人過敏史有記載（{', '.join(hits)}）",
+                    [drug],
+                ))
+
+    by_generic = defaultdict(list)
+    for drug in drugs:
+        by_generic[generic_key(drug)].append(drug)
+    for key, group in by_generic.items():
+        if len(group) > 1:
+            names = "、".join(d.name for d in group)
+            alerts.append(ScreeningAlert(KIND_DUPLICATE, f"同成分重複開立（{key}）：{names}", group))
+
+    return alerts
+
+
+def alerts_digest(alerts):
+    """
+    醫師看到的那組警示的指紋：確認勾選要連同這個值一起送回來，
+    存檔時重算一次對得上才算數，同一個 POST 裡改了藥、冒出新警示就要重新確認。
+    """
+    if not alerts:
+        return ""
+    lines = sorted(f"{a.kind}:{a.message}" for a in alerts)
+    return hashlib.sha1("\n".join(lines).encode("utf-8")).hexdigest()
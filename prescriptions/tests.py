@@ -1,3 +1,549 @@
-from django.test import TestCase
+import time
+from datetime import date, timedelta
+from unittest.mock import patch
 
-# Create your tests here.
+from django.contrib.auth.models import Group, User
+from django.core.cache import caches
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from doctors.models import Doctor
+from inventory import reservations
+from inventory.models import AllergenSynonym, Drug, StockBatch, StockReservation, StockTransaction
+from inventory.search import available_stock
+from inventory.utils import (
+    adjust_stock, quarantine_batch, refresh_stock_quantity, return_prescription_stock, stock_in,
+)
+from patients.models import Patient
+from queues.models import VisitTicket
+
+from . import dispensing, review, screening
+from .models import Prescription, PrescriptionAuditLog, PrescriptionItem, PrescriptionLog
+
+TEST_STORAGES = {
+    "default": {"BACKEND": "django.core.files.storage.FileSystemStorage"},
+    "staticfiles": {"BACKEND": "django.contrib.staticfiles.storage.StaticFilesStorage"},
+}
+
+
+class KeywordAutomatonTests(TestCase):
+    def test_overlapping_keywords(self):
+        automaton = screening.KeywordAutomaton()
+        for word in ["he", "she", "his", "hers", "西林", "盤尼西林"]:
+            automaton.add(word, word)
+        automaton.build()
+        self.assertEqual(automaton.find("ushers"), {"he", "she", "hers"})
+        self.assertEqual(automaton.find("對盤尼西林過敏"), {"西林", "盤尼西林"})
+        self.assertEqual(automaton.find("無"), set())
+
+
+class ScreeningTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.amoxicillin = Drug.objects.create(code="AMX", name="安莫西林", generic_name="Amoxicillin")
+        cls.augmentin = Drug.objects.create(code="AUG", name="Augmentin", generic_name="Amoxicillin/Clavulanate")
+        cls.aspirin = Drug.objects.create(code="ASP", name="Aspirin", generic_name="Acetylsalicylic acid")
+        cls.panadol = Drug.objects.create(code="PAN", name="普拿疼", generic_name="Acetaminophen")
+        cls.scanol = Drug.objects.create(code="SCA", name="斯斯解熱", generic_name="ACETAMINOPHEN")
+        cls.patient = Patient.objects.create(
+            full_name="王小明", national_id="A123456789", birth_date=date(1980, 1, 1),
+            allergies="對盤尼西林過敏；吃阿斯匹靈會起疹子",
+        )
+
+    def setUp(self):
+        caches["fragments"].clear()
+
+    def test_allergies_via_synonyms_and_combinations(self):
+        alerts = screening.screen(self.patient, [self.amoxicillin, self.augmentin, self.aspirin, self.panadol])
+        flagged = {d.code for a in alerts if a.is_allergy for d in a.drugs}
+        self.assertEqual(flagged, {"AMX", "AUG", "ASP"})
+        self.assertFalse([a for a in alerts if not a.is_allergy])
+
+    def test_duplicate_generics(self):
+        alerts = screening.screen(self.patient, [self.panadol, self.scanol])
+        self.assertEqual([a.kind for a in alerts], [screening.KIND_DUPLICATE])
+        self.assertEqual({d.code for d in alerts[0].drugs}, {"PAN", "SCA"})
+
+    def test_matcher_rebuilt_only_when_formulary_changes(self):
+        screening.get_matcher()
+        with CaptureQueriesContext(connection) as ctx:
+            screening.screen(self.patient, [self.panadol])
+        self.assertEqual(len(ctx.captured_queries), 0)
+
+        AllergenSynonym.objects.create(term="解熱鎮痛", generic_name="Acetaminophen")
+        self.patient.allergies = "解熱鎮痛藥過敏"
+        alerts = screening.screen(self.patient, [self.panadol])
+        self.assertEqual([d.code for a in alerts for d in a.drugs], ["PAN"])
+
+    def test_stock_movements_do_not_recompile(self):
+        screening.get_matcher()
+        with patch.object(screening, "compile_matcher", wraps=screening.compile_matcher) as compile_matcher:
+            batch = stock_in(self.panadol, 10, timezone.localdate() + timedelta(days=90))
+            adjust_stock(self.panadol, -2, "adjust")
+            refresh_stock_quantity(self.panadol)
+            quarantine_batch(batch)
+            screening.get_matcher()
+            self.assertEqual(compile_matcher.call_count, 0)
+
+            self.panadol.generic_name = "Paracetamol"
+            self.panadol.save(update_fields=["generic_name"])
+            screening.get_matcher()
+            self.assertEqual(compile_matcher.call_count, 1)
+
+    def test_screening_is_fast_on_a_large_formulary(self):
+        Drug.objects.bulk_create(
+            Drug(code=f"X{i:05d}", name=f"藥品{i}號", generic_name=f"Generic{i}") for i in range(5000)
+        )
+        caches["fragments"].clear()
+        screening.get_matcher()
+
+        drugs = [self.amoxicillin, self.panadol, self.aspirin] * 3
+        start = time.perf_counter()
+        for _ in range(50):
+            screening.screen(self.patient, drugs)
+        self.assertLess((time.perf_counter() - start) / 50, 0.005)
+
+
+@override_settings(PROFILING_SLOW_LOG=None, METRICS_DIR="", STORAGES=TEST_STORAGES)
+class PrescribingScreeningViewTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user("doc")
+        cls.user.groups.add(Group.objects.create(name="DOCTOR"))
+        doctor = Doctor.objects.create(name="林醫師", department="內科", user=cls.user)
+        patient = Patient.objects.create(
+            full_name="王小明", national_id="A123456789", birth_date=date(1980, 1, 1), allergies="aspirin",
+        )
+        cls.ticket = VisitTicket.objects.create(patient=patient, doctor=doctor, date=date.today(), number=1)
+        cls.aspirin = Drug.objects.create(code="ASP", name="Aspirin", generic_name="Acetylsalicylic acid")
+
+    def _post(self, **extra):
+        data = {
+            "notes": "",
+            "items-TOTAL_FORMS": "1",
+            "items-INITIAL_FORMS": "0",
+            "items-MIN_NUM_FORMS": "0",
+            "items-MAX_NUM_FORMS": "1000",
+            "items-0-drug": str(self.aspirin.pk),
+            "items-0-quantity": "3",
+            "items-0-treatment_days": "3",
+            "items-0-usage": "",
+            **extra,
+        }
+        return self.client.post(reverse("prescriptions:edit_for_ticket", args=[self.ticket.pk]), data)
+
+    def test_alert_must_be_acknowledged(self):
+        self.client.force_login(self.user)
+
+        response = self._post()
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, "用藥篩檢警示")
+        prescription = Prescription.objects.get(visit_ticket=self.ticket)
+        self.assertFalse(prescription.items.exists())
+
+        # 只勾選、沒帶畫面上那組警示的指紋，不算確認
+        response = self._post(screening_ack="1")
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(prescription.items.exists())
+
+        digest = response.context["screening_digest"]
+        response = self._post(screening_ack="1", screening_digest=digest)
+        self.assertRedirects(response, reverse("queues:doctor_panel"), fetch_redirect_response=False)
+        self.assertEqual(prescription.items.count(), 1)
+        log = PrescriptionLog.objects.filter(prescription=prescription).latest("id")
+        self.assertIn("已確認 1 項用藥警示", log.message)
+        audit = PrescriptionAuditLog.objects.get(prescription=prescription)
+        self.assertIn("Aspirin：病人過敏史有記載", audit.detail)
+
+    def test_ack_does_not_cover_new_alerts(self):
+        self.client.force_login(self.user)
+        digest = self._post().context["screening_digest"]
+
+        # 同一個 POST 換了處方內容：多開一支同成分的藥，冒出新的重複警示
+        aspirin2 = Drug.objects.create(code="ASP2", name="Bokey", generic_name="Acetylsalicylic acid")
+        response = self._post(
+            screening_ack="1", screening_digest=digest,
+            **{
+                "items-TOTAL_FORMS": "2",
+                "items-1-drug": str(aspirin2.pk),
+                "items-1-quantity": "3",
+                "items-1-treatment_days": "3",
+                "items-1-usage": "",
+            },
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, "同成分重複開立")
+        self.assertNotEqual(response.context["screening_digest"], digest)
+        self.assertFalse(Prescription.objects.get(visit_ticket=self.ticket).items.exists())
+
+
+@override_settings(PROFILING_SLOW_LOG=None, METRICS_DIR="", STORAGES=TEST_STORAGES)
+class BulkReviewTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.pharmacist = User.objects.create_user("pharm")
+        cls.pharmacist.groups.add(Group.objects.create(name="PHARMACY"))
+        doctor = Doctor.objects.create(name="林醫師", department="內科")
+        patient = Patient.objects.create(full_name="王小明", national_id="A123456789", birth_date=date(1980, 1, 1))
+
+        def rx(**kwargs):
+            return Prescription.objects.create(
+                patient=patient, doctor=doctor, status=Prescription.STATUS_FINAL, **kwargs,
+            )
+
+        cls.pending = [rx() for _ in range(6)]
+        cls.draft = Prescription.objects.create(patient=patient, doctor=doctor, status=Prescription.STATUS_DRAFT)
+        cls.approved = rx(verify_status=Prescription.VERIFY_APPROVED)
+
+    def _count_queries(self, ids, action):
+        with CaptureQueriesContext(connection) as ctx:
+            results = review.review_prescriptions(ids, action, self.pharmacist)
+        return len(ctx.captured_queries), results
+
+    def test_query_count_does_not_grow_with_selection(self):
+        few, _ = self._count_queries([self.pending[0].pk], review.ACTION_APPROVE)
+        many, results = self._count_queries([p.pk for p in self.pending[1:]], review.ACTION_APPROVE)
+        self.assertEqual(few, many)
+        self.assertTrue(all(r.ok for r in results))
+        self.assertEqual(
+            Prescription.objects.filter(verify_status=Prescription.VERIFY_APPROVED, verified_by=self.pharmacist).count(),
+            6,
+        )
+        self.assertEqual(PrescriptionLog.objects.filter(message="藥師審核通過").count(), 6)
+        self.assertEqual(PrescriptionAuditLog.objects.count(), 6)
+
+    def test_result_summary_reports_skipped(self):
+        ids = [self.pending[0].pk, self.draft.pk, self.approved.pk, 999999, self.pending[0].pk]
+        results = review.review_prescriptions(ids, review.ACTION_REJECT, self.pharmacist)
+
+        self.assertEqual([r.prescription_id for r in results], ids[:4])
+        self.assertEqual([r.ok for r in results], [True, False, False, False])
+        self.pending[0].refresh_from_db()
+        self.assertEqual(self.pending[0].verify_status, Prescription.VERIFY_REJECTED)
+        self.assertEqual(self.pending[0].verify_note, review.DEFAULT_REJECT_NOTE)
+
+    def test_view(self):
+        url = reverse("prescriptions:pharmacy_review_bulk")
+        data = {"action": "approve", "prescription_ids": [self.pending[0].pk, self.approved.pk], "verify_note": "OK"}
+
+        self.client.force_login(User.objects.create_user("nobody"))
+        self.assertEqual(self.client.post(url, data).status_code, 302)
+        self.assertEqual(PrescriptionLog.objects.count(), 0)
+
+        self.client.force_login(self.pharmacist)
+        response = self.client.post(url, data)
+        self.assertContains(response, "通過 1 / 2 張")
+        self.assertContains(response, "已經審核過")
+        self.assertEqual(PrescriptionLog.objects.get().message, "藥師審核通過（備註：OK）")
+
+
+@override_settings(PROFILING_SLOW_LOG=None, METRICS_DIR="", STORAGES=TEST_STORAGES)
+class BatchDispenseTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.pharmacist = User.objects.create_user("pharm")
+        cls.pharmacist.groups.add(Group.objects.create(name="PHARMACY"))
+        cls.doctor = Doctor.objects.create(name="林醫師", department="內科")
+        cls.patient = Patient.objects.create(full_name="王小明", national_id="A123456789", birth_date=date(1980, 1, 1))
+
+        today = date.today()
+        cls.drug_a = Drug.objects.create(code="A", name="安莫西林", stock_quantity=155)
+        cls.drug_b = Drug.objects.create(code="B", name="普拿疼", stock_quantity=6)
+        # 3 天後到期的批次不夠 7 天，不能發
+        cls.near = StockBatch.objects.create(drug=cls.drug_a, batch_no="A-NEAR", quantity=50, expiry_date=today + timedelta(days=3))
+        cls.early = StockBatch.objects.create(drug=cls.drug_a, batch_no="A-EARLY", quantity=5, expiry_date=today + timedelta(days=10))
+        cls.late = StockBatch.objects.create(drug=cls.drug_a, batch_no="A-LATE", quantity=100, expiry_date=today + timedelta(days=365))
+        cls.b1 = StockBatch.objects.create(drug=cls.drug_b, batch_no="B-1", quantity=6, expiry_date=today + timedelta(days=200))
+
+        cls.rx1 = cls.make_rx((cls.drug_a, 4), (cls.drug_b, 2))
+        cls.rx2 = cls.make_rx((cls.drug_a, 4), (cls.drug_b, 2))
+        cls.rx3 = cls.make_rx((cls.drug_b, 5))
+        cls.unverified = cls.make_rx((cls.drug_a, 1), verify=Prescription.VERIFY_PENDING)
+
+    @classmethod
+    def make_rx(cls, *items, verify=Prescription.VERIFY_APPROVED):
+        rx = Prescription.objects.create(
+            patient=cls.patient, doctor=cls.doctor, status=Prescription.STATUS_FINAL, verify_status=verify,
+        )
+        for drug, qty in items:
+            PrescriptionItem.objects.create(prescription=rx, drug=drug, quantity=qty, treatment_days=3)
+        return rx
+
+    def test_pick_list_is_consolidated_fefo(self):
+        plan = dispensing.plan_dispense([self.rx1.pk, self.rx2.pk, self.rx3.pk, self.unverified.pk])
+
+        self.assertEqual([rx.pk for rx in plan.prescriptions], [self.rx1.pk, self.rx2.pk])
+        self.assertEqual({s.prescription_id for s in plan.skipped}, {self.rx3.pk, self.unverified.pk})
+        self.assertEqual(
+            [(line.batch.batch_no, line.quantity, line.prescription_ids) for line in plan.pick_list],
+            [
+                ("A-EARLY", 5, [self.rx1.pk, self.rx2.pk]),
+                ("A-LATE", 3, [self.rx2.pk]),
+                ("B-1", 4, [self.rx1.pk, self.rx2.pk]),
+            ],
+        )
+
+    def test_dispense_writes_everything_in_bulk(self):
+        first = self.make_rx((self.drug_a, 1))
+        with CaptureQueriesContext(connection) as ctx:
+            dispensing.dispense_prescriptions([first.pk], self.pharmacist)
+        few = len(ctx.captured_queries)
+
+        with CaptureQueriesContext(connection) as ctx:
+            plan = dispensing.dispense_prescriptions([self.rx1.pk, self.rx2.pk, self.rx3.pk], self.pharmacist)
+        self.assertEqual(len(ctx.captured_queries), few)
+
+        self.assertEqual(len(plan.prescriptions), 2)
+        for batch, qty in [(self.near, 50), (self.early, 0), (self.late, 96), (self.b1, 2)]:
+            batch.refresh_from_db()
+            self.assertEqual(batch.quantity, qty, batch.batch_no)
+        self.drug_a.refresh_from_db()
+        self.drug_b.refresh_from_db()
+        self.assertEqual((self.drug_a.stock_quantity, self.drug_b.stock_quantity), (146, 2))
+
+        done = Prescription.objects.filter(pharmacy_status=Prescription.PHARMACY_DONE, dispensed_by=self.pharmacist)
+        self.assertEqual(set(done.values_list("pk", flat=True)), {first.pk, self.rx1.pk, self.rx2.pk})
+        # first 先用掉 A-EARLY 一顆，rx1 拿完剩下的 4 顆，rx2 的 A 全部從 A-LATE 出
+        self.assertEqual(StockTransaction.objects.filter(prescription__in=[self.rx1, self.rx2]).count(), 4)
+        self.assertEqual(PrescriptionLog.objects.filter(action=PrescriptionLog.ACTION_DISPENSE).count(), 3)
+        self.assertEqual(PrescriptionAuditLog.objects.filter(action="DISPENSE").count(), 3)
+
+    def test_stale_pick_list_is_refused(self):
+        plan = dispensing.plan_dispense([self.rx1.pk])
+        self.early.quantity = 1
+        self.early.save(update_fields=["quantity"])
+
+        with self.assertRaises(ValueError):
+            dispensing.dispense_prescriptions([self.rx1.pk], self.pharmacist, expected_signature=plan.signature)
+        self.assertFalse(StockTransaction.objects.exists())
+        self.rx1.refresh_from_db()
+        self.assertEqual(self.rx1.pharmacy_status, Prescription.PHARMACY_PENDING)
+
+    def test_views(self):
+        url = reverse("prescriptions:pharmacy_batch_dispense")
+        self.client.force_login(self.pharmacist)
+
+        response = self.client.get(url, {"prescription_ids": [self.rx1.pk, self.rx3.pk]})
+        self.assertContains(response, "A-EARLY")
+        self.assertContains(response, "仍缺")
+        signature = response.context["plan"].signature
+
+        response = self.client.post(url, {"prescription_ids": [self.rx1.pk], "signature": signature})
+        self.assertRedirects(response, reverse("prescriptions:pharmacy_panel"), fetch_redirect_response=False)
+        self.rx1.refresh_from_db()
+        self.assertEqual(self.rx1.pharmacy_status, Prescription.PHARMACY_DONE)
+
+
+@override_settings(PROFILING_SLOW_LOG=None, METRICS_DIR="", STORAGES=TEST_STORAGES)
+class StockReservationTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.pharmacist = User.objects.create_user("pharm")
+        cls.pharmacist.groups.add(Group.objects.create(name="PHARMACY"))
+        cls.doctor = Doctor.objects.create(name="林醫師", department="內科")
+        cls.patient = Patient.objects.create(full_name="王小明", national_id="A123456789", birth_date=date(1980, 1, 1))
+
+        cls.today = date.today()
+        cls.drug = Drug.objects.create(code="A", name="安莫西林", stock_quantity=10)
+        cls.early = StockBatch.objects.create(drug=cls.drug, batch_no="A-EARLY", quantity=6, expiry_date=cls.today + timedelta(days=30))
+        cls.late = StockBatch.objects.create(drug=cls.drug, batch_no="A-LATE", quantity=4, expiry_date=cls.today + timedelta(days=300))
+
+    def make_rx(self, qty):
+        rx = Prescription.objects.create(patient=self.patient, doctor=self.doctor, status=Prescription.STATUS_FINAL)
+        PrescriptionItem.objects.create(prescription=rx, drug=self.drug, quantity=qty, treatment_days=3)
+        return rx
+
+    def approve(self, *rxs):
+        return review.review_prescriptions([rx.pk for rx in rxs], review.ACTION_APPROVE, self.pharmacist)
+
+    def holds(self, rx):
+        return sorted(
+            StockReservation.objects
+            .filter(prescription=rx, status=StockReservation.STATUS_ACTIVE)
+            .values_list("batch__batch_no", "quantity")
+        )
+
+    def test_approval_holds_fefo_and_reduces_available_to_promise(self):
+        rx1, rx2 = self.make_rx(8), self.make_rx(5)
+        results = self.approve(rx1, rx2)
+
+        self.assertEqual(self.holds(rx1), [("A-EARLY", 6), ("A-LATE", 2)])
+        self.assertEqual(self.holds(rx2), [])
+        self.assertIn("庫存未保留", results[1].message)
+        self.assertEqual(available_stock([self.drug.pk]), {self.drug.pk: 2})
+
+        # 沒保留到的處方現場配也不能動到別人保留的量
+        rx2.refresh_from_db()
+        with self.assertRaises(ValueError):
+            dispensing.deduct_prescription_stock(rx2, list(rx2.items.all()), self.pharmacist)
+
+    def test_dispense_consumes_holds_without_replanning(self):
+        rx = self.make_rx(5)
+        self.approve(rx)
+        # 審核後才進了一批更早到期的藥：領藥照保留出，不會改拿新批次
+        StockBatch.objects.create(drug=self.drug, batch_no="A-NEW", quantity=50, expiry_date=self.today + timedelta(days=20))
+
+        self.client.force_login(self.pharmacist)
+        self.client.post(reverse("prescriptions:dispense_confirm", args=[rx.pk]))
+
+        rx.refresh_from_db()
+        self.assertEqual(rx.pharmacy_status, Prescription.PHARMACY_DONE)
+        self.assertEqual(
+            sorted(StockTransaction.objects.filter(prescription=rx).values_list("batch__batch_no", "change")),
+            [("A-EARLY", -5)],
+        )
+        self.assertEqual(StockReservation.objects.get(prescription=rx).status, StockReservation.STATUS_CONSUMED)
+        self.drug.refresh_from_db()
+        self.assertEqual(self.drug.stock_quantity, 55)
+
+    def test_stale_hold_is_rechecked_at_dispense(self):
+        # 審核後批次效期被更正到只剩 5 天：保留不能照用，改現場配到 A-LATE
+        rx = self.make_rx(3)
+        self.approve(rx)
+        self.assertEqual(self.holds(rx), [("A-EARLY", 3)])
+        StockBatch.objects.filter(pk=self.early.pk).update(expiry_date=self.today + timedelta(days=5))
+
+        dispensing.deduct_prescription_stock(
+            rx, list(rx.items.select_related("drug")), self.pharmacist, min_valid_days=dispensing.MIN_VALID_DAYS,
+        )
+        self.assertEqual(
+            list(StockTransaction.objects.filter(prescription=rx).values_list("batch__batch_no", "change")),
+            [("A-LATE", -3)],
+        )
+        self.assertEqual(StockReservation.objects.get(prescription=rx).status, StockReservation.STATUS_RELEASED)
+
+    def test_hold_checked_against_all_holds_on_the_batch(self):
+        rx, other = self.make_rx(4), self.make_rx(2)
+        self.approve(rx, other)
+        self.assertEqual(self.holds(rx), [("A-EARLY", 4)])
+        self.assertEqual(self.holds(other), [("A-EARLY", 2)])
+        # 批次盤虧剩 5：兩張保留加起來 6，照保留扣會把另一張的量也吃掉
+        StockBatch.objects.filter(pk=self.early.pk).update(quantity=5)
+
+        # 改現場配：A-EARLY 只剩扣掉另一張保留後的 3
+        plan = dispensing.plan_dispense([rx.pk])
+        self.assertFalse([a for a in plan.allocations if a.reservation])
+        self.assertEqual([(a.batch.batch_no, a.quantity) for a in plan.allocations], [("A-EARLY", 3), ("A-LATE", 1)])
+
+    def test_cancel_and_timeout_release(self):
+        cancelled, stale = self.make_rx(3), self.make_rx(3)
+        self.approve(cancelled, stale)
+        self.assertEqual(available_stock([self.drug.pk]), {self.drug.pk: 4})
+
+        self.client.force_login(self.pharmacist)
+        self.client.post(reverse("prescriptions:cancel_or_return", args=[cancelled.pk]))
+        self.assertEqual(self.holds(cancelled), [])
+
+        StockReservation.objects.filter(prescription=stale).update(expires_at=timezone.now() - timedelta(minutes=1))
+        # 逾時的保留不用等清理就不算數
+        self.assertEqual(available_stock([self.drug.pk]), {self.drug.pk: 10})
+        self.assertEqual(reservations.release_expired(), 1)
+        self.assertFalse(StockReservation.objects.filter(status=StockReservation.STATUS_ACTIVE).exists())
+
+    def test_batch_dispense_uses_holds(self):
+        held, walk_in = self.make_rx(5), self.make_rx(4)
+        self.approve(held)
+        Prescription.objects.filter(pk=walk_in.pk).update(verify_status=Prescription.VERIFY_APPROVED)
+
+        plan = dispensing.dispense_prescriptions([held.pk, walk_in.pk], self.pharmacist)
+
+        self.assertEqual(len(plan.prescriptions), 2)
+        self.assertTrue(all(a.reservation for a in plan.allocations if a.prescription.pk == held.pk))
+        # 沒保留的那張只能用剩下的：A-EARLY 剩 1、A-LATE 4
+        self.assertEqual(
+            sorted(StockTransaction.objects.filter(prescription=walk_in).values_list("batch__batch_no", "change")),
+            [("A-EARLY", -1), ("A-LATE", -3)],
+        )
+        self.assertEqual(StockReservation.objects.get(prescription=held).status, StockReservation.STATUS_CONSUMED)
+
+
+@override_settings(PROFILING_SLOW_LOG=None, METRICS_DIR="", STORAGES=TEST_STORAGES)
+class ReturnStockTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.pharmacist = User.objects.create_user("pharm")
+        cls.pharmacist.groups.add(Group.objects.create(name="PHARMACY"))
+        doctor = Doctor.objects.create(name="林醫師", department="內科")
+        patient = Patient.objects.create(full_name="王小明", national_id="A123456789", birth_date=date(1980, 1, 1))
+
+        today = date.today()
+        cls.drug = Drug.objects.create(code="A", name="安莫西林", stock_quantity=7)
+        cls.other = Drug.objects.create(code="B", name="普拿疼", stock_quantity=5)
+        cls.early = StockBatch.objects.create(drug=cls.drug, batch_no="A-EARLY", quantity=3, expiry_date=today + timedelta(days=30))
+        cls.late = StockBatch.objects.create(drug=cls.drug, batch_no="A-LATE", quantity=4, expiry_date=today + timedelta(days=300))
+        cls.b1 = StockBatch.objects.create(drug=cls.other, batch_no="B-1", quantity=5, expiry_date=today + timedelta(days=300))
+
+        cls.rx = Prescription.objects.create(
+            patient=patient, doctor=doctor, status=Prescription.STATUS_FINAL,
+            verify_status=Prescription.VERIFY_APPROVED,
+        )
+        PrescriptionItem.objects.create(prescription=cls.rx, drug=cls.drug, quantity=5, treatment_days=3)
+        PrescriptionItem.objects.create(prescription=cls.rx, drug=cls.other, quantity=2, treatment_days=3)
+
+    def setUp(self):
+        dispensing.deduct_prescription_stock(self.rx, list(self.rx.items.select_related("drug")), self.pharmacist)
+        Prescription.objects.filter(pk=self.rx.pk).update(pharmacy_status=Prescription.PHARMACY_DONE)
+
+    def batch_quantities(self):
+        return {b.batch_no: (b.quantity, b.status) for b in StockBatch.objects.all()}
+
+    def test_return_restores_exact_batches(self):
+        # 發藥後 A-LATE 被隔離、A-EARLY 過期、B-1 銷毀：退回的量都回到原批次，狀態照規則處理
+        StockBatch.objects.filter(pk=self.late.pk).update(status=StockBatch.STATUS_QUARANTINE)
+        StockBatch.objects.filter(pk=self.early.pk).update(expiry_date=date.today() - timedelta(days=1))
+        StockBatch.objects.filter(pk=self.b1.pk).update(status=StockBatch.STATUS_DESTROYED)
+
+        self.client.force_login(self.pharmacist)
+        response = self.client.post(reverse("prescriptions:cancel_or_return", args=[self.rx.pk]))
+        self.assertRedirects(response, reverse("prescriptions:pharmacy_panel"), fetch_redirect_response=False)
+
+        self.assertEqual(self.batch_quantities(), {
+            "A-EARLY": (3, StockBatch.STATUS_NORMAL),
+            "A-LATE": (4, StockBatch.STATUS_QUARANTINE),
+            "B-1": (5, StockBatch.STATUS_QUARANTINE),
+        })
+        returns = StockTransaction.objects.filter(prescription=self.rx, reason="return")
+        self.assertEqual(
+            sorted(returns.values_list("batch__batch_no", "change")),
+            [("A-EARLY", 3), ("A-LATE", 2), ("B-1", 2)],
+        )
+        self.assertIn("已過期", returns.get(batch=self.early).note)
+
+        # 藥品總量跟批次帳一致，之後再 refresh 也不會把退藥吃掉
+        for drug, total in [(self.drug, 7), (self.other, 5)]:
+            drug.refresh_from_db()
+            self.assertEqual(drug.stock_quantity, total)
+            self.assertEqual(refresh_stock_quantity(drug), total)
+
+        self.rx.refresh_from_db()
+        self.assertEqual(self.rx.pharmacy_status, Prescription.PHARMACY_CANCELLED)
+
+    def test_return_is_set_based_and_idempotent(self):
+        with CaptureQueriesContext(connection) as ctx:
+            restored, unbatched = return_prescription_stock(self.rx, operator=self.pharmacist)
+        self.assertEqual(len(restored), 3)
+        self.assertEqual(unbatched, {})
+        # 鎖處方，聚合發藥紀錄、藥品、批次各一個 query，寫入各一個 bulk，加上 savepoint
+        self.assertLessEqual(len(ctx.captured_queries), 10)
+
+        self.assertEqual(return_prescription_stock(self.rx), ([], {}))
+        self.assertEqual(self.batch_quantities()["A-LATE"], (4, StockBatch.STATUS_NORMAL))
+
+    def test_second_return_post_does_nothing(self):
+        self.client.force_login(self.pharmacist)
+        url = reverse("prescriptions:cancel_or_return", args=[self.rx.pk])
+        self.client.post(url)
+        response = self.client.post(url, follow=True)
+
+        self.assertContains(response, "這張處方已經作廢過")
+        self.assertEqual(StockTransaction.objects.filter(prescription=self.rx, reason="return").count(), 3)
+        self.assertEqual(self.batch_quantities()["A-LATE"], (4, StockBatch.STATUS_NORMAL))
+
+    def test_missing_batch_is_reported(self):
+        self.b1.delete()
+        restored, unbatched = return_prescription_stock(self.rx)
+        self.assertEqual(len(restored), 2)
+        self.assertEqual(unbatched, {self.other: 2})
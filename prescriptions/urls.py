@@ -6,6 +6,7 @@ app_name = "prescriptions"
 urlpatterns = [
     path("pharmacy/", views.pharmacy_panel, name="pharmacy_panel"),
     path("pharmacy/<int:pk>/", views.dispense, name="dispense"),
+    path("pharmacy/batch/", views.pharmacy_batch_dispense, name="pharmacy_batch_dispense"),
     path("pharmacy/<int:pk>/cancel_or_return/", views.cancel_or_return_prescription, name="cancel_or_return"),
 
     path("ticket/<int:ticket_id>/", views.edit_for_ticket, name="edit_for_ticket"),
@@ -17,6 +18,7 @@ urlpatterns = [
     path("patient/<int:pk>/", views.patient_prescription_detail, name="patient_detail"),
 
     path("pharmacy/review/", views.pharmacy_review_list, name="pharmacy_review_list"),
+    path("pharmacy/review/bulk/", views.pharmacy_review_bulk, name="pharmacy_review_bulk"),
     path("pharmacy/review/<int:pk>/", views.pharmacy_review_detail, name="pharmacy_review_detail"),
 
     path("detail/<int:pk>/", views.prescription_detail, name="prescription_detail"),
@@ -1,16 +1,24 @@
+from urllib.parse import urlencode
+
 from django.shortcuts import render, redirect, get_object_or_404
+from django.urls import reverse
 from django.views.decorators.http import require_POST
 
 from django.utils import timezone
+from django.utils.functional import SimpleLazyObject
 from django.contrib import messages
 from django.contrib.auth.decorators import login_required
 from django.http import HttpResponseForbidden
 
 from appointments.models import Appointment
+from common import metrics
 from common.utils import group_required
+from common.routers import use_replica
 from public.models import PublicRegistrationRequest
 
-from django.db.models import Max
+from collections import defaultdict
+
+from django.db.models import Max, Prefetch
 
 from .models import (
     Prescription,
@@ -19,9 +27,14 @@ from .models import (
     PrescriptionAuditLog,
 )
 from .forms import PrescriptionForm, PrescriptionItemFormSet
+from . import dispensing
+from .review import ACTION_APPROVE, ACTION_REJECT, review_prescriptions
+from .screening import alerts_digest, screen
 
 
-from inventory.utils import adjust_stock, can_dispense_item, preview_use_drug_from_prescription_item, use_drug_from_prescription_item
+from inventory.models import StockBatch
+from inventory import reservations
+from inventory.utils import can_dispense_item, preview_use_drug_from_prescription_item, return_prescription_stock
 from queues.models import VisitTicket
 from doctors.models import Doctor
 from patients.models import Patient
@@ -34,44 +47,76 @@ from django.db import transaction
 def pharmacy_panel(request):
     today = timezone.localdate()
 
-    prescriptions = (
-        Prescription.objects
-        .filter(
-            date=today,
-            status=Prescription.STATUS_FINAL,
-            pharmacy_status=Prescription.PHARMACY_PENDING,
-            verify_status=Prescription.VERIFY_APPROVED,
-        )
-        .select_related("patient", "doctor__user")
-        .prefetch_related("items__drug")
-        .order_by("date", "id")
-    )
-
     MIN_VALID_DAYS = 7
 
-    rx_rows = []
-    for rx in prescriptions:
-        items = list(rx.items.all())
-        problems = []
+    def build_rows():
+        prescriptions = (
+            Prescription.objects
+            .filter(
+                date=today,
+                status=Prescription.STATUS_FINAL,
+                pharmacy_status=Prescription.PHARMACY_PENDING,
+                verify_status=Prescription.VERIFY_APPROVED,
+            )
+            .select_related("patient", "doctor__user")
+            .prefetch_related(
+                "items__drug",
+                Prefetch(
+                    "items__drug__batches",
+                    queryset=StockBatch.objects
+                    .filter(status=StockBatch.STATUS_NORMAL, quantity__gt=0)
+                    .order_by("expiry_date", "id"),
+                    to_attr="usable_batches",
+                ),
+            )
+            .order_by("date", "id")
+        )
+
+        prescriptions = list(prescriptions)
+
+        # 別張處方審核時保留的量不能算進可領：一個 query 取回每個批次、每張處方的保留量
+        holds = reservations.held_by_prescription(list({
+            b.pk for rx in prescriptions for it in rx.items.all() for b in it.drug.usable_batches
+        }))
+        held_total = defaultdict(int)
+        for (batch_id, _), qty in holds.items():
+            held_total[batch_id] += qty
+
+        rx_rows = []
+        for rx in prescriptions:
+            items = list(rx.items.all())
+            problems = []
+
+            for it in items:
+                res = can_dispense_item(
+                    it,
+                    min_valid_days=MIN_VALID_DAYS,
+                    batches=it.drug.usable_batches,
+                    held={
+                        b.pk: held_total[b.pk] - holds.get((b.pk, rx.pk), 0)
+                        for b in it.drug.usable_batches
+                    },
+                )
 
-        for it in items:
-            res = can_dispense_item(it, min_valid_days=MIN_VALID_DAYS)
+                if isinstance(res, (tuple, list)):
+                    ok = bool(res[0]) if len(res) >= 1 else False
+                    reason = str(res[1]) if len(res) >= 2 else ""
+                else:
+                    ok = bool(res)
+                    reason = ""
 
-            if isinstance(res, (tuple, list)):
-                ok = bool(res[0]) if len(res) >= 1 else False
-                reason = str(res[1]) if len(res) >= 2 else ""
-            else:
-                ok = bool(res)
-                reason = ""
+                if not ok:
+                    problems.append(reason or f"{it.drug.name} 無法領藥（原因未知）")
 
-            if not ok:
-                problems.append(reason or f"{it.drug.name} 無法領藥（原因未知）")
+            rx_rows.append({
+                "rx": rx,
+                "can_dispense": (len(problems) == 0),
+                "problems": problems,
+            })
+        return rx_rows
 
-        rx_rows.append({
-            "rx": rx,
-            "can_dispense": (len(problems) == 0),
-            "problems": problems,
-        })
+    # 面板片段有快取時模板不會碰到 rx_rows，處方 / 批次都不用查
+    rx_rows = SimpleLazyObject(build_rows)
 
     return render(request, "prescriptions/pharmacy_panel.html", {
         "today": today,
@@ -92,6 +137,43 @@ def add_prescription_log(prescription, action, message="", user=None):
     )
 
 
+def screen_items(patient, items):
+    # 過敏 / 同成分重複篩檢；藥品在 formset 驗證時已經查出來了，這裡不用再查
+    drugs = [
+        f.cleaned_data.get("drug")
+        for f in items.forms
+        if f.cleaned_data and not f.cleaned_data.get("DELETE")
+    ]
+    return screen(patient, drugs)
+
+
+def screening_acknowledged(request, alerts):
+    # 勾選要跟當下重算的警示指紋對得上，確認的才是這次畫面上顯示的那組警示
+    if not alerts:
+        return True
+    return bool(request.POST.get("screening_ack")) and request.POST.get("screening_digest") == alerts_digest(alerts)
+
+
+def screening_note(message, alerts):
+    # PrescriptionLog.message 只有 200 字，這裡只放摘要，完整警示寫進 audit log
+    if not alerts:
+        return message
+    return f"{message}（已確認 {len(alerts)} 項用藥警示）"[:200]
+
+
+def log_screening_ack(prescription, alerts, user):
+    if not alerts:
+        return
+    PrescriptionAuditLog.objects.create(
+        prescription=prescription,
+        action="UPDATE",
+        performed_by=user,
+        detail="醫師確認用藥警示後開立：\n" + "\n".join(
+            f"[{'過敏' if a.is_allergy else '重複'}] {a.message}" for a in alerts
+        ),
+    )
+
+
 @group_required("PHARMACY")
 @transaction.atomic
 def dispense(request, pk):
@@ -138,12 +220,7 @@ def dispense(request, pk):
                 messages.error(request, "無法完成領藥 ：\n" + "\n".join(msg_lines))
                 return redirect("prescriptions:pharmacy_panel")
 
-            for item in items:
-                use_drug_from_prescription_item(
-                    item,
-                    prescription=prescription,
-                    operator=request.user,
-                )
+            dispensing.deduct_prescription_stock(prescription, items, request.user)
 
             prescription.pharmacy_status = Prescription.PHARMACY_DONE
             prescription.dispensed_at = timezone.now()
@@ -168,6 +245,7 @@ def dispense(request, pk):
                 detail="藥局完成領藥並扣庫存",
             )
 
+            metrics.inc(metrics.PRESCRIPTIONS_DISPENSED)
             messages.success(request, f"處方 #{prescription.id} 已完成領藥 ！")
             return redirect("prescriptions:pharmacy_panel")
 
@@ -207,6 +285,29 @@ def pharmacy_review_list(request):
     return render(request, "prescriptions/pharmacy_review_list.html", context)
 
 
+@require_POST
+@group_required("PHARMACY")
+def pharmacy_review_bulk(request):
+    action = request.POST.get("action")
+    ids = [pk for pk in request.POST.getlist("prescription_ids") if pk.isdigit()]
+
+    if action not in (ACTION_APPROVE, ACTION_REJECT):
+        messages.error(request, "未知的審核動作 ，請再試一次。")
+        return redirect("prescriptions:pharmacy_review_list")
+    if not ids:
+        messages.warning(request, "請先勾選要審核的處方 。")
+        return redirect("prescriptions:pharmacy_review_list")
+
+    results = review_prescriptions(ids, action, request.user, note=request.POST.get("verify_note"))
+
+    context = {
+        "results": results,
+        "action": action,
+        "ok_count": sum(1 for r in results if r.ok),
+    }
+    return render(request, "prescriptions/pharmacy_review_result.html", context)
+
+
 @group_required("PHARMACY")
 @transaction.atomic
 def pharmacy_review_detail(request, pk):
@@ -238,6 +339,10 @@ def pharmacy_review_detail(request, pk):
                 "verify_note",
             ])
 
+            failed = reservations.reserve_prescriptions(
+                [prescription], request.user, min_valid_days=dispensing.MIN_VALID_DAYS,
+            )
+
             msg = "藥師審核通過"
             if note:
                 msg += f"（備註：{note}）"
@@ -256,6 +361,8 @@ def pharmacy_review_detail(request, pk):
             )
 
             messages.success(request, f"處方 #{prescription.id} 已通過審核 ！")
+            if failed:
+                messages.warning(request, f"庫存未保留：{failed[prescription.pk]}（領藥時再現場配批次）")
             return redirect("prescriptions:pharmacy_review_list")
 
         elif action == "reject":
@@ -269,6 +376,7 @@ def pharmacy_review_detail(request, pk):
                 "verified_at",
                 "verify_note",
             ])
+            reservations.release_prescriptions([prescription.pk])
 
             add_prescription_log(
                 prescription,
@@ -348,7 +456,11 @@ def edit_for_ticket(request, ticket_id):
         print("=== [DEBUG] items.errors:", items.errors)
         print("=== [DEBUG] items.non_form_errors():", items.non_form_errors())
 
-        if form.is_valid() and items.is_valid():
+        alerts = screen_items(ticket.patient, items) if form.is_valid() and items.is_valid() else []
+
+        if not screening_acknowledged(request, alerts):
+            messages.warning(request, "用藥篩檢有警示，請確認後再儲存。")
+        elif form.is_valid() and items.is_valid():
             prescription = form.save(commit=False)
             prescription.patient = ticket.patient
             prescription.doctor = ticket.doctor
@@ -364,13 +476,16 @@ def edit_for_ticket(request, ticket_id):
 
             items.instance = prescription
             items.save()
+            # 回到待審核：之前審核時保留的庫存放掉，重新審核時再保留
+            reservations.release_prescriptions([prescription.pk])
 
             add_prescription_log(
                 prescription,
                 PrescriptionLog.ACTION_UPDATE,
-                "醫師儲存處方內容",
+                screening_note("醫師儲存處方內容", alerts),
                 user=request.user,
             )
+            log_screening_ack(prescription, alerts, request.user)
 
             print("=== [DEBUG] 處方已成功儲存 ，準備 redirect ===")
             messages.success(request, "處方已儲存 ！")
@@ -382,6 +497,7 @@ def edit_for_ticket(request, ticket_id):
     else:
         form = PrescriptionForm(instance=prescription)
         items = PrescriptionItemFormSet(instance=prescription)
+        alerts = []
 
     context = {
         "ticket": ticket,
@@ -389,6 +505,8 @@ def edit_for_ticket(request, ticket_id):
         "form": form,
         "items": items,
         "patient": ticket.patient,
+        "screening_alerts": alerts,
+        "screening_digest": alerts_digest(alerts),
     }
     return render(request, "prescriptions/prescription_form.html", context)
 
@@ -407,7 +525,11 @@ def edit_prescription(request, pk):
         form = PrescriptionForm(request.POST, instance=prescription)
         items = PrescriptionItemFormSet(request.POST, instance=prescription)
 
-        if form.is_valid() and items.is_valid():
+        alerts = screen_items(prescription.patient, items) if form.is_valid() and items.is_valid() else []
+
+        if not screening_acknowledged(request, alerts):
+            messages.warning(request, "用藥篩檢有警示，請確認後再儲存。")
+        elif form.is_valid() and items.is_valid():
             prescription_obj = form.save(commit=False)
 
             prescription_obj.status = Prescription.STATUS_FINAL
@@ -419,19 +541,22 @@ def edit_prescription(request, pk):
             prescription_obj.save()
             items.instance = prescription_obj
             items.save()
+            reservations.release_prescriptions([prescription_obj.pk])
 
             add_prescription_log(
                 prescription_obj,
                 PrescriptionLog.ACTION_UPDATE,
-                "醫師修改處方內容",
+                screening_note("醫師修改處方內容", alerts),
                 user=request.user,
             )
+            log_screening_ack(prescription_obj, alerts, request.user)
 
             messages.success(request, "處方已更新並送出 ！")
             return redirect("prescriptions:doctor_prescription_list")
     else:
         form = PrescriptionForm(instance=prescription)
         items = PrescriptionItemFormSet(instance=prescription)
+        alerts = []
 
     context = {
         "prescription": prescription,
@@ -439,11 +564,14 @@ def edit_prescription(request, pk):
         "items": items,
         "ticket": None, 
         "patient": prescription.patient,
+        "screening_alerts": alerts,
+        "screening_digest": alerts_digest(alerts),
     }
     return render(request, "prescriptions/prescription_form.html", context)
 
 
 @group_required("DOCTOR")
+@use_replica
 def doctor_prescription_list(request):
 
     doctor = Doctor.objects.filter(user=request.user).first()
@@ -592,10 +720,11 @@ def prescription_detail(request, pk):
 @group_required("PHARMACY")
 @transaction.atomic
 def cancel_or_return_prescription(request, pk):
-    prescription = get_object_or_404(
-        Prescription.objects.prefetch_related("items__drug"),
-        pk=pk
-    )
+    qs = Prescription.objects.prefetch_related("items__drug")
+    if request.method == "POST":
+        # 鎖住處方再看狀態：重複送出 / 兩個藥師同時按，後到的要等前一個 commit，看到已作廢就不會再退一次
+        qs = qs.select_for_update()
+    prescription = get_object_or_404(qs, pk=pk)
 
     if prescription.pharmacy_status == Prescription.PHARMACY_CANCELLED:
         messages.warning(request, "這張處方已經作廢過 。")
@@ -606,6 +735,7 @@ def cancel_or_return_prescription(request, pk):
         if prescription.pharmacy_status == Prescription.PHARMACY_PENDING:
             prescription.pharmacy_status = Prescription.PHARMACY_CANCELLED
             prescription.save()
+            reservations.release_prescriptions([prescription.pk])
 
             add_prescription_log(
                 prescription,
@@ -626,23 +756,26 @@ def cancel_or_return_prescription(request, pk):
 
         if prescription.pharmacy_status == Prescription.PHARMACY_DONE:
 
-            for item in prescription.items.all():
-                adjust_stock(
-                    drug=item.drug,
-                    change=+item.quantity,   
-                    reason="return",
-                    note=f"處方 #{prescription.id} 退藥",
-                    prescription=prescription,
-                    operator=request.user,
-                )
+            # 照當初發藥的批次加回，批次帳和藥品總量才不會對不起來
+            restored, unbatched = return_prescription_stock(prescription, operator=request.user)
 
             prescription.pharmacy_status = Prescription.PHARMACY_CANCELLED
             prescription.save()
 
+            detail = "已發藥，藥局退藥並作廢處方，庫存加回"
+            if restored:
+                detail += "（" + "、".join(
+                    f"{t.drug.name} 批號 {t.batch.batch_no or '-'} +{t.change}" for t in restored
+                ) + "）"
+            if unbatched:
+                detail += "；發藥批次已不存在、未加回：" + "、".join(
+                    f"{drug.name} {qty}" for drug, qty in unbatched.items()
+                )
+
             add_prescription_log(
                 prescription,
                 PrescriptionLog.ACTION_RETURN,
-                "已發藥，藥局退藥並作廢處方，庫存加回",
+                detail[:200],
                 user=request.user,
             )
 
@@ -650,10 +783,12 @@ def cancel_or_return_prescription(request, pk):
                 prescription=prescription,
                 action="RETURN",
                 performed_by=request.user,
-                detail="已發藥，藥局退藥並作廢處方，庫存加回",
+                detail=detail,
             )
 
             messages.success(request, f"處方 #{prescription.id} 已退藥並作廢 ！")
+            if unbatched:
+                messages.warning(request, "部分藥品找不到當初發藥的批次，未加回庫存，請手動盤點 。")
             return redirect("prescriptions:pharmacy_panel")
 
     return render(request, "prescriptions/cancel_or_return_confirm.html", {
@@ -709,13 +844,9 @@ def dispense_confirm(request, pk):
         return redirect("prescriptions:dispense_confirm", pk=pk)
 
     try:
-        for item in items:
-            use_drug_from_prescription_item(
-                item,
-                operator=request.user,
-                prescription=prescription,
-                min_valid_days=MIN_VALID_DAYS,
-            )
+        dispensing.deduct_prescription_stock(
+            prescription, items, request.user, min_valid_days=MIN_VALID_DAYS,
+        )
     except ValueError as e:
         messages.error(request, str(e))
         return redirect("prescriptions:dispense_confirm", pk=pk)
@@ -741,10 +872,47 @@ def dispense_confirm(request, pk):
         detail="藥局完成領藥（經確認頁）並扣庫存",
     )
 
+    metrics.inc(metrics.PRESCRIPTIONS_DISPENSED)
     messages.success(request, f"處方 #{prescription.id} 已完成領藥 ！")
     return redirect("prescriptions:pharmacy_panel")
 
 
+@group_required("PHARMACY")
+def pharmacy_batch_dispense(request):
+    """
+    批次領藥：GET 依勾選的處方產生合併撿藥單，POST 照單一次扣庫存。
+    POST 帶著預覽時的撿藥單指紋，庫存在中間變過就退回重新預覽，不會扣到跟單子不一樣的批次。
+    """
+    source = request.POST if request.method == "POST" else request.GET
+    ids = [pk for pk in source.getlist("prescription_ids") if pk.isdigit()]
+    if not ids:
+        messages.warning(request, "請先勾選要領藥的處方 。")
+        return redirect("prescriptions:pharmacy_panel")
+
+    if request.method == "POST":
+        try:
+            plan = dispensing.dispense_prescriptions(
+                ids, request.user, expected_signature=request.POST.get("signature", ""),
+            )
+        except ValueError as e:
+            messages.error(request, str(e))
+            query = urlencode([("prescription_ids", pk) for pk in ids])
+            return redirect(f"{reverse('prescriptions:pharmacy_batch_dispense')}?{query}")
+
+        if plan.prescriptions:
+            done = "、".join(f"#{rx.pk}" for rx in plan.prescriptions)
+            messages.success(request, f"已完成 {len(plan.prescriptions)} 張處方的批次領藥（{done}）！")
+        for s in plan.skipped:
+            messages.warning(request, f"處方 #{s.prescription_id} 未領藥：{s.reason}")
+        return redirect("prescriptions:pharmacy_panel")
+
+    plan = dispensing.plan_dispense(ids)
+    return render(request, "prescriptions/pharmacy_batch_dispense.html", {
+        "plan": plan,
+        "min_valid_days": dispensing.MIN_VALID_DAYS,
+    })
+
+
 @login_required
 @group_required("PHARMACY")    
 def prescription_print(request, pk):
@@ -0,0 +1,61 @@
+"""
+前台頁面用的快取讀取：匿名流量最大的頁面每次都在查同樣幾張幾乎不變的表。
+資料異動時由 public.signals 清掉對應的 key。
+"""
+
+from django.core.cache import cache
+from django.utils import timezone
+
+from doctors.models import Doctor
+
+from .models import Announcement, ClinicProfile
+
+PROFILE_KEY = "public:clinic_profile"
+DEPARTMENTS_KEY = "public:departments"
+DOCTORS_KEY = "public:doctors"
+ANNOUNCEMENTS_KEY = "public:announcements"
+
+DOCTOR_KEYS = (DEPARTMENTS_KEY, DOCTORS_KEY)
+
+
+def get_clinic_profile():
+    return cache.get_or_set(PROFILE_KEY, lambda: ClinicProfile.objects.first())
+
+
+def get_departments():
+    def load():
+        dept_qs = (
+            Doctor.objects
+            .exclude(department__isnull=True)
+            .exclude(department__exact="")
+            .values_list("department", flat=True)
+            .distinct()
+        )
+        return sorted(set(dept_qs))
+
+    return cache.get_or_set(DEPARTMENTS_KEY, load)
+
+
+def get_doctors(department=""):
+    doctors = cache.get_or_set(DOCTORS_KEY, lambda: list(Doctor.objects.all().order_by("id")))
+    if department:
+        return [d for d in doctors if d.department == department]
+    return doctors
+
+
+def get_active_announcements(today=None, limit=5):
+    """
+    快取存「還沒結束」的公告（含之後才開始的），取用時再依今天日期篩，
+    所以跨日不用等快取過期。
+    """
+    today = today or timezone.localdate()
+
+    def load():
+        return list(
+            Announcement.objects
+            .filter(show_on_homepage=True, end_date__gte=timezone.localdate())
+            .order_by("-is_pinned", "-start_date", "-created_at")
+        )
+
+    announcements = cache.get_or_set(ANNOUNCEMENTS_KEY, load)
+    return [a for a in announcements if a.start_date <= today <= a.end_date][:limit]
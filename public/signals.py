@@ -0,0 +1,30 @@
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from doctors.models import Doctor
+
+from . import cached
+from .models import Announcement, ClinicProfile
+
+
+def _invalidate(*keys):
+    # 當下先清一次；commit 後再清一次，避免別的 request 在 commit 前把舊資料又放回去
+    cache.delete_many(keys)
+    transaction.on_commit(lambda: cache.delete_many(keys))
+
+
+@receiver([post_save, post_delete], sender=ClinicProfile)
+def clear_clinic_profile(sender, **kwargs):
+    _invalidate(cached.PROFILE_KEY)
+
+
+@receiver([post_save, post_delete], sender=Announcement)
+def clear_announcements(sender, **kwargs):
+    _invalidate(cached.ANNOUNCEMENTS_KEY)
+
+
+@receiver([post_save, post_delete], sender=Doctor)
+def clear_doctor_directory(sender, **kwargs):
+    _invalidate(*cached.DOCTOR_KEYS)
@@ -1,3 +1,76 @@
-from django.test import TestCase
+from datetime import time, timedelta
 
-# Create your tests here.
+from django.core.cache import cache
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from doctors.models import Doctor, DoctorSchedule
+
+from .models import Announcement, ClinicProfile
+
+TEST_STORAGES = {
+    "default": {"BACKEND": "django.core.files.storage.FileSystemStorage"},
+    "staticfiles": {"BACKEND": "django.contrib.staticfiles.storage.StaticFilesStorage"},
+}
+
+
+@override_settings(PROFILING_SLOW_LOG=None, METRICS_DIR="", STORAGES=TEST_STORAGES)
+class PublicPageCacheTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        today = timezone.localdate()
+        cls.profile = ClinicProfile.objects.create(name="舊名稱", phone="02", address="台北")
+        cls.doctor = Doctor.objects.create(name="王醫師", department="內科")
+        DoctorSchedule.objects.create(
+            doctor=cls.doctor, weekday=today.weekday(), session="AM",
+            start_time=time(9, 0), end_time=time(12, 0),
+        )
+        cls.announcement = Announcement.objects.create(
+            title="今日公告", content="內容",
+            start_date=today - timedelta(days=1), end_date=today + timedelta(days=1),
+        )
+        Announcement.objects.create(
+            title="下週公告", content="內容",
+            start_date=today + timedelta(days=7), end_date=today + timedelta(days=8),
+        )
+
+    def setUp(self):
+        cache.clear()
+
+    def _queries(self, url):
+        self.client.get(url)
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(ctx), response
+
+    def test_anonymous_pages_hit_cache_only(self):
+        for name in ("public:home", "public:doctor_list", "public:register"):
+            with self.subTest(page=name):
+                count, _ = self._queries(reverse(name))
+                self.assertEqual(count, 0)
+
+        count, response = self._queries(reverse("public:doctor_list") + "?department=內科")
+        self.assertEqual(count, 0)
+        self.assertEqual([d.pk for d in response.context["doctors"]], [self.doctor.pk])
+
+    def test_only_current_announcements_are_shown(self):
+        _, response = self._queries(reverse("public:home"))
+        self.assertEqual([a.title for a in response.context["announcements"]], ["今日公告"])
+
+    def test_saves_and_deletes_invalidate(self):
+        home = reverse("public:home")
+        self._queries(home)
+
+        self.profile.name = "新名稱"
+        self.profile.save()
+        Doctor.objects.create(name="李醫師", department="外科")
+        self.announcement.delete()
+
+        response = self.client.get(home)
+        self.assertEqual(response.context["profile"].name, "新名稱")
+        self.assertEqual(response.context["homepage_departments"], ["內科", "外科"])
+        self.assertEqual(list(response.context["announcements"]), [])
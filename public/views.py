@@ -7,7 +7,8 @@ from django.db import transaction
 
 from patients.models import Patient
 
-from .models import ClinicProfile, Announcement, PublicRegistrationRequest
+from .models import PublicRegistrationRequest
+from .cached import get_active_announcements, get_clinic_profile, get_departments, get_doctors
 
 from doctors.models import Doctor, DoctorLeave, DoctorSchedule
 from datetime import timedelta
@@ -17,24 +18,13 @@ from django.db import IntegrityError
 
 def home(request):
     today = timezone.localdate()
-    profile = ClinicProfile.objects.first()
+    profile = get_clinic_profile()
 
-    announcements = (
-        Announcement.objects
-        .filter(show_on_homepage=True, start_date__lte=today, end_date__gte=today)
-        .order_by("-is_pinned", "-start_date", "-created_at")[:5]
-    )
+    announcements = get_active_announcements(today)
 
-    homepage_doctors = Doctor.objects.all().order_by("id")[:6]
+    homepage_doctors = get_doctors()[:6]
 
-    dept_qs = (
-        Doctor.objects
-        .exclude(department__isnull=True)
-        .exclude(department__exact="")
-        .values_list("department", flat=True)
-        .distinct()
-    )
-    homepage_departments = sorted(set(dept_qs))
+    homepage_departments = get_departments()
 
     return render(request, "public/home.html", {
         "profile": profile,
@@ -47,18 +37,11 @@ def home(request):
 
 @require_http_methods(["GET", "POST"])
 def register(request):
-    profile = ClinicProfile.objects.first()
+    profile = get_clinic_profile()
     today = timezone.localdate()
     max_date = today + timedelta(days=30)
 
-    dept_qs = (
-        Doctor.objects
-        .exclude(department__isnull=True)
-        .exclude(department__exact="")
-        .values_list("department", flat=True)
-        .distinct()
-    )
-    departments = sorted(set(dept_qs))
+    departments = get_departments()
 
     selected_department = (request.POST.get("department") if request.method == "POST" else request.GET.get("department"))
     selected_department = (selected_department or "").strip()
@@ -69,9 +52,7 @@ def register(request):
     selected_date_str = (request.POST.get("date") if request.method == "POST" else request.GET.get("date"))
     selected_date_str = (selected_date_str or "").strip()
 
-    doctors_qs = Doctor.objects.all().order_by("id")
-    if selected_department:
-        doctors_qs = doctors_qs.filter(department=selected_department)
+    doctors_qs = get_doctors(selected_department)
 
     selected_date = None
     if selected_date_str:
@@ -363,8 +344,8 @@ def register(request):
 
 
 def register_success(request, pk):
-    profile = ClinicProfile.objects.first()
-    req = get_object_or_404(PublicRegistrationRequest, pk=pk)
+    profile = get_clinic_profile()
+    req = get_object_or_404(PublicRegistrationRequest.objects.select_related("doctor"), pk=pk)
 
     period_label = "上午" if req.period == "AM" else "下午"
 
@@ -375,22 +356,13 @@ def register_success(request, pk):
     })
 
 def doctor_list(request):
-    profile = ClinicProfile.objects.first()
+    profile = get_clinic_profile()
 
-    dept_qs = (
-        Doctor.objects
-        .exclude(department__isnull=True)
-        .exclude(department__exact="")
-        .values_list("department", flat=True)
-        .distinct()
-    )
-    departments = sorted(set(dept_qs))
+    departments = get_departments()
 
     selected_department = (request.GET.get("department") or "").strip()
 
-    doctors = Doctor.objects.all().order_by("id")
-    if selected_department:
-        doctors = doctors.filter(department=selected_department)
+    doctors = get_doctors(selected_department)
 
     return render(request, "public/doctor_list.html", {
         "profile": profile,
@@ -401,7 +373,7 @@ def doctor_list(request):
 
 @require_http_methods(["GET", "POST"])
 def register_confirm(request):
-    profile = ClinicProfile.objects.first()
+    profile = get_clinic_profile()
     data = request.session.get("public_register")
     if not data:
         messages.error(request, "找不到掛號資料，請重新填寫")
@@ -0,0 +1,20 @@
+# Generated by Django 5.2.8 on 2026-10-19 06:51
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('appointments', '0005_hot_path_indexes'),
+        ('doctors', '0008_alter_doctorschedule_session'),
+        ('patients', '0005_patient_other_risk_notes'),
+        ('queues', '0002_visitticket_call_count_visitticket_is_skipped_and_more'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='visitticket',
+            index=models.Index(fields=['date', 'doctor', 'status'], name='queues_visi_date_5c34e1_idx'),
+        ),
+    ]
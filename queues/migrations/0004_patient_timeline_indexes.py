@@ -0,0 +1,20 @@
+# Generated by Django 5.2.8 on 2026-10-19 07:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('appointments', '0006_patient_timeline_indexes'),
+        ('doctors', '0008_alter_doctorschedule_session'),
+        ('patients', '0007_chart_number_sequence'),
+        ('queues', '0003_hot_path_indexes'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='visitticket',
+            index=models.Index(fields=['patient', 'date', 'id'], name='queues_visi_patient_099132_idx'),
+        ),
+    ]
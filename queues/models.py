@@ -46,6 +46,12 @@ class VisitTicket(models.Model):
 
     class Meta:
         unique_together = [("doctor", "date", "number")]
+        indexes = [
+            # board 只用 date 篩全部醫師；doctor_panel 再加 doctor / status
+            models.Index(fields=["date", "doctor", "status"]),
+            # 病人時間軸（patients.timeline）依 (date, id) 往回翻
+            models.Index(fields=["patient", "date", "id"]),
+        ]
         ordering = ["date", "doctor", "number"]
 
     def __str__(self):
@@ -1,11 +1,13 @@
 from django.http import HttpResponse, JsonResponse
 from django.shortcuts import render, get_object_or_404, redirect
 from django.utils import timezone
+from common import metrics
 from common.utils import group_required
 from .models import VisitTicket
 from doctors.models import Doctor, DoctorSchedule
 from django.db.models import F
 from django.db import transaction
+from django.utils.functional import SimpleLazyObject
 
 from django.contrib import messages
 
@@ -19,7 +21,12 @@ from prescriptions.models import Prescription
 @group_required("RECEPTION")
 def reception_panel(request):
     today = timezone.localdate()
-    tickets = VisitTicket.objects.filter(date=today).order_by("doctor__name", "number")
+    tickets = (
+        VisitTicket.objects
+        .filter(date=today)
+        .select_related("patient", "doctor")
+        .order_by("doctor__name", "number")
+    )
     return render(request, "queues/reception.html", {"tickets": tickets})
 
 
@@ -79,6 +86,7 @@ def reception_call(request):
                     next_ticket.call_count = F("call_count") + 1
                     next_ticket.called_at = timezone.now()
                     next_ticket.save(update_fields=["status", "call_count", "called_at"])
+                    metrics.inc(metrics.TICKETS_CALLED, source="reception")
                     messages.success(request, f"已叫號：第 {next_ticket.number} 號 。")
 
             elif action == "repeat":
@@ -88,6 +96,7 @@ def reception_call(request):
                     current_ticket.call_count = F("call_count") + 1
                     current_ticket.called_at = timezone.now()
                     current_ticket.save(update_fields=["call_count", "called_at"])
+                    metrics.inc(metrics.TICKETS_CALLED, source="reception")
                     messages.success(
                         request,
                         f"已重新叫號：第 {current_ticket.number} 號 。"
@@ -118,6 +127,7 @@ def reception_call(request):
                         next_ticket.save(
                             update_fields=["status", "call_count", "called_at"]
                         )
+                        metrics.inc(metrics.TICKETS_CALLED, source="reception")
                         messages.success(
                             request,
                             f"已標記過號，改叫第 {next_ticket.number} 號 。"
@@ -146,6 +156,7 @@ def reception_call(request):
                     target.called_at = timezone.now()
                     target.save(update_fields=["status", "call_count", "called_at"])
 
+                    metrics.inc(metrics.TICKETS_CALLED, source="reception")
                     messages.success(
                         request,
                         f"已叫回第 {target.number} 號 。"
@@ -215,6 +226,7 @@ def doctor_panel(request):
             next_ticket.call_count += 1
             next_ticket.save(update_fields=["status", "called_at", "call_count"])
 
+            metrics.inc(metrics.TICKETS_CALLED, source="doctor")
             messages.success(request, f"已叫號：第 {next_ticket.number} 號 。")
             return redirect("queues:doctor_panel")
 
@@ -251,6 +263,7 @@ def doctor_panel(request):
                 next_ticket.called_at = timezone.now()
                 next_ticket.call_count += 1
                 next_ticket.save(update_fields=["status", "called_at", "call_count"])
+                metrics.inc(metrics.TICKETS_CALLED, source="doctor")
                 messages.success(request, f"已過號。下一位：{next_ticket.number} 號 。")
             else:
                 messages.info(request, "已過號，目前沒有下一位 。")
@@ -267,6 +280,7 @@ def doctor_panel(request):
             ticket.called_at = timezone.now()
             ticket.save(update_fields=["status", "call_count", "called_at"])
 
+            metrics.inc(metrics.TICKETS_CALLED, source="doctor")
             messages.success(request, f"已重新叫號：第 {ticket.number} 號 。")
             return redirect("queues:doctor_panel")
 
@@ -313,40 +327,44 @@ def board(request):
 
     doctor_id = request.GET.get("doctor")
     selected_doctor = None
-
-    tickets_today = (
-        VisitTicket.objects
-        .filter(date=today)
-        .select_related("doctor", "patient")
-    )
-
     if doctor_id:
         selected_doctor = get_object_or_404(Doctor, pk=doctor_id, is_active=True)
-        tickets_today = tickets_today.filter(doctor=selected_doctor)
-
-    tickets_today = tickets_today.order_by("doctor__name", "number")
-
-    grouped = {}
-    for t in tickets_today:
-        info = grouped.setdefault(
-            t.doctor_id,
-            {
-                "doctor": t.doctor,
-                "current": None,
-                "next": None,
-                "done": [],
-            },
+
+    def build_board():
+        tickets_today = (
+            VisitTicket.objects
+            .filter(date=today)
+            .select_related("doctor", "patient")
         )
+        if selected_doctor:
+            tickets_today = tickets_today.filter(doctor=selected_doctor)
+
+        tickets_today = tickets_today.order_by("doctor__name", "number")
+
+        grouped = {}
+        for t in tickets_today:
+            info = grouped.setdefault(
+                t.doctor_id,
+                {
+                    "doctor": t.doctor,
+                    "current": None,
+                    "next": None,
+                    "done": [],
+                },
+            )
+
+            if t.status in ("CALLING", "IN_PROGRESS") and info["current"] is None:
+                info["current"] = t
+            elif t.status == "WAITING" and info["next"] is None:
+                info["next"] = t
+            elif t.status == "DONE":
+                if len(info["done"]) < 5:
+                    info["done"].append(t)
 
-        if t.status in ("CALLING", "IN_PROGRESS") and info["current"] is None:
-            info["current"] = t
-        elif t.status == "WAITING" and info["next"] is None:
-            info["next"] = t
-        elif t.status == "DONE":
-            if len(info["done"]) < 5:
-                info["done"].append(t)
+        return list(grouped.values())
 
-    board_data = list(grouped.values())
+    # 看板片段有快取時模板不會碰到 board_data，票也就不用查
+    board_data = SimpleLazyObject(build_board)
 
     context = {
         "today": today,